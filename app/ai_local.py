@@ -1,32 +1,45 @@
-﻿from prompt_templates import SYSTEM_INSTRUCTIONS, build_user_prompt
+﻿import json
 
+from code_candidates import candidate_count, pick_best, sample_candidates
+from context_budget import plan_prompt
+from json_grammar import grammar_kwargs
+from local_completion import complete
+from model_pool import lease_model
+from prefix_cache import prime_prefix
+from prompt_templates import SYSTEM_INSTRUCTIONS, build_user_prompt
+from speculative import speculative_kwargs
 
-def generate_with_local(settings, user_payload):
+
+def generate_with_local(settings, user_payload, on_delta=None):
     if not settings.local_model_path:
         raise ValueError("Local model path is empty. Please select a .gguf model file.")
 
-    try:
-        from llama_cpp import Llama
-    except Exception as exc:
-        raise RuntimeError(
-            "llama-cpp-python is not installed. Install it to use local AI."
-        ) from exc
-
-    prompt = (
-        f"{SYSTEM_INSTRUCTIONS}\n\n"
-        f"{build_user_prompt(user_payload)}\n\n"
-        "Return ONLY JSON with keys code and tutorial."
-    )
-
-    llm = Llama(model_path=settings.local_model_path, n_ctx=4096)
-    result = llm.create_completion(
-        prompt=prompt,
-        max_tokens=settings.max_output_tokens,
-        temperature=settings.temperature,
-    )
-
-    choices = result.get("choices", [])
-    if not choices:
-        return ""
-
-    return choices[0].get("text", "")
+    def build(sections: dict) -> str:
+        return (
+            f"{SYSTEM_INSTRUCTIONS}\n\n"
+            f"{build_user_prompt(sections)}\n\n"
+            "Return ONLY JSON with keys code and tutorial."
+        )
+
+    load_kwargs = speculative_kwargs(settings)
+    prompt, plan = plan_prompt(settings, settings.local_model_path, build, user_payload, **load_kwargs)
+
+    with lease_model(settings, settings.local_model_path, n_ctx=plan.n_ctx, **load_kwargs) as llm:
+        prime_prefix(settings, llm, settings.local_model_path, prompt)
+
+        def sample(index: int, temperature: float) -> str:
+            # Only the first candidate streams; the best one replaces it at the end.
+            return complete(
+                llm,
+                prompt,
+                plan.max_tokens,
+                temperature,
+                on_delta=on_delta if settings.stream_output and index == 0 else None,
+                span_name="generation" if index == 0 else f"candidate_{index + 1}",
+                **grammar_kwargs(settings),
+            )
+
+        if candidate_count(settings) == 1:
+            return sample(0, settings.temperature)
+        candidates = sample_candidates(settings, sample)
+    return json.dumps(pick_best(candidates))
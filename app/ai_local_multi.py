@@ -1,24 +1,63 @@
 from __future__ import annotations
 
 import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
+from cancellation import GenerationCancelled, check_cancelled
+from code_candidates import candidate_count, pick_best, sample_candidates
+from context_budget import ContextPlan, plan_prompt, plan_vision_batch, plan_vision_context
+from gguf_info import clip_image_size
+from image_prep import image_data_url
+from json_grammar import grammar_kwargs
+from local_completion import complete
+from model_output import parse_json_object, parse_model_output
+from model_pool import lease_model
+from prefix_cache import prime_prefix
 from prompt_templates import SYSTEM_INSTRUCTIONS, build_user_prompt
-
-
-def _require_llama_cpp():
-    try:
-        from llama_cpp import Llama  # type: ignore
-    except Exception as exc:  # pragma: no cover - runtime import error path
-        raise RuntimeError(
-            "llama-cpp-python is not installed. Install it to use local AI."
-        ) from exc
-    return Llama
-
-
-def _load_text_model(model_path: str):
-    Llama = _require_llama_cpp()
-    return Llama(model_path=model_path, n_ctx=4096)
+from speculative import speculative_kwargs
+from tracing import record_span, span
+from vision_cache import lookup_summary, store_summary, summary_key
+
+IMAGE_ANALYSIS_PROMPT = (
+    "Describe the LEGO robotics scene in this photo. "
+    "Focus on missions, field elements, robot configuration, and sensors."
+)
+IMAGE_BATCH_PROMPT = (
+    "Describe the LEGO robotics scene in each of the {count} numbered photos below. "
+    "Focus on missions, field elements, robot configuration, and sensors. "
+    'Return ONLY JSON: {{"photos": [{{"photo": <number>, "summary": "<description>"}}]}} '
+    "with one entry per photo, in order."
+)
+IMAGE_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "photos": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"photo": {"type": "integer"}, "summary": {"type": "string"}},
+                "required": ["photo", "summary"],
+            },
+        }
+    },
+    "required": ["photos"],
+}
+
+
+CANCEL_POLL_S = 0.1
+
+_EXECUTORS: dict[str, tuple[int, ProcessPoolExecutor]] = {}
+_EXECUTORS_LOCK = threading.Lock()
+_LAST_RUN = threading.local()
+
+
+def _load_text_model(settings, model_path: str, **load_kwargs):
+    return lease_model(settings, model_path, **load_kwargs)
 
 
 def _guess_mmproj_path(model_path: str) -> str | None:
@@ -38,22 +77,26 @@ def _guess_mmproj_path(model_path: str) -> str | None:
     return None
 
 
-def _analyze_images_with_local(settings, image_paths: list[str]) -> str:
+def _cached_summaries(settings, image_paths: list[str]) -> dict[str, str]:
+    summaries = {}
+    if settings.bypass_response_cache:
+        return summaries
+    for path in image_paths:
+        for prompt in _summary_prompts(settings):
+            cached = lookup_summary(summary_key(path, settings.local_image_model_path, prompt))
+            if cached is not None:
+                summaries[path] = cached
+                break
+    return summaries
+
+
+def _image_summaries(settings, image_paths: list[str], **load_kwargs) -> list[tuple[str, str]]:
     if not image_paths:
-        return ""
+        return []
 
     if not settings.local_image_model_path:
-        return ""
-
-    try:
-        from llama_cpp.llava_cpp import Llava15ChatHandler  # type: ignore
-    except Exception as exc:
-        raise RuntimeError(
-            "Image analysis requires llama-cpp-python built with vision support "
-            "(LLaVA-style). Install/upgrade it or use OpenAI for images."
-        ) from exc
+        return []
 
-    Llama = _require_llama_cpp()
     mmproj_path = _guess_mmproj_path(settings.local_image_model_path)
     if not mmproj_path:
         raise RuntimeError(
@@ -61,113 +104,493 @@ def _analyze_images_with_local(settings, image_paths: list[str]) -> str:
             "Place a .mmproj(.gguf) next to the image model."
         )
 
-    chat_handler = Llava15ChatHandler(clip_model_path=mmproj_path)
-    llm = Llama(model_path=settings.local_image_model_path, chat_handler=chat_handler, n_ctx=4096)
+    # Only photos without a cached summary for this model and prompt are sent
+    # through the vision model; unchanged photos are answered from disk.
+    summaries = _cached_summaries(settings, image_paths)
+    pending = [path for path in image_paths if path not in summaries]
 
-    summaries = []
-    for path in image_paths:
-        prompt = (
-            "Describe the LEGO robotics scene in this photo. "
-            "Focus on missions, field elements, robot configuration, and sensors."
+    with span(
+        "image_analysis", images=len(image_paths), cached=len(image_paths) - len(pending)
+    ) as current:
+        if pending:
+            started = time.perf_counter()
+            _describe_images(settings, mmproj_path, pending, summaries, load_kwargs)
+            current.set(mode=settings.image_analysis_mode, **_throughput(len(pending), started))
+
+    return [(path, summaries.get(path, "")) for path in image_paths]
+
+
+def _summary_prompts(settings) -> tuple[str, ...]:
+    # Summaries are cached under the prompt that produced them. Batched mode
+    # also describes single photos with IMAGE_ANALYSIS_PROMPT, so it accepts
+    # both; per-image mode never reuses a batched summary.
+    if settings.image_analysis_mode == "batched":
+        return (IMAGE_BATCH_PROMPT, IMAGE_ANALYSIS_PROMPT)
+    return (IMAGE_ANALYSIS_PROMPT,)
+
+
+def _throughput(images: int, started: float) -> dict:
+    elapsed = time.perf_counter() - started
+    return {
+        "analyzed": images,
+        "images_per_s": round(images / elapsed, 3) if elapsed > 0 else 0.0,
+        "s_per_image": round(elapsed / images, 3) if images else 0.0,
+    }
+
+
+def _vision_image_url(settings, path: str, native_size: int) -> str:
+    # Downscaled to the projector's input size here, so the vision encoder
+    # never decodes and resizes a full-resolution photo.
+    if native_size:
+        try:
+            return image_data_url(path, quality=settings.image_quality, max_side=native_size)
+        except Exception:
+            pass
+    return Path(path).absolute().as_uri()
+
+
+def _chat_text(response) -> str:
+    if response and isinstance(response, dict):
+        choices = response.get("choices", [])
+        if choices:
+            return choices[0].get("message", {}).get("content", "") or ""
+    return ""
+
+
+def _batch_summaries(text: str, count: int) -> list[str]:
+    # One summary per photo of the batch; "" where the reply has none.
+    data = parse_json_object(text)
+    entries = data.get("photos") if isinstance(data, dict) else data
+    summaries = [""] * count
+    if not isinstance(entries, list):
+        return summaries
+    unnumbered = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get("summary"), str):
+            continue
+        number = entry.get("photo")
+        if isinstance(number, int) and 1 <= number <= count and not summaries[number - 1]:
+            summaries[number - 1] = entry["summary"].strip()
+        else:
+            unnumbered.append(entry["summary"].strip())
+    for index in range(count):
+        if not summaries[index] and unnumbered:
+            summaries[index] = unnumbered.pop(0)
+    return summaries
+
+
+def _describe_batches(
+    settings, llm, plan: ContextPlan, image_paths: list[str], batch_size: int, native_size: int
+) -> dict[str, str]:
+    # Several photos per chat turn: the instruction is evaluated once per
+    # batch instead of once per photo.
+    format_kwargs = {}
+    if settings.json_grammar:
+        format_kwargs["response_format"] = {"type": "json_object", "schema": IMAGE_BATCH_SCHEMA}
+    summaries = {}
+    for start in range(0, len(image_paths), batch_size):
+        check_cancelled()
+        batch = image_paths[start : start + batch_size]
+        content = [{"type": "text", "text": IMAGE_BATCH_PROMPT.format(count=len(batch))}]
+        for number, path in enumerate(batch, start=1):
+            content.append({"type": "text", "text": f"Photo {number}:"})
+            content.append(
+                {"type": "image_url", "image_url": {"url": _vision_image_url(settings, path, native_size)}}
+            )
+        with span("image_batch", images=len(batch)) as current:
+            started = time.perf_counter()
+            response = llm.create_chat_completion(
+                messages=[{"role": "user", "content": content}],
+                max_tokens=plan.max_tokens,
+                **format_kwargs,
+            )
+            texts = _batch_summaries(_chat_text(response), len(batch))
+            current.set(parsed=sum(bool(text) for text in texts), **_throughput(len(batch), started))
+        summaries.update((path, text) for path, text in zip(batch, texts) if text)
+    return summaries
+
+
+def _describe_images(
+    settings, mmproj_path: str, image_paths: list[str], summaries: dict, load_kwargs: dict
+) -> None:
+    model_path = settings.local_image_model_path
+    batch_size = 1
+    if settings.image_analysis_mode == "batched" and len(image_paths) > 1:
+        batch_size, plan = plan_vision_batch(
+            settings,
+            model_path,
+            mmproj_path,
+            min(len(image_paths), max(1, settings.image_batch_size)),
+            **load_kwargs,
         )
-        image_url = Path(path).absolute().as_uri()
-        response = llm.create_chat_completion(
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": image_url}},
+    if batch_size == 1:
+        plan = plan_vision_context(settings, model_path, mmproj_path, **load_kwargs)
+    native_size = clip_image_size(mmproj_path)
+    with lease_model(
+        settings,
+        model_path,
+        n_ctx=plan.n_ctx,
+        mmproj_path=mmproj_path,
+        **load_kwargs,
+    ) as llm:
+        described = {}
+        if batch_size > 1:
+            described = _describe_batches(settings, llm, plan, image_paths, batch_size, native_size)
+        # Photos a batched reply left out are described one at a time.
+        for path in image_paths:
+            # Cached under the prompt that actually produced the summary.
+            prompt = IMAGE_BATCH_PROMPT if path in described else IMAGE_ANALYSIS_PROMPT
+            if path not in described:
+                check_cancelled()
+                response = llm.create_chat_completion(
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "text", "text": IMAGE_ANALYSIS_PROMPT},
+                                {
+                                    "type": "image_url",
+                                    "image_url": {"url": _vision_image_url(settings, path, native_size)},
+                                },
+                            ],
+                        }
                     ],
-                }
-            ]
-        )
-        content = ""
-        if response and isinstance(response, dict):
-            choices = response.get("choices", [])
-            if choices:
-                message = choices[0].get("message", {})
-                content = message.get("content", "")
-        if content:
-            summaries.append(f"{Path(path).name}: {content}")
-
-    return "\n".join(summaries)
-
-
-def _generate_text(llm, prompt: str, max_tokens: int, temperature: float) -> str:
-    result = llm.create_completion(
-        prompt=prompt,
-        max_tokens=max_tokens,
-        temperature=temperature,
+                    max_tokens=plan.max_tokens,
+                )
+                described[path] = _chat_text(response)
+            summaries[path] = described[path]
+            if described[path]:
+                store_summary(summary_key(path, model_path, prompt), path, described[path])
+
+
+def _format_image_notes(summaries: list[tuple[str, str]]) -> str:
+    return "\n".join(f"{Path(path).name}: {content}" for path, content in summaries if content)
+
+
+def _analyze_images_with_local(settings, image_paths: list[str], **load_kwargs) -> str:
+    return _format_image_notes(_image_summaries(settings, image_paths, **load_kwargs))
+
+
+def _generate_text(
+    llm,
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    on_delta=None,
+    fields=("code", "tutorial"),
+    span_name: str = "generation",
+    **completion_kwargs,
+) -> str:
+    return complete(
+        llm,
+        prompt,
+        max_tokens,
+        temperature,
+        on_delta=on_delta,
+        fields=fields,
+        span_name=span_name,
+        **completion_kwargs,
     )
-    choices = result.get("choices", [])
-    if not choices:
-        return ""
-    return choices[0].get("text", "")
 
 
-def _parse_model_output(text: str) -> dict:
-    if not text:
-        return {"code": "", "tutorial": ""}
+def _generate_field(settings, llm, prompt: str, field: str, max_tokens: int, on_delta=None) -> str:
+    def sample(index: int, temperature: float) -> str:
+        return _generate_text(
+            llm,
+            prompt,
+            max_tokens,
+            temperature,
+            on_delta=on_delta if index == 0 else None,
+            fields=(field,),
+            span_name=f"{field}_generation" if index == 0 else f"{field}_candidate_{index + 1}",
+            **grammar_kwargs(settings, (field,)),
+        )
+
+    # Best-of-N sampling only applies to the code specialist.
+    if field != "code" or candidate_count(settings) == 1:
+        return sample(0, settings.temperature)
+    return json.dumps(pick_best(sample_candidates(settings, sample)))
+
+
+def get_last_run_timings() -> dict:
+    # Per thread, so concurrent batch jobs don't read each other's timings.
+    return dict(getattr(_LAST_RUN, "timings", {}))
+
+
+def _split_threads(jobs: int) -> int:
+    return max(1, (os.cpu_count() or 1) // max(1, jobs))
+
+
+def _executor(role: str, workers: int = 1) -> ProcessPoolExecutor:
+    # Executors are kept alive between runs so each worker process keeps its
+    # own model pool warm.
+    with _EXECUTORS_LOCK:
+        current = _EXECUTORS.get(role)
+        if current and current[0] == workers:
+            return current[1]
+        if current:
+            current[1].shutdown(wait=False, cancel_futures=True)
+        executor = ProcessPoolExecutor(max_workers=workers)
+        _EXECUTORS[role] = (workers, executor)
+        return executor
 
-    cleaned = text.strip()
 
-    if cleaned.startswith("```"):
-        lines = cleaned.splitlines()
-        if lines and lines[0].startswith("```"):
-            lines = lines[1:]
-        if lines and lines[-1].strip().startswith("```"):
-            lines = lines[:-1]
-        cleaned = "\n".join(lines).strip()
+def _discard_executor(role: str) -> None:
+    with _EXECUTORS_LOCK:
+        current = _EXECUTORS.pop(role, None)
+    if current:
+        current[1].shutdown(wait=False, cancel_futures=True)
 
+
+def _kill_executor(role: str) -> None:
+    # Worker processes cannot see the cancel event, so a cancelled run stops
+    # them outright to free their cores. The next run starts fresh workers.
+    with _EXECUTORS_LOCK:
+        current = _EXECUTORS.pop(role, None)
+    if not current:
+        return
+    executor = current[1]
+    processes = list((getattr(executor, "_processes", None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def _submit(role: str, fn, *args, workers: int = 1):
     try:
-        return json.loads(cleaned)
-    except Exception:
-        pass
+        return _executor(role, workers).submit(fn, *args)
+    except BrokenProcessPool:
+        _discard_executor(role)
+        return _executor(role, workers).submit(fn, *args)
 
-    start = cleaned.find("{")
-    end = cleaned.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        try:
-            return json.loads(cleaned[start : end + 1])
-        except Exception:
-            pass
 
-    return {"code": cleaned, "tutorial": ""}
+def _result(role: str, future, *other_roles: str):
+    # Polls so a cancelled run stops waiting within CANCEL_POLL_S.
+    try:
+        while True:
+            try:
+                return future.result(timeout=CANCEL_POLL_S)
+            except FutureTimeout:
+                check_cancelled()
+    except BrokenProcessPool:
+        _discard_executor(role)
+        raise
+    except GenerationCancelled:
+        for name in (role, *other_roles):
+            _kill_executor(name)
+        raise
+
+
+def _specialist_load_kwargs(settings, field: str) -> dict:
+    # Speculative decoding only pays off on the code model, which copies
+    # port, sensor and mission names from the prompt.
+    return speculative_kwargs(settings) if field == "code" else {}
+
+
+def _timed_generate_worker(
+    settings, model_path: str, prompt: str, field: str, n_threads: int, plan: ContextPlan
+):
+    started = time.perf_counter()
+    load_kwargs = _specialist_load_kwargs(settings, field)
+    with _load_text_model(
+        settings, model_path, n_ctx=plan.n_ctx, n_threads=n_threads, **load_kwargs
+    ) as llm:
+        prime_prefix(settings, llm, model_path, prompt)
+        raw = _generate_field(settings, llm, prompt, field, plan.max_tokens)
+    return raw, time.perf_counter() - started
+
+
+def _timed_image_worker(settings, image_paths: list[str], n_threads: int):
+    started = time.perf_counter()
+    summaries = _image_summaries(settings, image_paths, n_threads=n_threads)
+    return summaries, time.perf_counter() - started
+
+
+def _analyze_images_parallel(settings, image_paths: list[str]) -> tuple[str, list[float]]:
+    by_path = _cached_summaries(settings, image_paths)
+    pending = [path for path in image_paths if path not in by_path]
+
+    futures = []
+    if pending:
+        workers = max(1, min(settings.local_parallel_image_workers, len(pending)))
+        n_threads = _split_threads(workers)
+        chunks = [pending[index::workers] for index in range(workers)]
+        futures = [
+            _submit("image", _timed_image_worker, settings, chunk, n_threads, workers=workers)
+            for chunk in chunks
+        ]
+
+    durations = []
+    for future in futures:
+        summaries, elapsed = _result("image", future)
+        durations.append(elapsed)
+        by_path.update(summaries)
+
+    # Restore the original photo order across the interleaved chunks.
+    ordered = [(path, by_path.get(path, "")) for path in image_paths]
+    return _format_image_notes(ordered), durations
+
+
+def _with_image_notes(user_payload: dict, image_notes: str) -> dict:
+    if not image_notes:
+        return user_payload
+    user_payload = dict(user_payload)
+    extra = user_payload.get("notes", "")
+    user_payload["notes"] = f"{extra}\n\nImage observations:\n{image_notes}".strip()
+    return user_payload
+
+
+def _build_specialist_prompt(sections: dict, field: str) -> str:
+    user_prompt = build_user_prompt(_with_image_notes(sections, sections.get("image_notes", "")))
+    base_prompt = f"{SYSTEM_INSTRUCTIONS}\n\n{user_prompt}\n\nReturn ONLY JSON with keys code and tutorial."
+    return (
+        f"{base_prompt}\n\n"
+        f"You are the {field} specialist. Return ONLY JSON with the single key {field}."
+    )
+
 
+def _plan_specialist(settings, model_path: str, field: str, user_payload, image_notes: str):
+    # Image observations are their own section so they are trimmed before
+    # the typed notes when the prompt does not fit the model.
+    sections = {**user_payload, "image_notes": image_notes}
+    return plan_prompt(
+        settings,
+        model_path,
+        lambda current: _build_specialist_prompt(current, field),
+        sections,
+        **_specialist_load_kwargs(settings, field),
+    )
 
-def generate_with_local_multi(settings, user_payload, image_paths: list[str]) -> str:
-    if not settings.local_code_model_path:
-        raise ValueError("Local code model path is empty.")
-    if not settings.local_tutorial_model_path:
-        raise ValueError("Local tutorial model path is empty.")
 
+def _generate_sequential(settings, user_payload, image_paths: list[str], on_delta=None):
+    started = time.perf_counter()
     image_notes = _analyze_images_with_local(settings, image_paths)
-    if image_notes:
-        user_payload = dict(user_payload)
-        extra = user_payload.get("notes", "")
-        user_payload["notes"] = f"{extra}\n\nImage observations:\n{image_notes}".strip()
+    images_s = time.perf_counter() - started
 
-    user_prompt = build_user_prompt(user_payload)
-    base_prompt = f"{SYSTEM_INSTRUCTIONS}\n\n{user_prompt}\n\nReturn ONLY JSON with keys code and tutorial."
+    if not settings.stream_output:
+        on_delta = None
 
-    code_llm = _load_text_model(settings.local_code_model_path)
-    tutorial_llm = _load_text_model(settings.local_tutorial_model_path)
+    code_started = time.perf_counter()
+    code_prompt, code_plan = _plan_specialist(
+        settings, settings.local_code_model_path, "code", user_payload, image_notes
+    )
+    with _load_text_model(
+        settings,
+        settings.local_code_model_path,
+        n_ctx=code_plan.n_ctx,
+        **_specialist_load_kwargs(settings, "code"),
+    ) as code_llm:
+        prime_prefix(settings, code_llm, settings.local_code_model_path, code_prompt)
+        code_text_raw = _generate_field(
+            settings, code_llm, code_prompt, "code", code_plan.max_tokens, on_delta
+        )
+    code_s = time.perf_counter() - code_started
 
-    code_prompt = (
-        f"{base_prompt}\n\n"
-        "You are the code specialist. Return ONLY JSON with key code and an empty tutorial."
+    tutorial_started = time.perf_counter()
+    tutorial_prompt, tutorial_plan = _plan_specialist(
+        settings, settings.local_tutorial_model_path, "tutorial", user_payload, image_notes
     )
-    tutorial_prompt = (
-        f"{base_prompt}\n\n"
-        "You are the tutorial specialist. Return ONLY JSON with key tutorial and an empty code."
+    with _load_text_model(
+        settings, settings.local_tutorial_model_path, n_ctx=tutorial_plan.n_ctx
+    ) as tutorial_llm:
+        prime_prefix(settings, tutorial_llm, settings.local_tutorial_model_path, tutorial_prompt)
+        tutorial_text_raw = _generate_field(
+            settings, tutorial_llm, tutorial_prompt, "tutorial", tutorial_plan.max_tokens, on_delta
+        )
+    tutorial_s = time.perf_counter() - tutorial_started
+
+    timings = {
+        "mode": "sequential",
+        "images_s": images_s,
+        "code_s": code_s,
+        "tutorial_s": tutorial_s,
+        "stage_sum_s": images_s + code_s + tutorial_s,
+    }
+    return code_text_raw, tutorial_text_raw, timings
+
+
+def _generate_parallel(settings, user_payload, image_paths: list[str], on_delta=None):
+    image_durations: list[float] = []
+    image_notes = ""
+    images_started = time.perf_counter()
+    if image_paths and settings.local_image_model_path:
+        image_notes, image_durations = _analyze_images_parallel(settings, image_paths)
+    images_s = time.perf_counter() - images_started
+    if image_durations:
+        record_span("image_analysis", images_s, images=len(image_paths), workers=len(image_durations))
+
+    # Planned here rather than in the workers so the sizes show up in this run's trace.
+    code_prompt, code_plan = _plan_specialist(
+        settings, settings.local_code_model_path, "code", user_payload, image_notes
+    )
+    tutorial_prompt, tutorial_plan = _plan_specialist(
+        settings, settings.local_tutorial_model_path, "tutorial", user_payload, image_notes
     )
 
-    code_text_raw = _generate_text(code_llm, code_prompt, settings.max_output_tokens, settings.temperature)
-    tutorial_text_raw = _generate_text(
-        tutorial_llm, tutorial_prompt, settings.max_output_tokens, settings.temperature
+    n_threads = _split_threads(2)
+    code_future = _submit(
+        "code",
+        _timed_generate_worker,
+        settings,
+        settings.local_code_model_path,
+        code_prompt,
+        "code",
+        n_threads,
+        code_plan,
+    )
+    tutorial_future = _submit(
+        "tutorial",
+        _timed_generate_worker,
+        settings,
+        settings.local_tutorial_model_path,
+        tutorial_prompt,
+        "tutorial",
+        n_threads,
+        tutorial_plan,
     )
 
-    code_data = _parse_model_output(code_text_raw).get("code", "")
-    tutorial_data = _parse_model_output(tutorial_text_raw).get("tutorial", "")
-    return json.dumps({"code": code_data, "tutorial": tutorial_data})
+    # Tokens cannot be streamed back from the worker processes, so each pane is
+    # filled as soon as its specialist finishes.
+    code_text_raw, code_s = _result("code", code_future, "tutorial")
+    record_span("code_generation", code_s, process="worker")
+    if on_delta is not None and settings.stream_output:
+        on_delta("code", parse_model_output(code_text_raw).get("code", ""))
+    tutorial_text_raw, tutorial_s = _result("tutorial", tutorial_future)
+    record_span("tutorial_generation", tutorial_s, process="worker")
+    if on_delta is not None and settings.stream_output:
+        on_delta("tutorial", parse_model_output(tutorial_text_raw).get("tutorial", ""))
+
+    timings = {
+        "mode": "parallel",
+        "images_s": images_s,
+        "code_s": code_s,
+        "tutorial_s": tutorial_s,
+        "stage_sum_s": sum(image_durations) + code_s + tutorial_s,
+    }
+    return code_text_raw, tutorial_text_raw, timings
+
+
+def generate_with_local_multi(settings, user_payload, image_paths: list[str], on_delta=None) -> str:
+    if not settings.local_code_model_path:
+        raise ValueError("Local code model path is empty.")
+    if not settings.local_tutorial_model_path:
+        raise ValueError("Local tutorial model path is empty.")
+
+    started = time.perf_counter()
+    if settings.local_parallel:
+        code_text_raw, tutorial_text_raw, timings = _generate_parallel(
+            settings, user_payload, image_paths, on_delta
+        )
+    else:
+        code_text_raw, tutorial_text_raw, timings = _generate_sequential(
+            settings, user_payload, image_paths, on_delta
+        )
+    timings["wall_s"] = time.perf_counter() - started
+    _LAST_RUN.timings = timings
+
+    code_data = parse_model_output(code_text_raw)
+    tutorial_data = parse_model_output(tutorial_text_raw).get("tutorial", "")
+    output = {"code": code_data.get("code", ""), "tutorial": tutorial_data}
+    if code_data.get("code_alternatives"):
+        output["code_alternatives"] = code_data["code_alternatives"]
+    return json.dumps(output)
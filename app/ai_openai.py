@@ -1,21 +1,21 @@
-﻿import base64
+﻿import asyncio
 import json
-import mimetypes
-import os
-from pathlib import Path
-
-from openai import OpenAI
-
+import time
+
+from cancellation import GenerationCancelled, check_cancelled, count_tokens, current_cancel_event
+from code_candidates import candidate_count, candidate_temperature, pick_best
+from image_prep import image_data_url
+from json_stream import stream_fields
+from model_output import parse_model_output
+from openai_client import get_client, make_async_client, with_retries
 from prompt_templates import SYSTEM_INSTRUCTIONS, build_user_prompt
+from tracing import span, token_rates
+
+CANCEL_POLL_S = 0.1
 
 
-def _data_url_for_image(path: str) -> str:
-    mime, _ = mimetypes.guess_type(path)
-    if not mime:
-        mime = "image/jpeg"
-    data = Path(path).read_bytes()
-    b64 = base64.b64encode(data).decode("utf-8")
-    return f"data:{mime};base64,{b64}"
+def _data_url_for_image(path: str, settings) -> str:
+    return image_data_url(path, settings.image_detail, settings.image_quality)
 
 
 def _extract_output_text(response) -> str:
@@ -42,27 +42,43 @@ def _extract_output_text(response) -> str:
     return str(response)
 
 
-def generate_with_openai(settings, user_payload, image_paths):
-    api_key = settings.openai_api_key or os.getenv("OPENAI_API_KEY", "")
-    if not api_key:
-        raise ValueError("OpenAI API key is missing. Set it in the app or in OPENAI_API_KEY.")
+def _usage_tokens(response) -> tuple[int, int]:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return 0, 0
+    return getattr(usage, "input_tokens", 0) or 0, getattr(usage, "output_tokens", 0) or 0
+
+
+def _stream_output_text(events, stats: dict):
+    for event in events:
+        check_cancelled()
+        event_type = getattr(event, "type", "")
+        if event_type == "response.output_text.delta":
+            if stats["first_token_s"] is None:
+                stats["first_token_s"] = time.perf_counter() - stats["started"]
+            stats["chunks"] += 1
+            count_tokens()
+            yield getattr(event, "delta", "")
+        elif event_type == "response.completed":
+            stats["usage"] = _usage_tokens(getattr(event, "response", None))
 
-    client = OpenAI(api_key=api_key)
 
+def _build_request(settings, user_payload, image_paths) -> dict:
     user_prompt = build_user_prompt(user_payload)
     content = [{"type": "input_text", "text": user_prompt}]
 
-    if settings.include_images:
-        for path in image_paths:
-            content.append(
-                {
-                    "type": "input_image",
-                    "image_url": _data_url_for_image(path),
-                    "detail": settings.image_detail,
-                }
-            )
-
-    response = client.responses.create(
+    if settings.include_images and image_paths:
+        with span("image_encoding", images=len(image_paths)):
+            for path in image_paths:
+                content.append(
+                    {
+                        "type": "input_image",
+                        "image_url": _data_url_for_image(path, settings),
+                        "detail": settings.image_detail,
+                    }
+                )
+
+    return dict(
         model=settings.openai_model,
         instructions=SYSTEM_INSTRUCTIONS,
         input=[{"role": "user", "content": content}],
@@ -70,4 +86,126 @@ def generate_with_openai(settings, user_payload, image_paths):
         max_output_tokens=settings.max_output_tokens,
     )
 
+
+def generate_with_openai(settings, user_payload, image_paths, on_delta=None):
+    request = _build_request(settings, user_payload, image_paths)
+    if candidate_count(settings) > 1:
+        # Candidates are not streamed: which one is shown is only known once
+        # all of them are scored, so on_delta is not called.
+        return _generate_candidates(settings, request)
+    return _run_request(settings, request, on_delta)
+
+
+def complete_text(settings, prompt: str, on_delta=None, fields=("code", "tutorial")) -> str:
+    # Text-only request for prompts built elsewhere, e.g. patching one artifact.
+    request = dict(
+        model=settings.openai_model,
+        instructions=SYSTEM_INSTRUCTIONS,
+        input=[{"role": "user", "content": [{"type": "input_text", "text": prompt}]}],
+        temperature=settings.temperature,
+        max_output_tokens=settings.max_output_tokens,
+    )
+    return _run_request(settings, request, on_delta, fields)
+
+
+def _run_request(settings, request: dict, on_delta=None, fields=("code", "tutorial")) -> str:
+    client = get_client(settings).with_options(max_retries=settings.openai_max_retries)
+    with span("openai_request", model=settings.openai_model) as current:
+        started = time.perf_counter()
+        # A cancellable run always streams so it can drop the connection early.
+        streaming = on_delta is not None and settings.stream_output
+        if streaming or current_cancel_event() is not None:
+            stats = {"started": started, "first_token_s": None, "chunks": 0, "usage": None}
+            events = client.responses.create(**request, stream=True)
+            try:
+                raw = stream_fields(
+                    _stream_output_text(events, stats),
+                    on_delta if streaming else (lambda field, text: None),
+                    fields,
+                )
+            finally:
+                events.close()
+            input_tokens, output_tokens = stats["usage"] or (0, stats["chunks"])
+            token_rates(
+                current,
+                input_tokens,
+                output_tokens,
+                time.perf_counter() - started,
+                stats["first_token_s"],
+            )
+            return raw
+
+        response = client.responses.create(**request)
+        token_rates(current, *_usage_tokens(response), time.perf_counter() - started)
+
     return _extract_output_text(response)
+
+
+async def _create_async(client, semaphore, settings, request: dict):
+    async with semaphore:
+        return await with_retries(
+            lambda: client.responses.create(**request), settings.openai_max_retries
+        )
+
+
+async def _sample_async(settings, request: dict, count: int) -> list:
+    # At most openai_concurrency candidates are in flight at once.
+    semaphore = asyncio.Semaphore(max(1, settings.openai_concurrency))
+    client = make_async_client(settings)
+    try:
+        return await asyncio.gather(
+            *(
+                _create_async(
+                    client,
+                    semaphore,
+                    settings,
+                    {**request, "temperature": candidate_temperature(settings, index)},
+                )
+                for index in range(count)
+            ),
+            return_exceptions=True,
+        )
+    finally:
+        await client.close()
+
+
+async def _sample_cancellable(settings, request: dict, count: int, cancel_event) -> list:
+    # Polls the cancel event while the candidates run; cancelling the task
+    # aborts the requests still in flight.
+    task = asyncio.ensure_future(_sample_async(settings, request, count))
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=CANCEL_POLL_S)
+        if done:
+            return task.result()
+        if cancel_event is not None and cancel_event.is_set():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            raise GenerationCancelled("Generation was cancelled.")
+
+
+def _generate_candidates(settings, request: dict) -> str:
+    # Best-of-N: all candidates are requested at once and the one whose code
+    # scores best is returned, with the others kept as alternatives.
+    count = candidate_count(settings)
+    with span("openai_request", model=settings.openai_model, candidates=count) as current:
+        started = time.perf_counter()
+        responses = asyncio.run(
+            _sample_cancellable(settings, request, count, current_cancel_event())
+        )
+        check_cancelled()
+        succeeded = [response for response in responses if not isinstance(response, Exception)]
+        if not succeeded:
+            raise responses[0]
+        usage = [_usage_tokens(response) for response in succeeded]
+        count_tokens(sum(tokens[1] for tokens in usage))
+        token_rates(
+            current,
+            sum(tokens[0] for tokens in usage),
+            sum(tokens[1] for tokens in usage),
+            time.perf_counter() - started,
+        )
+    candidates = [parse_model_output(_extract_output_text(response)) for response in succeeded]
+    return json.dumps(pick_best(candidates))
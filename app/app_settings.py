@@ -1,7 +1,9 @@
 ﻿import json
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 from pathlib import Path
 
+from write_behind import atomic_write_text, get_writer
+
 SETTINGS_DIR = Path.home() / ".legosupersoftware"
 SETTINGS_PATH = SETTINGS_DIR / "settings.json"
 
@@ -10,17 +12,50 @@ SETTINGS_PATH = SETTINGS_DIR / "settings.json"
 class AppSettings:
     competition: str = "WRO"
     ai_mode: str = "auto"  # auto | openai | local | local_multi
+    hedged_auto: bool = False
     openai_model: str = "gpt-5"
     openai_api_key: str = ""
+    openai_base_url: str = ""
+    openai_concurrency: int = 4
+    openai_max_retries: int = 3
     remember_api_key: bool = False
     image_detail: str = "auto"  # auto | low | high
     include_images: bool = True
+    image_quality: int = 85
+    # Send one photo per group of near-duplicates and skip blank shots.
+    dedupe_photos: bool = True
     local_model_path: str = ""
     local_code_model_path: str = ""
     local_tutorial_model_path: str = ""
     local_image_model_path: str = ""
     temperature: float = 0.2
     max_output_tokens: int = 1400
+    code_candidates: int = 1
+    # Short code-only repair requests after a failed static check; 0 disables.
+    code_repair_attempts: int = 2
+    edit_mode: bool = False
+    stream_output: bool = True
+    json_grammar: bool = True
+    speculative_mode: str = "off"  # off | prompt_lookup | draft_model
+    draft_model_path: str = ""
+    speculative_tokens: int = 10
+    local_parallel: bool = False
+    local_parallel_image_workers: int = 2
+    image_analysis_mode: str = "per_image"  # per_image | batched
+    # Most photos packed into one vision chat turn in batched mode.
+    image_batch_size: int = 4
+    prefix_cache: bool = True
+    prefix_cache_max_mb: int = 2048
+    bypass_response_cache: bool = False
+    response_cache_max_mb: int = 256
+    trace_log: bool = True
+    preload_models: bool = False
+    model_pool_ram_mb: int = 8192
+    # 0 sizes n_ctx up to the model's trained context length.
+    local_max_n_ctx: int = 0
+    workspace: str = "default"
+    # Best n_threads / n_batch / mmap / mlock per machine and model, from autotune.py.
+    cpu_profiles: dict = field(default_factory=dict)
 
 
 def load_settings() -> AppSettings:
@@ -43,11 +78,19 @@ def load_settings() -> AppSettings:
     return settings
 
 
-def save_settings(settings: AppSettings) -> None:
-    SETTINGS_DIR.mkdir(parents=True, exist_ok=True)
+def settings_data(settings: AppSettings) -> dict:
     data = asdict(settings)
 
     if not settings.remember_api_key:
         data["openai_api_key"] = ""
 
-    SETTINGS_PATH.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    return data
+
+
+def save_settings(settings: AppSettings) -> None:
+    atomic_write_text(SETTINGS_PATH, json.dumps(settings_data(settings), indent=2))
+
+
+def schedule_save_settings(settings: AppSettings) -> None:
+    # Written in the background; call get_writer().flush() before exiting.
+    get_writer().schedule(SETTINGS_PATH, settings_data(settings))
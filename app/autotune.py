@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+if __package__:
+    # Allow `python -m app.autotune` from the repo root; the app modules use flat imports.
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from app_settings import load_settings, save_settings
+from context_budget import token_counter
+from cpu_profile import machine_id, store_profile
+from model_pool import _require_llama_cpp
+from prompt_templates import SYSTEM_INSTRUCTIONS, build_user_prompt
+
+BATCH_SIZES = (128, 256, 512)
+# (use_mmap, use_mlock)
+MEMORY_OPTIONS = ((True, False), (True, True), (False, False))
+BASE_PARAMS = {"n_batch": 512, "use_mmap": True, "use_mlock": False}
+GENERATE_TOKENS = 64
+
+# A fixed mission sheet, long enough that every batch size needs several batches.
+BENCH_PAYLOAD = {
+    "competition": "WRO",
+    "tasks": "\n".join(
+        f"Mission {index}: drive to zone {index}, pick up the element with the arm, "
+        f"turn {index * 15} degrees and place it on target {index}."
+        for index in range(1, 25)
+    ),
+    "notes": "The table is slightly uneven near the start area. Black lines mark every zone.",
+    "parts": "SPIKE Prime core set, two large motors, one medium motor, color sensor, distance sensor",
+    "sensors": "Port A left drive, port B right drive, port C arm, port D color sensor, port E distance",
+    "constraints": "Robot must fit in 25x25x25 cm at the start. Two minutes per run.",
+}
+
+
+def bench_prompt() -> str:
+    return (
+        f"{SYSTEM_INSTRUCTIONS}\n\n"
+        f"{build_user_prompt(BENCH_PAYLOAD)}\n\n"
+        "Return ONLY JSON with keys code and tutorial."
+    )
+
+
+def thread_candidates() -> list[int]:
+    logical = os.cpu_count() or 1
+    return sorted({max(1, logical * share // 4) for share in (1, 2, 3, 4)})
+
+
+def _params(n_threads: int, n_batch: int, memory: tuple[bool, bool]) -> dict:
+    return {"n_threads": n_threads, "n_batch": n_batch, "use_mmap": memory[0], "use_mlock": memory[1]}
+
+
+def measure(model_path: str, prompt: str, params: dict, n_ctx: int, generate_tokens: int) -> dict:
+    # Prompt eval is the time to the first streamed token; generation is the
+    # rate of the tokens after it.
+    Llama = _require_llama_cpp()
+    started = time.perf_counter()
+    llm = Llama(model_path=model_path, n_ctx=n_ctx, verbose=False, **params)
+    load_s = time.perf_counter() - started
+    try:
+        prompt_tokens = len(llm.tokenize(prompt.encode("utf-8")))
+        started = time.perf_counter()
+        first_token_s = None
+        completion_tokens = 0
+        for chunk in llm.create_completion(
+            prompt=prompt, max_tokens=generate_tokens, temperature=0.0, stream=True
+        ):
+            if not chunk.get("choices"):
+                continue
+            if first_token_s is None:
+                first_token_s = time.perf_counter() - started
+            completion_tokens += 1
+        total_s = time.perf_counter() - started
+    finally:
+        close = getattr(llm, "close", None)
+        if callable(close):
+            close()
+    first_token_s = first_token_s or total_s
+    decode_s = total_s - first_token_s
+    return {
+        "load_s": round(load_s, 3),
+        "prompt_tokens_per_s": round(prompt_tokens / first_token_s, 2) if first_token_s else 0.0,
+        "tokens_per_s": round((completion_tokens - 1) / decode_s, 2)
+        if completion_tokens > 1 and decode_s > 0
+        else 0.0,
+        "prompt_tokens": prompt_tokens,
+    }
+
+
+def workload_s(result: dict, output_tokens: int) -> float:
+    # Estimated time for one generation: the benchmark prompt plus a full answer.
+    if not result["prompt_tokens_per_s"] or not result["tokens_per_s"]:
+        return float("inf")
+    return result["prompt_tokens"] / result["prompt_tokens_per_s"] + output_tokens / result["tokens_per_s"]
+
+
+def tune_model(
+    model_path: str, output_tokens: int, full_grid: bool = False, generate_tokens: int = GENERATE_TOKENS
+) -> tuple[dict | None, dict]:
+    # Staged search by default: threads first, then batch size with the best
+    # thread count, then mmap/mlock. --full-grid measures every combination.
+    prompt = bench_prompt()
+    n_ctx = max(2048, token_counter(model_path)(prompt) + generate_tokens + 64)
+    results: dict[tuple, dict] = {}
+
+    def run(params: dict) -> float:
+        key = tuple(sorted(params.items()))
+        if key not in results:
+            try:
+                result = measure(model_path, prompt, params, n_ctx, generate_tokens)
+            except Exception as exc:
+                result = {
+                    "error": str(exc),
+                    "prompt_tokens_per_s": 0.0,
+                    "tokens_per_s": 0.0,
+                    "prompt_tokens": 0,
+                }
+            result["workload_s"] = workload_s(result, output_tokens)
+            results[key] = result
+            _print_result(params, result)
+        return results[key]["workload_s"]
+
+    if full_grid:
+        grid = itertools.product(thread_candidates(), BATCH_SIZES, MEMORY_OPTIONS)
+        for n_threads, n_batch, memory in grid:
+            run(_params(n_threads, n_batch, memory))
+    else:
+        memory = (BASE_PARAMS["use_mmap"], BASE_PARAMS["use_mlock"])
+        n_threads = min(
+            thread_candidates(), key=lambda value: run(_params(value, BASE_PARAMS["n_batch"], memory))
+        )
+        n_batch = min(BATCH_SIZES, key=lambda value: run(_params(n_threads, value, memory)))
+        for option in MEMORY_OPTIONS:
+            run(_params(n_threads, n_batch, option))
+
+    best_key = min(results, key=lambda key: results[key]["workload_s"])
+    if results[best_key]["workload_s"] == float("inf"):
+        return None, results
+    return dict(best_key), results
+
+
+def _print_result(params: dict, result: dict) -> None:
+    shown = ", ".join(f"{key}={value}" for key, value in params.items())
+    if "error" in result:
+        print(f"  {shown}: failed ({result['error']})")
+        return
+    print(
+        f"  {shown}: prompt {result['prompt_tokens_per_s']:.1f} tok/s, "
+        f"generation {result['tokens_per_s']:.1f} tok/s, load {result['load_s']:.1f}s"
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Find the fastest n_threads, n_batch, mmap and mlock for each local model "
+        "on this machine."
+    )
+    parser.add_argument("models", nargs="*", help="GGUF files to tune (default: the configured models)")
+    parser.add_argument("--full-grid", action="store_true", help="Measure every combination")
+    parser.add_argument("--generate-tokens", type=int, default=GENERATE_TOKENS)
+    parser.add_argument("--no-save", action="store_true", help="Only print the results")
+    parser.add_argument("--json", type=Path, help="Also write every measurement to this file")
+    args = parser.parse_args(argv)
+
+    settings = load_settings()
+    models = args.models or [
+        settings.local_model_path,
+        settings.local_code_model_path,
+        settings.local_tutorial_model_path,
+    ]
+    models = list(dict.fromkeys(path for path in models if path))
+    missing = [path for path in models if not Path(path).exists()]
+    if missing:
+        print(f"Model not found: {', '.join(missing)}", file=sys.stderr)
+        return 2
+    if not models:
+        print("No local models configured. Pass .gguf paths or set them in the app.", file=sys.stderr)
+        return 1
+
+    print(f"Machine: {machine_id()}")
+    report = {}
+    failed = 0
+    for path in models:
+        print(f"{Path(path).name}:")
+        best, results = tune_model(
+            path, settings.max_output_tokens, args.full_grid, max(2, args.generate_tokens)
+        )
+        report[path] = {
+            "best": best,
+            "runs": [{**dict(key), **result} for key, result in results.items()],
+        }
+        if best is None:
+            failed += 1
+            print("  no configuration ran")
+            continue
+        measured = results[tuple(sorted(best.items()))]
+        print(f"  best: {', '.join(f'{key}={value}' for key, value in best.items())}")
+        store_profile(
+            settings,
+            path,
+            best,
+            {
+                "prompt_tokens_per_s": measured["prompt_tokens_per_s"],
+                "tokens_per_s": measured["tokens_per_s"],
+                "tuned_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            },
+        )
+
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+    if not args.no_save:
+        save_settings(settings)
+        print("Saved profiles to the app settings.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import importlib.util
+import os
+import struct
+import sys
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+GGUF_MAGIC = b"GGUF"
+GGUF_VERSIONS = (1, 2, 3)
+
+_CACHE: dict[tuple, dict[str, "BackendStatus"]] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+@dataclass(frozen=True)
+class BackendStatus:
+    available: bool
+    reason: str = ""
+
+
+def check_gguf(path: str) -> str:
+    # Returns "" for a readable GGUF file, otherwise why it cannot be used.
+    if not path:
+        return "no model selected"
+    file_path = Path(path)
+    if not file_path.is_file():
+        return f"{file_path.name} not found"
+    try:
+        with file_path.open("rb") as handle:
+            header = handle.read(8)
+    except OSError as exc:
+        return f"{file_path.name} is not readable ({exc.strerror})"
+    if len(header) < 8 or header[:4] != GGUF_MAGIC:
+        return f"{file_path.name} is not a GGUF file"
+    (version,) = struct.unpack("<I", header[4:])
+    if version not in GGUF_VERSIONS:
+        return f"{file_path.name} has unsupported GGUF version {version}"
+    return ""
+
+
+def _signature(path: str) -> tuple:
+    try:
+        stat = Path(path).stat()
+    except (OSError, ValueError):
+        return (path,)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+def _mmproj_path(model_path: str) -> str | None:
+    from ai_local_multi import _guess_mmproj_path
+
+    return _guess_mmproj_path(model_path)
+
+
+def _importable(name: str) -> bool:
+    # find_spec checks for the package without paying for its import.
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ValueError:
+        return name in sys.modules
+
+
+def _labelled(label: str, reason: str) -> str:
+    return f"{label}: {reason}" if reason else ""
+
+
+def _probe(settings) -> dict[str, BackendStatus]:
+    llama_missing = "" if _importable("llama_cpp") else "llama-cpp-python is not installed"
+
+    def local_status(*reasons: str) -> BackendStatus:
+        problems = [reason for reason in (llama_missing, *reasons) if reason]
+        return BackendStatus(not problems, "; ".join(problems))
+
+    draft = ""
+    if settings.speculative_mode == "draft_model":
+        draft = _labelled("draft model", check_gguf(settings.draft_model_path))
+
+    statuses = {
+        "local": local_status(check_gguf(settings.local_model_path), draft),
+        "local_multi": local_status(
+            _labelled("code model", check_gguf(settings.local_code_model_path)),
+            _labelled("tutorial model", check_gguf(settings.local_tutorial_model_path)),
+            draft,
+        ),
+    }
+
+    # Photos are only analysed locally when an image model is set.
+    vision = ""
+    if settings.local_image_model_path:
+        vision = check_gguf(settings.local_image_model_path)
+        if not vision:
+            mmproj = _mmproj_path(settings.local_image_model_path)
+            vision = check_gguf(mmproj) if mmproj else "no mmproj file next to it"
+    statuses["local_vision"] = local_status(_labelled("image model", vision))
+
+    openai_reasons = []
+    if not _importable("openai"):
+        openai_reasons.append("openai package is not installed")
+    if not (settings.openai_api_key or os.getenv("OPENAI_API_KEY", "")):
+        openai_reasons.append("no API key")
+    statuses["openai"] = BackendStatus(not openai_reasons, "; ".join(openai_reasons))
+    return statuses
+
+
+def probe_backends(settings) -> dict[str, BackendStatus]:
+    # Cached until a relevant setting or one of the model files changes.
+    paths = (
+        settings.local_model_path,
+        settings.local_code_model_path,
+        settings.local_tutorial_model_path,
+        settings.local_image_model_path,
+        settings.draft_model_path if settings.speculative_mode == "draft_model" else "",
+    )
+    mmproj = _mmproj_path(settings.local_image_model_path) if settings.local_image_model_path else None
+    key = (
+        tuple(_signature(path) if path else None for path in (*paths, mmproj)),
+        bool(settings.openai_api_key or os.getenv("OPENAI_API_KEY", "")),
+    )
+    with _CACHE_LOCK:
+        cached = _CACHE.get(key)
+    if cached is not None:
+        return cached
+    statuses = _probe(settings)
+    with _CACHE_LOCK:
+        _CACHE.clear()
+        _CACHE[key] = statuses
+    return statuses
+
+
+def available_backends(settings, image_paths: list[str]) -> tuple[list[str], list[str]]:
+    # Auto-mode candidates in preference order, plus why the others were skipped.
+    statuses = probe_backends(settings)
+    candidates, skipped = [], []
+    for backend in ("local_multi", "local", "openai"):
+        status = statuses[backend]
+        if backend == "local_multi" and status.available and image_paths:
+            status = statuses["local_vision"]
+        if status.available:
+            candidates.append(backend)
+        else:
+            skipped.append(f"{backend}: {status.reason}")
+    return candidates, skipped
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import replace
+from pathlib import Path
+
+if __package__:
+    # Allow `python -m app.batch` from the repo root; the app modules use flat imports.
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from app_settings import AppSettings, load_settings
+from generation import generate
+
+PAYLOAD_KEYS = ("competition", "task_title", "tasks", "notes", "parts", "sensors", "constraints")
+
+
+def _safe_name(name: str) -> str:
+    cleaned = re.sub(r"[^A-Za-z0-9._-]+", "_", name).strip("._")
+    return cleaned or "job"
+
+
+def _job_from_record(record: dict, default_name: str, base_dir: Path, settings: AppSettings) -> dict:
+    payload = {key: str(record.get(key, "")) for key in PAYLOAD_KEYS}
+    payload["competition"] = payload["competition"] or settings.competition
+    images = []
+    for image in record.get("images", []) or []:
+        image_path = Path(image)
+        if not image_path.is_absolute():
+            image_path = base_dir / image_path
+        images.append(str(image_path))
+    name = record.get("name") or record.get("task_title") or default_name
+    return {"name": _safe_name(str(name)), "payload": payload, "images": images}
+
+
+def load_jobs(source: Path, settings: AppSettings) -> list[dict]:
+    jobs = []
+    if source.is_dir():
+        for path in sorted(source.glob("*.json")):
+            record = json.loads(path.read_text(encoding="utf-8"))
+            jobs.append(_job_from_record(record, path.stem, path.parent, settings))
+    else:
+        with source.open(encoding="utf-8") as handle:
+            for index, line in enumerate(handle, start=1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                jobs.append(_job_from_record(record, f"job{index:03d}", source.parent, settings))
+
+    # Keep output folders unique when several payloads share a title.
+    seen: dict[str, int] = {}
+    for job in jobs:
+        count = seen.get(job["name"], 0)
+        seen[job["name"]] = count + 1
+        if count:
+            job["name"] = f"{job['name']}_{count + 1}"
+    return jobs
+
+
+def _write_outputs(job: dict, data: dict, output_dir: Path) -> None:
+    job_dir = output_dir / job["name"]
+    job_dir.mkdir(parents=True, exist_ok=True)
+    (job_dir / "code.py").write_text(data.get("code", ""), encoding="utf-8")
+    (job_dir / "tutorial.md").write_text(data.get("tutorial", ""), encoding="utf-8")
+
+
+def run_job(settings: AppSettings, job: dict, output_dir: Path) -> dict:
+    started = time.perf_counter()
+    summary = {"name": job["name"], "images": len(job["images"])}
+    try:
+        result = generate(settings, job["payload"], job["images"])
+    except Exception as exc:
+        summary.update(
+            status="failed",
+            error=str(exc),
+            traceback=traceback.format_exc(),
+            elapsed_s=round(time.perf_counter() - started, 3),
+        )
+        return summary
+
+    _write_outputs(job, result.data, output_dir)
+    summary.update(
+        status="ok",
+        backend=result.backend,
+        cache_hit=result.cache_hit,
+        elapsed_s=round(time.perf_counter() - started, 3),
+        timings=result.timings,
+    )
+    return summary
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Generate code and tutorials for many mission sets without the GUI."
+    )
+    parser.add_argument("source", type=Path, help="Directory of .json payloads or a .jsonl file")
+    parser.add_argument("-o", "--output", type=Path, default=Path("batch_output"))
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Concurrent jobs")
+    parser.add_argument("--mode", choices=["auto", "openai", "local", "local_multi"])
+    parser.add_argument("--settings", type=Path, help="JSON file with AppSettings overrides")
+    parser.add_argument("--bypass-cache", action="store_true")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    settings = load_settings()
+    overrides = {}
+    if args.settings:
+        overrides.update(json.loads(args.settings.read_text(encoding="utf-8")))
+    if args.mode:
+        overrides["ai_mode"] = args.mode
+    if args.bypass_cache:
+        overrides["bypass_response_cache"] = True
+    unknown = sorted(key for key in overrides if not hasattr(settings, key))
+    if unknown:
+        print(f"Unknown settings: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    settings = replace(settings, **overrides)
+
+    jobs = load_jobs(args.source, settings)
+    if not jobs:
+        print(f"No payloads found in {args.source}", file=sys.stderr)
+        return 1
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    results = []
+    # Every job goes through the same pipeline as the app: photo dedup,
+    # response cache, code check and repair, and its own trace and timing.
+    # OpenAI jobs share the pooled client and its connections.
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = [executor.submit(run_job, settings, job, args.output) for job in jobs]
+        for future in as_completed(futures):
+            summary = future.result()
+            results.append(summary)
+            print(f"[{len(results)}/{len(jobs)}] {summary['name']}: {summary['status']} "
+                  f"in {summary['elapsed_s']:.1f}s")
+
+    order = {job["name"]: index for index, job in enumerate(jobs)}
+    results.sort(key=lambda item: order[item["name"]])
+    failed = sum(1 for item in results if item["status"] != "ok")
+    report = {
+        "mode": settings.ai_mode,
+        "jobs": len(jobs),
+        "concurrency": max(1, args.jobs),
+        "failed": failed,
+        "wall_s": round(time.perf_counter() - started, 3),
+        "results": results,
+    }
+    (args.output / "summary.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Wrote {args.output / 'summary.json'} ({failed} failed)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
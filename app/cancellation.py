@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+
+_CURRENT = threading.local()
+
+
+class GenerationCancelled(RuntimeError):
+    pass
+
+
+def current_cancel_event() -> threading.Event | None:
+    return getattr(_CURRENT, "event", None)
+
+
+def current_token_listener():
+    return getattr(_CURRENT, "on_tokens", None)
+
+
+@contextmanager
+def use_cancel_event(event: threading.Event | None, on_tokens=None):
+    # Streaming loops on this thread stop at their next chunk once the event is
+    # set. on_tokens(count) hears about every generated token; without it the
+    # enclosing listener is kept.
+    previous = current_cancel_event()
+    previous_listener = current_token_listener()
+    _CURRENT.event = event
+    _CURRENT.on_tokens = on_tokens if on_tokens is not None else previous_listener
+    try:
+        yield event
+    finally:
+        _CURRENT.event = previous
+        _CURRENT.on_tokens = previous_listener
+
+
+def check_cancelled() -> None:
+    event = current_cancel_event()
+    if event is not None and event.is_set():
+        raise GenerationCancelled("Generation was cancelled.")
+
+
+def count_tokens(count: int = 1) -> None:
+    listener = current_token_listener()
+    if listener is not None:
+        listener(count)
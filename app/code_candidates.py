@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+from cancellation import check_cancelled
+from model_output import parse_model_output
+from pybricks_check import check_code
+
+MAX_CANDIDATES = 8
+
+
+def candidate_count(settings) -> int:
+    return max(1, min(MAX_CANDIDATES, int(settings.code_candidates)))
+
+
+def candidate_temperature(settings, index: int) -> float:
+    # The first sample keeps the configured temperature; later ones are
+    # warmer so they actually differ from it.
+    if index == 0:
+        return settings.temperature
+    return min(1.0, max(settings.temperature, 0.4) + 0.15 * index)
+
+
+def sample_candidates(settings, sample) -> list[dict]:
+    # sample(index, temperature) -> raw model text. Local samples run one after
+    # another on the same model, so stop at the first candidate without problems.
+    candidates = []
+    for index in range(candidate_count(settings)):
+        if index:
+            check_cancelled()
+        data = parse_model_output(sample(index, candidate_temperature(settings, index)))
+        candidates.append(data)
+        if check_code(data.get("code", "")).clean:
+            break
+    return candidates
+
+
+def pick_best(candidates: list[dict]) -> dict:
+    # Returns the candidate with the best code score; with more than one
+    # candidate, every code variant is kept under code_alternatives, best first.
+    reports = [check_code(data.get("code", "")) for data in candidates]
+    ranked = sorted(range(len(candidates)), key=lambda index: (-reports[index].score, index))
+    best = dict(candidates[ranked[0]])
+    if len(candidates) > 1:
+        best["code_alternatives"] = [
+            {
+                "code": candidates[index].get("code", ""),
+                "score": reports[index].score,
+                "problems": reports[index].problems,
+            }
+            for index in ranked
+        ]
+    return best
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from model_output import parse_model_output
+from pybricks_check import check_code
+from prompt_templates import build_repair_prompt
+from tracing import span
+
+
+def repair_code(settings, backend: str, data: dict, payload: dict) -> tuple[dict, dict]:
+    # Runs after parse_model_output. When the static check finds problems,
+    # only the program is sent back with the problem list; the tutorial is
+    # kept as it is. Returns (data, repair info); data is unchanged when the
+    # code is clean or no attempt scored better. Warnings are only reported.
+    code = data.get("code", "")
+    sensors = payload.get("sensors", "")
+    report = check_code(code, sensors)
+    attempts = max(0, int(settings.code_repair_attempts))
+    if report.clean or not code.strip() or attempts == 0:
+        return data, ({"warnings": report.warnings} if report.warnings else {})
+
+    from incremental import complete_role
+
+    best_code, best = code, report
+    used = 0
+    for attempt in range(1, attempts + 1):
+        used = attempt
+        with span("code_repair", attempt=attempt, problems=len(best.problems)) as current:
+            raw = complete_role(
+                settings,
+                backend,
+                "code",
+                lambda sections, code=best_code, problems=best.problems: build_repair_prompt(
+                    code, problems, sections.get("sensors", "")
+                ),
+                {"sensors": sensors},
+                span_name="code_repair_generation",
+            )
+            candidate = parse_model_output(raw).get("code", "")
+            candidate_report = check_code(candidate, sensors)
+            current.set(score=candidate_report.score, clean=candidate_report.clean)
+        if candidate.strip() and candidate_report.score > best.score:
+            best_code, best = candidate, candidate_report
+        if best.clean:
+            break
+
+    info = {
+        "attempts": used,
+        "found": report.problems,
+        "remaining": best.problems,
+        "warnings": best.warnings,
+    }
+    if best_code == code:
+        return data, info
+    repaired = {**data, "code": best_code}
+    if data.get("code_alternatives"):
+        repaired["code_alternatives"] = [
+            {"code": best_code, "score": best.score, "problems": best.problems},
+            *data["code_alternatives"],
+        ]
+    return repaired, info
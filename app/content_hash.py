@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from pathlib import Path
+
+_CHUNK_SIZE = 1024 * 1024
+
+_DIGESTS: dict[tuple, str] = {}
+_LOCK = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    # SHA-256 of the file bytes, memoized by (path, mtime, size) so unchanged
+    # photos are only read once per session.
+    stat = Path(path).stat()
+    key = (str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size)
+    with _LOCK:
+        digest = _DIGESTS.get(key)
+    if digest is not None:
+        return digest
+
+    hasher = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    with _LOCK:
+        _DIGESTS[key] = digest
+    return digest
+
+
+def known_digest(path: str) -> tuple[int, int, str] | None:
+    # (mtime_ns, size, digest) if this session already hashed the file as it is now.
+    try:
+        stat = Path(path).stat()
+    except OSError:
+        return None
+    with _LOCK:
+        digest = _DIGESTS.get((str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size))
+    return (stat.st_mtime_ns, stat.st_size, digest) if digest else None
+
+
+def remember_digest(path: str, mtime_ns: int, size: int, digest: str) -> None:
+    # Seeds the memo with a digest recorded earlier; it is only used while the
+    # file still has that mtime and size.
+    with _LOCK:
+        _DIGESTS[(str(Path(path).resolve()), int(mtime_ns), int(size))] = digest
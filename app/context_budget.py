@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from gguf_info import clip_image_tokens, context_length, kv_bytes_per_token
+from model_pool import _file_signature, _require_llama_cpp, get_pool, tuned_load_kwargs
+from tracing import span
+
+# n_ctx is rounded up to whole steps so small prompt changes keep hitting the
+# same pooled model and cached prompt state.
+N_CTX_STEP = 1024
+MIN_N_CTX = 2048
+# Used when the GGUF metadata cannot be read.
+FALLBACK_MAX_CTX = 4096
+CHARS_PER_TOKEN = 4
+VISION_PROMPT_TOKENS = 128
+VISION_SUMMARY_TOKENS = 512
+# Batched analysis: the shared instruction once, a label per photo and a
+# shorter summary per photo.
+VISION_BATCH_PROMPT_TOKENS = 160
+VISION_IMAGE_LABEL_TOKENS = 8
+VISION_BATCH_SUMMARY_TOKENS = 192
+
+# Prompt sections in the order they are trimmed, lowest priority first. Tasks
+# and sensors are what the program is built from, so they go last.
+TRIM_ORDER = ("image_notes", "notes", "parts", "constraints", "tasks", "sensors")
+TRIM_MARKER = " [...trimmed to fit the model context]"
+
+_TOKENIZERS: dict[tuple, tuple] = {}
+_TOKENIZERS_LOCK = threading.Lock()
+
+
+@dataclass
+class ContextPlan:
+    n_ctx: int
+    prompt_tokens: int
+    max_tokens: int
+    model_max: int
+    kv_bytes_per_token: int
+    trimmed: list[str] = field(default_factory=list)
+
+    def kv_mb(self, n_ctx: int | None = None) -> float:
+        return self.kv_bytes_per_token * (n_ctx or self.n_ctx) / (1024 * 1024)
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def token_counter(model_path: str):
+    # Counts with the model's own tokenizer, loaded vocab-only (no weights).
+    # Falls back to a character estimate when it cannot be loaded.
+    signature = _file_signature(model_path)
+    if signature is None:
+        return _estimate_tokens
+    with _TOKENIZERS_LOCK:
+        cached = _TOKENIZERS.get(signature)
+        if cached is None:
+            try:
+                Llama = _require_llama_cpp()
+                cached = (Llama(model_path=model_path, vocab_only=True, verbose=False), threading.Lock())
+            except Exception:
+                cached = (None, None)
+            _TOKENIZERS[signature] = cached
+    tokenizer, lock = cached
+    if tokenizer is None:
+        return _estimate_tokens
+
+    def count(text: str) -> int:
+        with lock:
+            return len(tokenizer.tokenize(text.encode("utf-8"), add_bos=True))
+
+    return count
+
+
+def model_context_limit(settings, model_path: str) -> int:
+    limit = context_length(model_path) or FALLBACK_MAX_CTX
+    if settings.local_max_n_ctx > 0:
+        limit = min(limit, settings.local_max_n_ctx)
+    return limit
+
+
+def _round_n_ctx(needed: int, limit: int) -> int:
+    steps = -(-needed // N_CTX_STEP)
+    return min(limit, max(MIN_N_CTX, steps * N_CTX_STEP))
+
+
+def _pick_n_ctx(
+    settings, model_path: str, needed: int, limit: int, mmproj_path: str | None, load_kwargs: dict
+) -> int:
+    # An already loaded copy with a large enough context beats loading the
+    # model again at a slightly smaller size.
+    load_kwargs = tuned_load_kwargs(settings, model_path, load_kwargs)
+    for n_ctx in get_pool().loaded_contexts(model_path, mmproj_path, **load_kwargs):
+        if needed <= n_ctx <= limit:
+            return n_ctx
+    return _round_n_ctx(needed, limit)
+
+
+def _trim_section(text: str, keep_tokens: int, section_tokens: int) -> str:
+    # Keeps the start of the section, cut at a word boundary.
+    if keep_tokens <= 0:
+        return ""
+    keep_chars = int(len(text) * keep_tokens / max(1, section_tokens))
+    cut = text[:keep_chars]
+    if " " in cut:
+        cut = cut[: cut.rfind(" ")]
+    return cut.rstrip() + TRIM_MARKER if cut.strip() else ""
+
+
+def _fit_sections(count, build, sections: dict, budget: int) -> tuple[str, int, list[str]]:
+    sections = dict(sections)
+    trimmed = []
+    prompt = build(sections)
+    tokens = count(prompt)
+    marker_tokens = count(TRIM_MARKER)
+    for name in TRIM_ORDER:
+        # A few passes per section, since the cut is estimated from its length.
+        for _ in range(3):
+            text = str(sections.get(name, "")).strip()
+            if tokens <= budget or not text:
+                break
+            section_tokens = count(text)
+            keep = section_tokens - (tokens - budget) - marker_tokens
+            sections[name] = _trim_section(text, keep, section_tokens)
+            if name not in trimmed:
+                trimmed.append(name)
+            prompt = build(sections)
+            tokens = count(prompt)
+        if tokens <= budget:
+            break
+    return prompt, tokens, trimmed
+
+
+def plan_prompt(
+    settings,
+    model_path: str,
+    build,
+    sections: dict,
+    mmproj_path: str | None = None,
+    **load_kwargs,
+) -> tuple[str, ContextPlan]:
+    # build(sections) -> prompt. The prompt is tokenized as built and n_ctx is
+    # sized to it plus the output budget; when it does not fit the model, the
+    # lowest-priority sections are cut down first (see TRIM_ORDER).
+    with span("context_plan", model=Path(model_path).name) as plan_span:
+        count = token_counter(model_path)
+        limit = model_context_limit(settings, model_path)
+        output_tokens = max(1, min(settings.max_output_tokens, limit // 2))
+        prompt, prompt_tokens, trimmed = _fit_sections(count, build, sections, limit - output_tokens)
+        if prompt_tokens + output_tokens > limit:
+            raise ValueError(
+                f"The prompt needs {prompt_tokens} tokens but {Path(model_path).name} only "
+                f"fits {limit} including the answer. Shorten the mission inputs."
+            )
+        n_ctx = _pick_n_ctx(
+            settings, model_path, prompt_tokens + output_tokens, limit, mmproj_path, load_kwargs
+        )
+        plan = ContextPlan(
+            n_ctx=n_ctx,
+            prompt_tokens=prompt_tokens,
+            max_tokens=min(settings.max_output_tokens, n_ctx - prompt_tokens),
+            model_max=limit,
+            kv_bytes_per_token=kv_bytes_per_token(model_path),
+            trimmed=trimmed,
+        )
+        plan_span.set(**plan_attrs(plan))
+    return prompt, plan
+
+
+def plan_vision_context(settings, model_path: str, mmproj_path: str, **load_kwargs) -> ContextPlan:
+    # One photo per completion: its image embedding, the short prompt and the summary.
+    with span("context_plan", model=Path(model_path).name) as plan_span:
+        limit = model_context_limit(settings, model_path)
+        image_tokens = clip_image_tokens(mmproj_path) or 576
+        prompt_tokens = image_tokens + VISION_PROMPT_TOKENS
+        needed = min(limit, prompt_tokens + VISION_SUMMARY_TOKENS)
+        n_ctx = _pick_n_ctx(settings, model_path, needed, limit, mmproj_path, load_kwargs)
+        plan = ContextPlan(
+            n_ctx=n_ctx,
+            prompt_tokens=prompt_tokens,
+            max_tokens=max(1, min(VISION_SUMMARY_TOKENS, n_ctx - prompt_tokens)),
+            model_max=limit,
+            kv_bytes_per_token=kv_bytes_per_token(model_path),
+        )
+        plan_span.set(**plan_attrs(plan))
+    return plan
+
+
+def plan_vision_batch(
+    settings, model_path: str, mmproj_path: str, count: int, **load_kwargs
+) -> tuple[int, ContextPlan]:
+    # As many photos per chat turn as the context allows, at most count.
+    with span("context_plan", model=Path(model_path).name) as plan_span:
+        limit = model_context_limit(settings, model_path)
+        image_tokens = clip_image_tokens(mmproj_path) or 576
+        per_image = image_tokens + VISION_IMAGE_LABEL_TOKENS + VISION_BATCH_SUMMARY_TOKENS
+        size = max(1, min(count, (limit - VISION_BATCH_PROMPT_TOKENS) // per_image))
+        prompt_tokens = VISION_BATCH_PROMPT_TOKENS + size * (image_tokens + VISION_IMAGE_LABEL_TOKENS)
+        needed = min(limit, prompt_tokens + size * VISION_BATCH_SUMMARY_TOKENS)
+        n_ctx = _pick_n_ctx(settings, model_path, needed, limit, mmproj_path, load_kwargs)
+        plan = ContextPlan(
+            n_ctx=n_ctx,
+            prompt_tokens=prompt_tokens,
+            max_tokens=max(1, min(size * VISION_BATCH_SUMMARY_TOKENS, n_ctx - prompt_tokens)),
+            model_max=limit,
+            kv_bytes_per_token=kv_bytes_per_token(model_path),
+        )
+        plan_span.set(batch_size=size, **plan_attrs(plan))
+    return size, plan
+
+
+def plan_attrs(plan: ContextPlan) -> dict:
+    attrs = {
+        "n_ctx": plan.n_ctx,
+        "prompt_tokens": plan.prompt_tokens,
+        "max_tokens": plan.max_tokens,
+        "model_max": plan.model_max,
+    }
+    if plan.kv_bytes_per_token:
+        # What the chosen size costs next to loading the model's full context.
+        attrs["kv_mb"] = round(plan.kv_mb(), 1)
+        attrs["kv_mb_at_max"] = round(plan.kv_mb(plan.model_max), 1)
+    if plan.trimmed:
+        attrs["trimmed"] = plan.trimmed
+    return attrs
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import os
+import platform
+from pathlib import Path
+
+# Llama load options the autotuner picks per (machine, model).
+TUNED_KEYS = ("n_threads", "n_batch", "use_mmap", "use_mlock")
+
+
+def machine_id() -> str:
+    return f"{platform.node()}|{platform.machine()}|{os.cpu_count() or 1}"
+
+
+def profile_key(model_path: str) -> str:
+    return f"{machine_id()}|{Path(model_path).resolve()}"
+
+
+def find_profile(settings, model_path: str) -> dict | None:
+    # Profiles are only used on the machine that measured them and only while
+    # the model file keeps the size it had then.
+    profile = settings.cpu_profiles.get(profile_key(model_path))
+    if not isinstance(profile, dict):
+        return None
+    try:
+        size = Path(model_path).stat().st_size
+    except OSError:
+        return None
+    if profile.get("model_size") != size:
+        return None
+    return profile
+
+
+def profile_kwargs(settings, model_path: str) -> dict:
+    if not model_path:
+        return {}
+    profile = find_profile(settings, model_path)
+    if profile is None:
+        return {}
+    return {key: profile[key] for key in TUNED_KEYS if key in profile}
+
+
+def store_profile(settings, model_path: str, params: dict, measured: dict) -> None:
+    profiles = dict(settings.cpu_profiles)
+    profiles[profile_key(model_path)] = {
+        **{key: params[key] for key in TUNED_KEYS if key in params},
+        "model_size": Path(model_path).stat().st_size,
+        **measured,
+    }
+    settings.cpu_profiles = profiles
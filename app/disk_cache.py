@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+
+
+# Flat directory of files named by key. Reads refresh the file mtime, and
+# writes prune the least recently used files once the size budget is exceeded.
+class DiskCache:
+    def __init__(self, directory: Path, suffix: str = ".bin", max_bytes: int = 0):
+        self.directory = Path(directory)
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}{self.suffix}"
+
+    def get_bytes(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        self.prune()
+
+    def get_json(self, key: str):
+        data = self.get_bytes(key)
+        if data is None:
+            return None
+        try:
+            return json.loads(data.decode("utf-8"))
+        except ValueError:
+            self.discard(key)
+            return None
+
+    def put_json(self, key: str, value) -> None:
+        self.put_bytes(key, json.dumps(value).encode("utf-8"))
+
+    def discard(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def prune(self) -> None:
+        if self.max_bytes <= 0 or not self.directory.exists():
+            return
+        with self._lock:
+            entries = []
+            for path in self.directory.glob(f"*{self.suffix}"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+
+    def clear(self) -> None:
+        if not self.directory.exists():
+            return
+        for path in self.directory.glob(f"*{self.suffix}"):
+            path.unlink(missing_ok=True)
@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+
+from backend_probe import available_backends
+from code_repair import repair_code
+from cancellation import (
+    GenerationCancelled,
+    check_cancelled,
+    current_cancel_event,
+    current_token_listener,
+    use_cancel_event,
+)
+from model_output import is_valid_output, parse_model_output
+from photo_dedup import group_photos, hashing_available
+from response_cache import lookup_response, response_cache_key, store_response
+from tracing import Trace, current_trace, span, start_trace, use_trace
+
+
+@dataclass
+class GenerationResult:
+    data: dict
+    backend: str = ""
+    cache_hit: bool = False
+    elapsed_s: float = 0.0
+    timings: dict = field(default_factory=dict)
+    trace: Trace | None = None
+    # Artifacts rebuilt by an edit-mode run; None for a full generation.
+    patched: list[str] | None = None
+    # attempts, found and remaining problems when the code needed a repair.
+    repair: dict = field(default_factory=dict)
+
+
+# Backends (and through them the openai SDK) are imported on first use so the
+# window can appear before any of them is loaded. Plain import statements keep
+# them visible to PyInstaller.
+def _run_backend(settings, backend: str, payload: dict, image_paths: list[str], on_delta=None) -> str:
+    if backend == "local":
+        from ai_local import generate_with_local
+
+        return generate_with_local(settings, payload, on_delta=on_delta)
+    if backend == "local_multi":
+        from ai_local_multi import generate_with_local_multi
+
+        return generate_with_local_multi(settings, payload, image_paths, on_delta=on_delta)
+    from ai_openai import generate_with_openai
+
+    return generate_with_openai(settings, payload, image_paths, on_delta=on_delta)
+
+
+def _import_backends() -> None:
+    for name in ("ai_openai", "ai_local", "ai_local_multi"):
+        try:
+            __import__(name)
+        except Exception:
+            continue
+
+
+def warm_backends() -> threading.Thread:
+    thread = threading.Thread(target=_import_backends, name="backend-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def _backend_timings(backend: str) -> dict:
+    # local_multi keeps its stage timings per thread; read them on the same thread.
+    if backend != "local_multi":
+        return {}
+    from ai_local_multi import get_last_run_timings
+
+    return get_last_run_timings()
+
+
+def _auto_backends(settings, image_paths: list[str]) -> list[str]:
+    # Backends whose model files, packages or API key are missing are skipped
+    # up front instead of failing after a slow model load.
+    backends, skipped = available_backends(settings, image_paths)
+    if not backends:
+        raise RuntimeError("No AI backend is available:\n" + "\n".join(skipped))
+    return backends
+
+
+def _hedge_pair(backends: list[str]) -> list[str]:
+    # Two local backends would compete for the same CPU, so only a local
+    # backend paired with OpenAI is worth racing.
+    primary = backends[0]
+    for backup in backends[1:]:
+        if (primary == "openai") != (backup == "openai"):
+            return [primary, backup]
+    return [primary]
+
+
+def _run_hedged(
+    settings, backends: list[str], payload: dict, image_paths: list[str], on_delta, on_restart
+) -> tuple[str, str, dict]:
+    trace = current_trace()
+    # Each racer has its own event so the loser can be stopped; cancelling the
+    # whole run stops both.
+    outer_event = current_cancel_event()
+    on_tokens = current_token_listener()
+    results: queue.Queue = queue.Queue()
+    cancel_events = {backend: threading.Event() for backend in backends}
+    leader: list[str] = []
+    leader_lock = threading.Lock()
+
+    def forward(backend: str):
+        # Only the first backend to stream owns the output panes.
+        def _on_delta(field, text):
+            with leader_lock:
+                if not leader:
+                    leader.append(backend)
+            if leader[0] == backend:
+                on_delta(field, text)
+
+        return _on_delta
+
+    def run(backend: str) -> None:
+        with use_trace(trace), use_cancel_event(cancel_events[backend], on_tokens):
+            try:
+                raw = _run_backend(
+                    settings, backend, payload, image_paths, forward(backend) if on_delta else None
+                )
+                results.put((backend, raw, _backend_timings(backend), None))
+            except Exception as exc:
+                results.put((backend, "", {}, exc))
+
+    for backend in backends:
+        threading.Thread(target=run, args=(backend,), name=f"hedge-{backend}", daemon=True).start()
+
+    errors = []
+    for _ in backends:
+        while True:
+            try:
+                backend, raw, timings, error = results.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if outer_event is not None and outer_event.is_set():
+                    for event in cancel_events.values():
+                        event.set()
+                    check_cancelled()
+        if error is None and is_valid_output(raw):
+            for other, event in cancel_events.items():
+                if other != backend:
+                    event.set()
+            if leader and leader[0] != backend and on_restart is not None:
+                on_restart()
+            return backend, raw, timings
+        errors.append(f"{backend}: {error or 'no valid JSON in the reply'}")
+    raise RuntimeError("All hedged backends failed:\n" + "\n".join(errors))
+
+
+def _generate_raw(
+    settings, payload: dict, image_paths: list[str], on_delta=None, on_restart=None
+) -> tuple[str, str, dict]:
+    if settings.ai_mode != "auto":
+        raw = _run_backend(settings, settings.ai_mode, payload, image_paths, on_delta)
+        return settings.ai_mode, raw, _backend_timings(settings.ai_mode)
+
+    backends = _auto_backends(settings, image_paths)
+    if settings.hedged_auto:
+        pair = _hedge_pair(backends)
+        if len(pair) > 1:
+            return _run_hedged(settings, pair, payload, image_paths, on_delta, on_restart)
+
+    for backend in backends[:-1]:
+        try:
+            raw = _run_backend(settings, backend, payload, image_paths, on_delta)
+            return backend, raw, _backend_timings(backend)
+        except GenerationCancelled:
+            raise
+        except Exception:
+            if on_restart is not None:
+                on_restart()
+    raw = _run_backend(settings, backends[-1], payload, image_paths, on_delta)
+    return backends[-1], raw, _backend_timings(backends[-1])
+
+
+def generate_raw(
+    settings, payload: dict, image_paths: list[str], on_delta=None, on_restart=None
+) -> tuple[str, str]:
+    backend, raw, _ = _generate_raw(settings, payload, image_paths, on_delta, on_restart)
+    return backend, raw
+
+
+def _select_photos(settings, image_paths: list[str]) -> list[str]:
+    # Near-duplicates and blank shots never reach image analysis or the upload.
+    if not settings.dedupe_photos or not image_paths or not hashing_available():
+        return image_paths
+    with span("photo_dedup", images=len(image_paths)) as current:
+        groups = group_photos(image_paths)
+        selected = list(image_paths) if groups.all_blank else groups.representatives
+        current.set(kept=len(selected), blank=len(groups.blank), all_blank=groups.all_blank)
+    return selected
+
+
+def generate(
+    settings,
+    payload: dict,
+    image_paths: list[str],
+    on_delta=None,
+    on_restart=None,
+    trace_listener=None,
+) -> GenerationResult:
+    with start_trace(
+        "generate",
+        listener=trace_listener,
+        write_log=settings.trace_log,
+        mode=settings.ai_mode,
+        images=len(image_paths),
+    ) as trace:
+        image_paths = _select_photos(settings, image_paths)
+        result = _generate(settings, payload, image_paths, on_delta, on_restart)
+        trace.attrs.update(backend=result.backend, cache_hit=result.cache_hit)
+        result.trace = trace
+        return result
+
+
+def _generate(settings, payload: dict, image_paths: list[str], on_delta, on_restart) -> GenerationResult:
+    started = time.perf_counter()
+    with span("cache_lookup"):
+        cache_key = response_cache_key(settings, payload, image_paths)
+        cached = None
+        if not settings.bypass_response_cache:
+            cached = lookup_response(settings, cache_key)
+    if cached is not None:
+        return GenerationResult(cached, cache_hit=True, elapsed_s=time.perf_counter() - started)
+
+    backend, raw, timings = _generate_raw(settings, payload, image_paths, on_delta, on_restart)
+    with span("parse"):
+        data = parse_model_output(raw)
+    data, repair = repair_code(settings, backend, data, payload)
+    if data.get("code") or data.get("tutorial"):
+        store_response(settings, cache_key, data)
+    return GenerationResult(
+        data,
+        backend=backend,
+        elapsed_s=time.perf_counter() - started,
+        timings=timings,
+        repair=repair,
+    )
+
+
+def regenerate(
+    settings,
+    previous_payload: dict,
+    current: dict,
+    payload: dict,
+    image_paths: list[str],
+    on_delta=None,
+    on_restart=None,
+    trace_listener=None,
+) -> GenerationResult:
+    # Edit mode: only the artifacts fed by changed inputs are rebuilt, with the
+    # current text as context. Images must be unchanged since the last run.
+    from incremental import affected_targets, changed_fields, patch_artifacts
+
+    with start_trace(
+        "regenerate",
+        listener=trace_listener,
+        write_log=settings.trace_log,
+        mode=settings.ai_mode,
+        images=len(image_paths),
+    ) as trace:
+        started = time.perf_counter()
+        image_paths = _select_photos(settings, image_paths)
+        changed = changed_fields(previous_payload, payload)
+        targets = affected_targets(changed)
+        trace.attrs.update(changed=changed, patched=targets)
+        if not targets:
+            data = {"code": current.get("code", ""), "tutorial": current.get("tutorial", "")}
+            return GenerationResult(
+                data, elapsed_s=time.perf_counter() - started, trace=trace, patched=[]
+            )
+
+        if settings.ai_mode != "auto":
+            backends = [settings.ai_mode]
+        else:
+            backends = _auto_backends(settings, image_paths)
+        for index, backend in enumerate(backends):
+            try:
+                data = patch_artifacts(
+                    settings, backend, previous_payload, current, payload, image_paths,
+                    targets, changed, on_delta,
+                )
+                break
+            except GenerationCancelled:
+                raise
+            except Exception:
+                if index == len(backends) - 1:
+                    raise
+                if on_restart is not None:
+                    on_restart()
+        repair = {}
+        if "code" in targets:
+            data, repair = repair_code(settings, backend, data, payload)
+        trace.attrs.update(backend=backend)
+        return GenerationResult(
+            data,
+            backend=backend,
+            elapsed_s=time.perf_counter() - started,
+            trace=trace,
+            patched=targets,
+            repair=repair,
+        )
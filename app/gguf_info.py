@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import struct
+import threading
+from pathlib import Path
+
+GGUF_MAGIC = b"GGUF"
+
+# GGUF value types: struct format and size of the fixed-width ones.
+_SCALARS = {
+    0: ("<B", 1), 1: ("<b", 1), 2: ("<H", 2), 3: ("<h", 2), 4: ("<I", 4), 5: ("<i", 4),
+    6: ("<f", 4), 7: ("<?", 1), 10: ("<Q", 8), 11: ("<q", 8), 12: ("<d", 8),
+}
+_STRING = 8
+_ARRAY = 9
+
+_CACHE: dict[tuple, dict] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+class _Reader:
+    def __init__(self, handle, version: int):
+        self.handle = handle
+        # Version 1 used 32-bit lengths and counts.
+        self.count_format = ("<I", 4) if version == 1 else ("<Q", 8)
+
+    def read(self, fmt: str, size: int):
+        data = self.handle.read(size)
+        if len(data) != size:
+            raise ValueError("truncated GGUF header")
+        return struct.unpack(fmt, data)[0]
+
+    def count(self) -> int:
+        return self.read(*self.count_format)
+
+    def string(self) -> str:
+        length = self.count()
+        return self.handle.read(length).decode("utf-8", errors="replace")
+
+    def skip_string(self) -> None:
+        self.handle.seek(self.count(), 1)
+
+    def value(self, value_type: int, keep: bool):
+        if value_type in _SCALARS:
+            return self.read(*_SCALARS[value_type])
+        if value_type == _STRING:
+            if keep:
+                return self.string()
+            self.skip_string()
+            return None
+        if value_type == _ARRAY:
+            item_type = self.read("<I", 4)
+            length = self.count()
+            if not keep:
+                # Vocabulary arrays hold 100k+ entries; skip them without decoding.
+                if item_type in _SCALARS:
+                    self.handle.seek(_SCALARS[item_type][1] * length, 1)
+                else:
+                    for _ in range(length):
+                        self.value(item_type, False)
+                return None
+            return [self.value(item_type, True) for _ in range(length)]
+        raise ValueError(f"unknown GGUF value type {value_type}")
+
+
+def _read_metadata(path: str) -> dict:
+    metadata = {}
+    with open(path, "rb") as handle:
+        if handle.read(4) != GGUF_MAGIC:
+            raise ValueError(f"{Path(path).name} is not a GGUF file")
+        version = struct.unpack("<I", handle.read(4))[0]
+        reader = _Reader(handle, version)
+        reader.count()  # tensor count
+        for _ in range(reader.count()):
+            key = reader.string()
+            value_type = reader.read("<I", 4)
+            # Arrays (tokenizer vocabularies, merges) are never needed here.
+            value = reader.value(value_type, keep=value_type != _ARRAY)
+            if value is not None:
+                metadata[key] = value
+    return metadata
+
+
+def gguf_metadata(path: str) -> dict:
+    # Scalar metadata of a GGUF file, cached until the file changes. Returns
+    # an empty dict for files that cannot be read.
+    try:
+        stat = Path(path).stat()
+    except (OSError, ValueError):
+        return {}
+    key = (str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(key)
+    if cached is not None:
+        return cached
+    try:
+        metadata = _read_metadata(path)
+    except (OSError, ValueError, struct.error):
+        metadata = {}
+    with _CACHE_LOCK:
+        _CACHE[key] = metadata
+    return metadata
+
+
+def _arch_value(metadata: dict, name: str):
+    arch = metadata.get("general.architecture", "")
+    return metadata.get(f"{arch}.{name}")
+
+
+def context_length(path: str) -> int:
+    return int(_arch_value(gguf_metadata(path), "context_length") or 0)
+
+
+def kv_bytes_per_token(path: str, bytes_per_value: int = 2) -> int:
+    # K and V for every layer: n_layers * n_kv_heads * head_dim values each
+    # (f16 cache by default). Returns 0 when the metadata is incomplete.
+    metadata = gguf_metadata(path)
+    layers = _arch_value(metadata, "block_count")
+    embedding = _arch_value(metadata, "embedding_length")
+    heads = _arch_value(metadata, "attention.head_count")
+    if not (layers and embedding and heads):
+        return 0
+    kv_heads = _arch_value(metadata, "attention.head_count_kv") or heads
+    key_length = _arch_value(metadata, "attention.key_length") or embedding // heads
+    value_length = _arch_value(metadata, "attention.value_length") or embedding // heads
+    return int(layers * kv_heads * (key_length + value_length) * bytes_per_value)
+
+
+def clip_image_size(mmproj_path: str) -> int:
+    # Side of the square the vision encoder scales every image to, e.g. 336.
+    return int(gguf_metadata(mmproj_path).get("clip.vision.image_size") or 0)
+
+
+def clip_image_tokens(mmproj_path: str) -> int:
+    # Patch embeddings a LLaVA-style projector produces per image.
+    metadata = gguf_metadata(mmproj_path)
+    image_size = metadata.get("clip.vision.image_size")
+    patch_size = metadata.get("clip.vision.patch_size")
+    if not (image_size and patch_size):
+        return 0
+    return int((image_size // patch_size) ** 2)
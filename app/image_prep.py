@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import base64
+import io
+import mimetypes
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+# Largest image size each OpenAI detail level can use. "low" is processed as a
+# single 512px tile; "high" (and "auto", which may pick high) fits the image in
+# 2048x2048 and then scales the shortest side down to 768px.
+LOW_DETAIL_SIZE = 512
+HIGH_DETAIL_MAX_SIZE = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Multiple of 3 so each chunk encodes to base64 without padding.
+_RAW_CHUNK_SIZE = 3 * 256 * 1024
+
+_CACHE: OrderedDict[tuple, str] = OrderedDict()
+_CACHE_BYTES = 0
+_LOCK = threading.Lock()
+
+
+def target_size(width: int, height: int, detail: str) -> tuple[int, int]:
+    if detail == "low":
+        scale = min(1.0, LOW_DETAIL_SIZE / max(width, height))
+    else:
+        scale = min(1.0, HIGH_DETAIL_MAX_SIZE / max(width, height))
+        short_side = min(width, height) * scale
+        if short_side > HIGH_DETAIL_SHORT_SIDE:
+            scale *= HIGH_DETAIL_SHORT_SIDE / short_side
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def fit_size(width: int, height: int, max_side: int) -> tuple[int, int]:
+    scale = min(1.0, max_side / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _raw_data_url(path: str) -> str:
+    mime, _ = mimetypes.guess_type(path)
+    if not mime:
+        mime = "image/jpeg"
+    parts = [f"data:{mime};base64,"]
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(_RAW_CHUNK_SIZE), b""):
+            parts.append(base64.b64encode(chunk).decode("ascii"))
+    return "".join(parts)
+
+
+def _resized_data_url(path: str, detail: str, quality: int, max_side: int = 0) -> str | None:
+    try:
+        from PIL import Image, ImageOps  # type: ignore
+    except Exception:
+        return None
+
+    with Image.open(path) as image:
+        width, height = image.size
+        # EXIF rotation swaps the axes, so size the target on the upright image.
+        orientation = image.getexif().get(0x0112, 1)
+        upright = (height, width) if orientation in (5, 6, 7, 8) else (width, height)
+        size = fit_size(*upright, max_side) if max_side else target_size(*upright, detail)
+        if size == upright and image.format in ("JPEG", "PNG", "WEBP", "GIF"):
+            return None
+
+        # draft() lets the JPEG decoder scale down while decoding, so a 12 MP
+        # photo never has to be fully decoded in memory.
+        draft_size = (size[1], size[0]) if upright != (width, height) else size
+        image.draft("RGB", draft_size)
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if image.size != size:
+            image = image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getbuffer()).decode("ascii")
+
+
+def image_data_url(path: str, detail: str = "auto", quality: int = 85, max_side: int = 0) -> str:
+    # max_side, when set, replaces the detail-level sizing: the image is fit
+    # into a max_side square, e.g. a vision encoder's native input size.
+    global _CACHE_BYTES
+
+    stat = Path(path).stat()
+    key = (str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size, detail, quality, max_side)
+    with _LOCK:
+        cached = _CACHE.get(key)
+        if cached is not None:
+            _CACHE.move_to_end(key)
+            return cached
+
+    try:
+        data_url = _resized_data_url(path, detail, quality, max_side)
+    except Exception:
+        data_url = None
+    if data_url is None:
+        data_url = _raw_data_url(path)
+
+    with _LOCK:
+        if key not in _CACHE:
+            _CACHE[key] = data_url
+            _CACHE_BYTES += len(data_url)
+        while _CACHE_BYTES > CACHE_MAX_BYTES and len(_CACHE) > 1:
+            _, evicted = _CACHE.popitem(last=False)
+            _CACHE_BYTES -= len(evicted)
+    return data_url
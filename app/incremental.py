@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from context_budget import plan_prompt
+from json_grammar import grammar_kwargs
+from local_completion import complete
+from model_output import parse_model_output
+from model_pool import lease_model
+from prefix_cache import prime_prefix
+from prompt_templates import SYSTEM_INSTRUCTIONS, build_patch_prompt
+from speculative import speculative_kwargs
+
+ARTIFACTS = ("code", "tutorial")
+
+# Which generated artifacts each payload field feeds. A port change only
+# touches the program; a parts change only touches the build steps.
+FIELD_TARGETS = {
+    "competition": ("code", "tutorial"),
+    "task_title": ("tutorial",),
+    "tasks": ("code", "tutorial"),
+    "notes": ("code", "tutorial"),
+    "parts": ("tutorial",),
+    "sensors": ("code",),
+    "constraints": ("code", "tutorial"),
+}
+
+
+def changed_fields(previous: dict, payload: dict) -> list[str]:
+    keys = list(dict.fromkeys([*FIELD_TARGETS, *previous, *payload]))
+    return [
+        key for key in keys if str(previous.get(key, "")).strip() != str(payload.get(key, "")).strip()
+    ]
+
+
+def affected_targets(changed: list[str]) -> list[str]:
+    targets = set()
+    for field in changed:
+        targets.update(FIELD_TARGETS.get(field, ARTIFACTS))
+    return [target for target in ARTIFACTS if target in targets]
+
+
+def _role_model(settings, backend: str, target: str) -> tuple[str, dict]:
+    # Same model and load options as a full run, so the pooled model and its
+    # cached prompt state are reused.
+    if backend == "local":
+        return settings.local_model_path, speculative_kwargs(settings)
+    if target == "code":
+        return settings.local_code_model_path, speculative_kwargs(settings)
+    return settings.local_tutorial_model_path, {}
+
+
+def complete_role(
+    settings, backend: str, target: str, build, sections: dict, on_delta=None, span_name: str = ""
+) -> str:
+    # build(sections) -> prompt, so local models can trim sections to fit their context.
+    if not settings.stream_output:
+        on_delta = None
+    if backend == "openai":
+        from ai_openai import complete_text
+
+        return complete_text(settings, build(sections), on_delta=on_delta, fields=(target,))
+
+    model_path, load_kwargs = _role_model(settings, backend, target)
+    if not model_path:
+        raise ValueError(f"No local model is set for the {target} in {backend} mode.")
+    prompt, plan = plan_prompt(
+        settings,
+        model_path,
+        lambda current: f"{SYSTEM_INSTRUCTIONS}\n\n{build(current)}",
+        sections,
+        **load_kwargs,
+    )
+    with lease_model(settings, model_path, n_ctx=plan.n_ctx, **load_kwargs) as llm:
+        prime_prefix(settings, llm, model_path, prompt)
+        return complete(
+            llm,
+            prompt,
+            plan.max_tokens,
+            settings.temperature,
+            on_delta=on_delta,
+            fields=(target,),
+            span_name=span_name or f"{target}_patch",
+            **grammar_kwargs(settings, (target,)),
+        )
+
+
+def _sections_for_backend(settings, backend: str, payload: dict, image_paths: list[str]) -> dict:
+    # local_multi adds image summaries as their own section; they come from the
+    # vision cache when the photos did not change.
+    if backend != "local_multi" or not image_paths:
+        return payload
+    from ai_local_multi import _analyze_images_with_local
+
+    return {**payload, "image_notes": _analyze_images_with_local(settings, image_paths)}
+
+
+def patch_artifacts(
+    settings,
+    backend: str,
+    previous_payload: dict,
+    current: dict,
+    payload: dict,
+    image_paths: list[str],
+    targets: list[str],
+    changed: list[str],
+    on_delta=None,
+) -> dict:
+    from ai_local_multi import _with_image_notes
+
+    data = {target: current.get(target, "") for target in ARTIFACTS}
+    sections = _sections_for_backend(settings, backend, payload, image_paths)
+    for target in targets:
+        def build(current_sections: dict, target=target) -> str:
+            return build_patch_prompt(
+                _with_image_notes(current_sections, current_sections.get("image_notes", "")),
+                previous_payload,
+                target,
+                data[target],
+                changed,
+            )
+
+        raw = complete_role(settings, backend, target, build, sections, on_delta)
+        value = parse_model_output(raw).get(target, "")
+        if value:
+            data[target] = value
+    return data
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from dataclasses import dataclass, field
+
+# Lower runs first; equal priorities run in the order they were queued.
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# Finished jobs kept for the job list.
+KEEP_FINISHED = 20
+
+
+@dataclass
+class GenerationJob:
+    job_id: int
+    title: str
+    settings: object
+    payload: dict
+    image_paths: list[str]
+    # (last payload, current output) for an edit-mode run, taken when queued.
+    previous: tuple[dict, dict] | None = None
+    priority: str = "normal"
+    status: str = QUEUED
+    stage: str = ""
+    tokens: int = 0
+    error: str = ""
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    queued_at: float = field(default_factory=time.perf_counter)
+    started_at: float = 0.0
+    finished_at: float = 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def add_tokens(self, count: int) -> None:
+        # Called from the generation thread; a plain int add is enough here.
+        self.tokens += count
+
+    def summary(self) -> str:
+        text = f"#{self.job_id} {self.title} [{self.priority}] {self.status}"
+        if self.status == RUNNING:
+            elapsed = time.perf_counter() - self.started_at
+            details = [f"{elapsed:.0f}s"]
+            if self.stage:
+                details.append(self.stage)
+            if self.tokens:
+                details.append(f"{self.tokens} tokens")
+            text += f" ({', '.join(details)})"
+        elif self.finished and self.started_at:
+            text += f" after {self.finished_at - self.started_at:.1f}s"
+            if self.tokens:
+                text += f", {self.tokens} tokens"
+        return text
+
+
+class JobQueue:
+    # Bookkeeping only: the caller runs each job it takes and reports back
+    # with finish(). Cancelling a queued job drops it at once; a running job
+    # gets its cancel event set and stops at the next token.
+    def __init__(self, keep_finished: int = KEEP_FINISHED):
+        self.keep_finished = keep_finished
+        self._heap: list[tuple[int, int, GenerationJob]] = []
+        self._jobs: dict[int, GenerationJob] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        settings,
+        payload: dict,
+        image_paths: list[str],
+        previous: tuple[dict, dict] | None = None,
+        priority: str = "normal",
+        title: str = "",
+    ) -> GenerationJob:
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        with self._lock:
+            job_id = next(self._ids)
+            job = GenerationJob(
+                job_id,
+                title or payload.get("task_title") or "Untitled",
+                settings,
+                payload,
+                list(image_paths),
+                previous,
+                priority,
+            )
+            self._jobs[job_id] = job
+            heapq.heappush(self._heap, (PRIORITIES[priority], job_id, job))
+            return job
+
+    def take_next(self) -> GenerationJob | None:
+        with self._lock:
+            while self._heap:
+                _, _, job = heapq.heappop(self._heap)
+                if job.status == QUEUED:
+                    job.status = RUNNING
+                    job.started_at = time.perf_counter()
+                    return job
+            return None
+
+    def finish(self, job: GenerationJob, status: str, error: str = "") -> None:
+        with self._lock:
+            job.status = status
+            job.error = error
+            job.stage = ""
+            job.finished_at = time.perf_counter()
+            self._prune()
+
+    def cancel(self, job_id: int) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            job.cancel_event.set()
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.finished_at = time.perf_counter()
+                self._prune()
+            return True
+
+    def cancel_all(self) -> int:
+        return sum(self.cancel(job.job_id) for job in self.jobs() if not job.finished)
+
+    def running(self) -> GenerationJob | None:
+        with self._lock:
+            return next((job for job in self._jobs.values() if job.status == RUNNING), None)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(job.status == QUEUED for job in self._jobs.values())
+
+    def jobs(self) -> list[GenerationJob]:
+        # Running first, then queued in the order they will run, then the
+        # most recently finished.
+        with self._lock:
+            jobs = list(self._jobs.values())
+        active = sorted(
+            (job for job in jobs if not job.finished),
+            key=lambda job: (job.status != RUNNING, PRIORITIES[job.priority], job.job_id),
+        )
+        finished = sorted(
+            (job for job in jobs if job.finished), key=lambda job: job.finished_at, reverse=True
+        )
+        return active + finished
+
+    def _prune(self) -> None:
+        finished = sorted(
+            (job for job in self._jobs.values() if job.finished), key=lambda job: job.finished_at
+        )
+        for job in finished[: max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job.job_id]
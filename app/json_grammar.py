@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import json
+import threading
+
+from prompt_templates import JSON_SCHEMA
+
+# JSON string body: any character except quote, backslash and control
+# characters, or a valid escape sequence.
+_GBNF_RULES = r'''
+string ::= "\"" ( [^"\\\x7F\x00-\x1F] | "\\" ( ["\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] ) )* "\""
+ws ::= ( [ \t\n] ( [ \t\n] ( [ \t\n] )? )? )?
+'''
+
+_GRAMMARS: dict[tuple[str, ...], object] = {}
+_GRAMMARS_LOCK = threading.Lock()
+
+
+def build_gbnf(fields=tuple(JSON_SCHEMA)) -> str:
+    # A fixed key order keeps the grammar small and lets the model spend its
+    # tokens on the values; the object closes right after the last one.
+    members = ' ws "," ws '.join(
+        f"{json.dumps(json.dumps(field))} ws \":\" ws string" for field in fields
+    )
+    return f'root ::= "{{" ws {members} ws "}}"\n' + _GBNF_RULES.lstrip("\n")
+
+
+def json_grammar(fields=tuple(JSON_SCHEMA)):
+    # Returns a cached LlamaGrammar, or None when llama-cpp-python has no grammar support.
+    fields = tuple(fields)
+    with _GRAMMARS_LOCK:
+        if fields in _GRAMMARS:
+            return _GRAMMARS[fields]
+        try:
+            from llama_cpp import LlamaGrammar  # type: ignore
+
+            grammar = LlamaGrammar.from_string(build_gbnf(fields), verbose=False)
+        except Exception:
+            grammar = None
+        _GRAMMARS[fields] = grammar
+        return grammar
+
+
+def grammar_kwargs(settings, fields=tuple(JSON_SCHEMA)) -> dict:
+    if not settings.json_grammar:
+        return {}
+    grammar = json_grammar(fields)
+    return {"grammar": grammar} if grammar is not None else {}
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import json
+
+_SIMPLE_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class JsonFieldStream:
+    # Incremental reader for a streamed JSON object. It decodes the string values
+    # of the selected top-level keys as soon as their characters arrive, so the UI
+    # can show partial code/tutorial text before the object is complete. Anything
+    # outside the top-level object (code fences, chatter) is ignored, including
+    # brackets and quotes in chatter before the first "{".
+
+    def __init__(self, fields=("code", "tutorial")):
+        self.fields = tuple(fields)
+        self.values = {field: "" for field in self.fields}
+        self._depth = 0
+        self.opened = False
+        self.closed = False
+        self._in_string = False
+        self._string_is_key = False
+        self._escape = ""
+        self._high_surrogate = ""
+        self._key_chars: list[str] = []
+        self._key = None
+        self._awaiting_value = False
+        self._target = None
+
+    def feed(self, chunk: str) -> dict[str, str]:
+        deltas: dict[str, str] = {}
+        for ch in chunk:
+            if not self.opened:
+                if ch == "{":
+                    self.opened = True
+                    self._depth = 1
+                continue
+            if self._in_string:
+                self._feed_string_char(ch, deltas)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._awaiting_value:
+                    self._string_is_key = False
+                    self._target = self._key if self._key in self.values else None
+                else:
+                    self._string_is_key = self._depth == 1
+                    self._key_chars = []
+                    self._target = None
+                self._awaiting_value = False
+            elif ch in "{[":
+                self._depth += 1
+                self._awaiting_value = False
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    # The top-level object that opened with the first "{" is complete.
+                    self.closed = True
+                    break
+            elif ch == ":" and self._depth == 1:
+                self._awaiting_value = True
+            elif not ch.isspace():
+                self._awaiting_value = False
+        return deltas
+
+    def _feed_string_char(self, ch: str, deltas: dict[str, str]) -> None:
+        if self._escape:
+            self._escape += ch
+            decoded = self._decode_escape()
+            if decoded is not None:
+                self._escape = ""
+                self._emit(decoded, deltas)
+            return
+
+        if ch == "\\":
+            self._escape = "\\"
+        elif ch == '"':
+            self._in_string = False
+            if self._string_is_key:
+                self._key = "".join(self._key_chars)
+            self._target = None
+        else:
+            self._emit(ch, deltas)
+
+    def _decode_escape(self) -> str | None:
+        code = self._escape[1]
+        if code != "u":
+            return _SIMPLE_ESCAPES.get(code, code)
+        if len(self._escape) < 6:
+            return None
+
+        try:
+            text = json.loads(f'"{self._high_surrogate}{self._escape}"')
+        except ValueError:
+            text = "\ufffd"
+
+        if not self._high_surrogate and "\ud800" <= text <= "\udbff":
+            # Wait for the low half of a surrogate pair.
+            self._high_surrogate = self._escape
+            return ""
+        self._high_surrogate = ""
+        return text
+
+    def _emit(self, text: str, deltas: dict[str, str]) -> None:
+        if not text:
+            return
+        if self._string_is_key:
+            self._key_chars.append(text)
+        elif self._target:
+            self.values[self._target] += text
+            deltas[self._target] = deltas.get(self._target, "") + text
+
+
+def stream_fields(chunks, on_delta, fields=("code", "tutorial")) -> str:
+    reader = JsonFieldStream(fields)
+    raw_parts = []
+    for chunk in chunks:
+        if not chunk:
+            continue
+        raw_parts.append(chunk)
+        for field, delta in reader.feed(chunk).items():
+            on_delta(field, delta)
+        if reader.closed:
+            # Nothing after the top-level object is used; stop generating.
+            break
+    return "".join(raw_parts)
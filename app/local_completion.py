@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import time
+
+from cancellation import check_cancelled, count_tokens, current_cancel_event
+from json_stream import stream_fields
+from tracing import current_trace, span, token_rates
+
+
+def _ignore_delta(field: str, text: str) -> None:
+    pass
+
+
+def _reset_draft_stats(llm):
+    draft = getattr(llm, "draft_model", None)
+    if draft is None or not hasattr(draft, "reset_stats"):
+        return None
+    draft.reset_stats()
+    return draft
+
+
+def _report_draft_stats(span_obj, draft) -> None:
+    if draft is None:
+        return
+    drafted, accepted = draft.stats()
+    span_obj.set(
+        drafted_tokens=drafted,
+        accepted_tokens=accepted,
+        acceptance_rate=round(accepted / drafted, 3) if drafted else 0.0,
+    )
+
+
+def complete(
+    llm,
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    on_delta=None,
+    fields=("code", "tutorial"),
+    span_name: str = "generation",
+    **completion_kwargs,
+) -> str:
+    with span(span_name) as current:
+        started = time.perf_counter()
+        draft = _reset_draft_stats(llm)
+        # A cancellable run always streams so it can stop between tokens.
+        if on_delta is None and current_cancel_event() is None:
+            result = llm.create_completion(
+                prompt=prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                **completion_kwargs,
+            )
+            usage = result.get("usage") or {}
+            token_rates(
+                current,
+                usage.get("prompt_tokens", 0),
+                usage.get("completion_tokens", 0),
+                time.perf_counter() - started,
+            )
+            _report_draft_stats(current, draft)
+            choices = result.get("choices", [])
+            if not choices:
+                return ""
+            return choices[0].get("text", "")
+
+        chunks = llm.create_completion(
+            prompt=prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            **completion_kwargs,
+        )
+        stats = {"first_token_s": None, "completion_tokens": 0}
+
+        def _texts():
+            for chunk in chunks:
+                check_cancelled()
+                if not chunk.get("choices"):
+                    continue
+                if stats["first_token_s"] is None:
+                    stats["first_token_s"] = time.perf_counter() - started
+                stats["completion_tokens"] += 1
+                count_tokens()
+                yield chunk["choices"][0].get("text", "")
+
+        try:
+            raw = stream_fields(_texts(), on_delta or _ignore_delta, fields)
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+        if current_trace() is not None:
+            prompt_tokens = len(llm.tokenize(prompt.encode("utf-8")))
+            token_rates(
+                current,
+                prompt_tokens,
+                stats["completion_tokens"],
+                time.perf_counter() - started,
+                stats["first_token_s"],
+            )
+        _report_draft_stats(current, draft)
+        return raw
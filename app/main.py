@@ -1,9 +1,12 @@
-﻿import json
+﻿import multiprocessing
+import os
+import time
 import traceback
+from dataclasses import replace
 from pathlib import Path
 
-from PySide6.QtCore import Qt, QThread, Signal
-from PySide6.QtGui import QClipboard
+from PySide6.QtCore import QObject, Qt, QThread, QTimer, Signal
+from PySide6.QtGui import QClipboard, QTextCursor
 from PySide6.QtWidgets import (
     QApplication,
     QCheckBox,
@@ -12,6 +15,7 @@ from PySide6.QtWidgets import (
     QFormLayout,
     QGroupBox,
     QHBoxLayout,
+    QInputDialog,
     QLabel,
     QLineEdit,
     QListWidget,
@@ -20,91 +24,152 @@ from PySide6.QtWidgets import (
     QMessageBox,
     QPushButton,
     QPlainTextEdit,
+    QSpinBox,
     QSplitter,
     QTabWidget,
     QVBoxLayout,
     QWidget,
 )
 
-from app_settings import AppSettings, load_settings, save_settings
-from ai_openai import generate_with_openai
-from ai_local import generate_with_local
-from ai_local_multi import generate_with_local_multi
+from app_settings import AppSettings, load_settings, schedule_save_settings
+from cancellation import GenerationCancelled, use_cancel_event
+from generation import generate, regenerate, warm_backends
+from jobs import CANCELLED, DONE, FAILED, PRIORITIES, GenerationJob, JobQueue
+from model_pool import preload_models
+from photo_dedup import group_photos, hash_in_background, hashing_available, is_hashed
+from response_cache import cache_stats
+from workspace import (
+    ImageRef,
+    apply_project_settings,
+    list_workspaces,
+    load_workspace,
+    project_settings,
+    schedule_save_workspace,
+)
+from write_behind import get_writer
 
 
 class GenerateThread(QThread):
     success = Signal(dict)
     failed = Signal(str)
-
-    def __init__(self, settings: AppSettings, payload: dict, image_paths: list[str]):
+    partial = Signal(str, str)
+    stream_reset = Signal()
+    stage = Signal(str)
+    cancelled = Signal()
+
+    # Minimum time between partial-text signals so per-token deltas are
+    # coalesced instead of flooding the Qt event loop.
+    PARTIAL_INTERVAL_S = 0.08
+
+    def __init__(
+        self,
+        settings: AppSettings,
+        payload: dict,
+        image_paths: list[str],
+        previous: tuple[dict, dict] | None = None,
+        job: GenerationJob | None = None,
+    ):
         super().__init__()
         self.settings = settings
         self.payload = payload
         self.image_paths = image_paths
+        # (last payload, current output) when only changed sections should be rebuilt.
+        self.previous = previous
+        # The queued job this thread runs; its event cancels the run and it
+        # collects stage and token progress.
+        self.job = job
+        self.patched: list[str] | None = None
+        self.started_at = 0.0
+        self.first_token_s: float | None = None
+        self.backend = ""
+        self.timing_text = ""
+        self.cache_hit = False
+        self.repair: dict = {}
+        self.breakdown = ""
+        self._pending: dict[str, str] = {}
+        self._last_partial = 0.0
 
     def run(self):
+        self.started_at = time.perf_counter()
+        cancel_event = self.job.cancel_event if self.job else None
+        on_tokens = self.job.add_tokens if self.job else None
         try:
-            mode = self.settings.ai_mode
-            if mode == "local":
-                raw = generate_with_local(self.settings, self.payload)
-            elif mode == "local_multi":
-                raw = generate_with_local_multi(self.settings, self.payload, self.image_paths)
-            elif mode == "openai":
-                raw = generate_with_openai(self.settings, self.payload, self.image_paths)
-            else:
-                raw = self._auto_generate()
-
-            data = parse_model_output(raw)
-            self.success.emit(data)
+            with use_cancel_event(cancel_event, on_tokens):
+                result = self._run()
+            self._flush_partial()
+            self.patched = result.patched
+            self.backend = result.backend
+            self.cache_hit = result.cache_hit
+            self.repair = result.repair
+            self.timing_text = _format_multi_timings(result.timings)
+            self.success.emit(result.data)
+        except GenerationCancelled:
+            self.cancelled.emit()
         except Exception as exc:
             self.failed.emit(f"{exc}\n\n{traceback.format_exc()}")
 
-    def _auto_generate(self):
-        if self.settings.local_code_model_path and self.settings.local_tutorial_model_path:
-            try:
-                return generate_with_local_multi(self.settings, self.payload, self.image_paths)
-            except Exception:
-                pass
-
-        if self.settings.local_model_path:
-            try:
-                return generate_with_local(self.settings, self.payload)
-            except Exception:
-                pass
-        return generate_with_openai(self.settings, self.payload, self.image_paths)
-
-
-def parse_model_output(text: str) -> dict:
-    if not text:
-        return {"code": "", "tutorial": ""}
-
-    cleaned = text.strip()
-
-    if cleaned.startswith("```"):
-        lines = cleaned.splitlines()
-        if lines and lines[0].startswith("```"):
-            lines = lines[1:]
-        if lines and lines[-1].strip().startswith("```"):
-            lines = lines[:-1]
-        cleaned = "\n".join(lines).strip()
-
-    try:
-        return json.loads(cleaned)
-    except Exception:
-        pass
-
-    start = cleaned.find("{")
-    end = cleaned.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        try:
-            return json.loads(cleaned[start : end + 1])
-        except Exception:
-            pass
+    def _run(self):
+        if self.previous is not None:
+            previous_payload, current = self.previous
+            return regenerate(
+                self.settings,
+                previous_payload,
+                current,
+                self.payload,
+                self.image_paths,
+                on_delta=self._on_delta,
+                on_restart=self._restart_stream,
+                trace_listener=self._on_trace,
+            )
+        return generate(
+            self.settings,
+            self.payload,
+            self.image_paths,
+            on_delta=self._on_delta,
+            on_restart=self._restart_stream,
+            trace_listener=self._on_trace,
+        )
+
+    def _on_trace(self, trace):
+        self.breakdown = trace.breakdown()
+        if self.job is not None:
+            self.job.stage = trace.current_stage()
+        self.stage.emit(self.breakdown)
+
+    def _on_delta(self, field: str, text: str):
+        if self.first_token_s is None:
+            self.first_token_s = time.perf_counter() - self.started_at
+        self._pending[field] = self._pending.get(field, "") + text
+        now = time.perf_counter()
+        if now - self._last_partial >= self.PARTIAL_INTERVAL_S:
+            self._last_partial = now
+            self._flush_partial()
+
+    def _flush_partial(self):
+        pending, self._pending = self._pending, {}
+        for field, text in pending.items():
+            self.partial.emit(field, text)
+
+    def _restart_stream(self):
+        self._pending = {}
+        self.first_token_s = None
+        self.stream_reset.emit()
 
-    return {
-        "code": cleaned,
-        "tutorial": "",
-    }
+
+class PhotoHashSignals(QObject):
+    # Emitted from the hashing pool; Qt queues it to the window's thread.
+    hashed = Signal(str)
+
+
+def _format_multi_timings(timings: dict) -> str:
+    if not timings:
+        return ""
+    return (
+        f"{timings['mode']} {timings['wall_s']:.1f}s wall, "
+        f"stages {timings['stage_sum_s']:.1f}s "
+        f"(images {timings['images_s']:.1f}s, code {timings['code_s']:.1f}s, "
+        f"tutorial {timings['tutorial_s']:.1f}s)"
+    )
 
 
 class MainWindow(QMainWindow):
@@ -114,12 +179,27 @@ class MainWindow(QMainWindow):
         self.resize(1200, 760)
 
         self.settings = load_settings()
+        self.workspace = load_workspace(self.settings.workspace)
+        apply_project_settings(self.settings, self.workspace.settings)
 
         self.image_paths: list[str] = []
         self.worker: GenerateThread | None = None
+        self.jobs = JobQueue()
+        self._last_payload: dict | None = None
+        self._last_image_paths: list[str] = []
+        self._streamed_fields: set[str] = set()
+        # Set while the UI is filled from settings, so that doesn't schedule writes.
+        self._loading = False
+        self.photo_signals = PhotoHashSignals()
 
         self._build_ui()
         self._load_settings_into_ui()
+        self._load_workspace_into_ui()
+
+    def start_background_warmup(self):
+        warm_backends()
+        if self.settings.preload_models:
+            preload_models(self.settings)
 
     def _build_ui(self):
         root = QSplitter(Qt.Horizontal)
@@ -130,6 +210,15 @@ class MainWindow(QMainWindow):
         input_group = QGroupBox("Inputs")
         input_layout = QFormLayout(input_group)
 
+        workspace_row = QWidget()
+        workspace_layout = QHBoxLayout(workspace_row)
+        workspace_layout.setContentsMargins(0, 0, 0, 0)
+        self.workspace_combo = QComboBox()
+        self.new_workspace_btn = QPushButton("New")
+        workspace_layout.addWidget(self.workspace_combo, 1)
+        workspace_layout.addWidget(self.new_workspace_btn)
+        input_layout.addRow("Workspace", workspace_row)
+
         self.competition_combo = QComboBox()
         self.competition_combo.addItems(["WRO", "FIRST LEGO League"])
         input_layout.addRow("Competition", self.competition_combo)
@@ -178,6 +267,9 @@ class MainWindow(QMainWindow):
         self.ai_mode_combo.addItems(["auto", "openai", "local", "local_multi"])
         settings_layout.addRow("AI mode", self.ai_mode_combo)
 
+        self.hedged_auto_check = QCheckBox("Auto mode: race local and OpenAI, keep the first result")
+        settings_layout.addRow("", self.hedged_auto_check)
+
         self.openai_model_input = QLineEdit()
         settings_layout.addRow("OpenAI model", self.openai_model_input)
 
@@ -185,16 +277,27 @@ class MainWindow(QMainWindow):
         self.api_key_input.setEchoMode(QLineEdit.Password)
         settings_layout.addRow("OpenAI API key", self.api_key_input)
 
+        self.openai_base_url_input = QLineEdit()
+        self.openai_base_url_input.setPlaceholderText("Default, or http://<team server>:8765/v1")
+        settings_layout.addRow("OpenAI base URL", self.openai_base_url_input)
+
         self.remember_key = QCheckBox("Remember API key on this PC")
         settings_layout.addRow("", self.remember_key)
 
         self.include_images_check = QCheckBox("Include images in OpenAI request")
         settings_layout.addRow("", self.include_images_check)
 
+        self.dedupe_photos_check = QCheckBox("Send one photo per group of near-duplicates, skip blank shots")
+        settings_layout.addRow("", self.dedupe_photos_check)
+
         self.image_detail_combo = QComboBox()
         self.image_detail_combo.addItems(["auto", "low", "high"])
         settings_layout.addRow("Image detail", self.image_detail_combo)
 
+        self.image_quality_spin = QSpinBox()
+        self.image_quality_spin.setRange(30, 100)
+        settings_layout.addRow("Image upload quality", self.image_quality_spin)
+
         self.local_model_input = QLineEdit()
         settings_layout.addRow("Local model path", self.local_model_input)
 
@@ -219,6 +322,74 @@ class MainWindow(QMainWindow):
         self.browse_local_image_model = QPushButton("Browse image model")
         settings_layout.addRow("", self.browse_local_image_model)
 
+        self.image_analysis_mode_combo = QComboBox()
+        self.image_analysis_mode_combo.addItems(["per_image", "batched"])
+        settings_layout.addRow("Local image analysis", self.image_analysis_mode_combo)
+
+        self.image_batch_spin = QSpinBox()
+        self.image_batch_spin.setRange(1, 16)
+        settings_layout.addRow("Photos per batch", self.image_batch_spin)
+
+        self.speculative_mode_combo = QComboBox()
+        self.speculative_mode_combo.addItems(["off", "prompt_lookup", "draft_model"])
+        settings_layout.addRow("Speculative decoding", self.speculative_mode_combo)
+
+        self.draft_model_input = QLineEdit()
+        settings_layout.addRow("Draft model", self.draft_model_input)
+
+        self.browse_draft_model = QPushButton("Browse draft model")
+        settings_layout.addRow("", self.browse_draft_model)
+
+        self.preload_models_check = QCheckBox("Preload local models at startup")
+        settings_layout.addRow("", self.preload_models_check)
+
+        self.model_ram_spin = QSpinBox()
+        self.model_ram_spin.setRange(0, 262144)
+        self.model_ram_spin.setSingleStep(1024)
+        self.model_ram_spin.setSuffix(" MB")
+        self.model_ram_spin.setSpecialValueText("Unlimited")
+        settings_layout.addRow("Model RAM budget", self.model_ram_spin)
+
+        self.max_n_ctx_spin = QSpinBox()
+        self.max_n_ctx_spin.setRange(0, 131072)
+        self.max_n_ctx_spin.setSingleStep(1024)
+        self.max_n_ctx_spin.setSuffix(" tokens")
+        self.max_n_ctx_spin.setSpecialValueText("Model maximum")
+        self.max_n_ctx_spin.setToolTip("Upper limit for the context size of local models")
+        settings_layout.addRow("Max local context", self.max_n_ctx_spin)
+
+        self.stream_output_check = QCheckBox("Stream output while generating")
+        settings_layout.addRow("", self.stream_output_check)
+
+        self.local_parallel_check = QCheckBox("Run local_multi models in parallel")
+        settings_layout.addRow("", self.local_parallel_check)
+
+        self.image_workers_spin = QSpinBox()
+        self.image_workers_spin.setRange(1, 16)
+        settings_layout.addRow("Parallel image workers", self.image_workers_spin)
+
+        self.json_grammar_check = QCheckBox("Constrain local model output to valid JSON")
+        settings_layout.addRow("", self.json_grammar_check)
+
+        self.code_candidates_spin = QSpinBox()
+        self.code_candidates_spin.setRange(1, 8)
+        self.code_candidates_spin.setToolTip("Sample several programs and keep the one that passes the most checks")
+        settings_layout.addRow("Code candidates (best of N)", self.code_candidates_spin)
+
+        self.code_repair_spin = QSpinBox()
+        self.code_repair_spin.setRange(0, 5)
+        self.code_repair_spin.setSpecialValueText("Off")
+        self.code_repair_spin.setToolTip(
+            "When the code fails the Pybricks check, send only the code and the problems back"
+        )
+        settings_layout.addRow("Code repair attempts", self.code_repair_spin)
+
+        self.prefix_cache_check = QCheckBox("Reuse cached prompt prefix state for local models")
+        settings_layout.addRow("", self.prefix_cache_check)
+
+        self.bypass_cache_check = QCheckBox("Bypass response cache")
+        settings_layout.addRow("", self.bypass_cache_check)
+
         left_layout.addWidget(settings_group)
         left_layout.addStretch(1)
 
@@ -236,6 +407,9 @@ class MainWindow(QMainWindow):
         code_layout = QVBoxLayout(code_tab)
         self.copy_code_btn = QPushButton("Copy code")
         code_layout.addWidget(self.copy_code_btn)
+        self.code_alternatives_combo = QComboBox()
+        self.code_alternatives_combo.setVisible(False)
+        code_layout.addWidget(self.code_alternatives_combo)
         code_layout.addWidget(self.code_text)
 
         tutorial_tab = QWidget()
@@ -253,11 +427,47 @@ class MainWindow(QMainWindow):
         action_layout = QHBoxLayout(action_bar)
         self.generate_btn = QPushButton("Generate")
         self.status_label = QLabel("Ready")
+        self.status_label.setWordWrap(True)
         action_layout.addWidget(self.generate_btn)
+        self.priority_combo = QComboBox()
+        self.priority_combo.addItems(list(PRIORITIES))
+        self.priority_combo.setCurrentText("normal")
+        self.priority_combo.setToolTip("Queued jobs run in priority order, one at a time")
+        action_layout.addWidget(self.priority_combo)
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.setEnabled(False)
+        action_layout.addWidget(self.cancel_btn)
+        self.edit_mode_check = QCheckBox("Only regenerate what changed")
+        action_layout.addWidget(self.edit_mode_check)
         action_layout.addWidget(self.status_label)
         action_layout.addStretch(1)
         right_layout.addWidget(action_bar)
 
+        jobs_group = QGroupBox("Jobs")
+        jobs_layout = QVBoxLayout(jobs_group)
+        self.job_list = QListWidget()
+        self.job_list.setMaximumHeight(120)
+        jobs_layout.addWidget(self.job_list)
+        job_buttons = QWidget()
+        job_btn_layout = QHBoxLayout(job_buttons)
+        job_btn_layout.setContentsMargins(0, 0, 0, 0)
+        self.cancel_job_btn = QPushButton("Cancel selected")
+        self.cancel_all_btn = QPushButton("Cancel all")
+        job_btn_layout.addWidget(self.cancel_job_btn)
+        job_btn_layout.addWidget(self.cancel_all_btn)
+        job_btn_layout.addStretch(1)
+        jobs_layout.addWidget(job_buttons)
+        right_layout.addWidget(jobs_group)
+
+        # Coalesces relabelling while a batch of photos is being hashed.
+        self.photo_group_timer = QTimer(self)
+        self.photo_group_timer.setSingleShot(True)
+        self.photo_group_timer.setInterval(100)
+
+        # Refreshes elapsed time and token counts of the running job.
+        self.job_timer = QTimer(self)
+        self.job_timer.setInterval(500)
+
         root.addWidget(left)
         root.addWidget(right)
         root.setStretchFactor(0, 2)
@@ -277,49 +487,246 @@ class MainWindow(QMainWindow):
         self.browse_local_code_model.clicked.connect(self._browse_local_code_model)
         self.browse_local_tutorial_model.clicked.connect(self._browse_local_tutorial_model)
         self.browse_local_image_model.clicked.connect(self._browse_local_image_model)
+        self.browse_draft_model.clicked.connect(self._browse_draft_model)
         self.generate_btn.clicked.connect(self._generate)
+        self.cancel_btn.clicked.connect(self._cancel_running)
+        self.cancel_job_btn.clicked.connect(self._cancel_selected_job)
+        self.cancel_all_btn.clicked.connect(self._cancel_all_jobs)
+        self.job_timer.timeout.connect(self._refresh_jobs)
+        self.photo_signals.hashed.connect(self._on_photo_hashed)
+        self.photo_group_timer.timeout.connect(self._refresh_photo_groups)
+        self.workspace_combo.textActivated.connect(self._switch_workspace)
+        self.new_workspace_btn.clicked.connect(self._new_workspace)
         self.copy_code_btn.clicked.connect(lambda: self._copy_text(self.code_text.toPlainText()))
         self.copy_tutorial_btn.clicked.connect(lambda: self._copy_text(self.tutorial_text.toPlainText()))
 
-        self.ai_mode_combo.currentTextChanged.connect(self._save_settings_from_ui)
-        self.openai_model_input.textChanged.connect(self._save_settings_from_ui)
-        self.api_key_input.textChanged.connect(self._save_settings_from_ui)
-        self.remember_key.stateChanged.connect(self._save_settings_from_ui)
-        self.include_images_check.stateChanged.connect(self._save_settings_from_ui)
-        self.image_detail_combo.currentTextChanged.connect(self._save_settings_from_ui)
-        self.local_model_input.textChanged.connect(self._save_settings_from_ui)
-        self.local_code_model_input.textChanged.connect(self._save_settings_from_ui)
-        self.local_tutorial_model_input.textChanged.connect(self._save_settings_from_ui)
-        self.local_image_model_input.textChanged.connect(self._save_settings_from_ui)
-        self.competition_combo.currentTextChanged.connect(self._save_settings_from_ui)
+        self.ai_mode_combo.currentTextChanged.connect(self._schedule_save)
+        self.hedged_auto_check.stateChanged.connect(self._schedule_save)
+        self.openai_model_input.textChanged.connect(self._schedule_save)
+        self.api_key_input.textChanged.connect(self._schedule_save)
+        self.openai_base_url_input.textChanged.connect(self._schedule_save)
+        self.remember_key.stateChanged.connect(self._schedule_save)
+        self.include_images_check.stateChanged.connect(self._schedule_save)
+        self.dedupe_photos_check.stateChanged.connect(self._on_dedupe_toggled)
+        self.image_detail_combo.currentTextChanged.connect(self._schedule_save)
+        self.image_quality_spin.valueChanged.connect(self._schedule_save)
+        self.local_model_input.textChanged.connect(self._schedule_save)
+        self.local_code_model_input.textChanged.connect(self._schedule_save)
+        self.local_tutorial_model_input.textChanged.connect(self._schedule_save)
+        self.local_image_model_input.textChanged.connect(self._schedule_save)
+        self.speculative_mode_combo.currentTextChanged.connect(self._schedule_save)
+        self.image_analysis_mode_combo.currentTextChanged.connect(self._schedule_save)
+        self.image_batch_spin.valueChanged.connect(self._schedule_save)
+        self.draft_model_input.textChanged.connect(self._schedule_save)
+        self.competition_combo.currentTextChanged.connect(self._schedule_save)
+        self.preload_models_check.stateChanged.connect(self._schedule_save)
+        self.model_ram_spin.valueChanged.connect(self._schedule_save)
+        self.max_n_ctx_spin.valueChanged.connect(self._schedule_save)
+        self.stream_output_check.stateChanged.connect(self._schedule_save)
+        self.local_parallel_check.stateChanged.connect(self._schedule_save)
+        self.image_workers_spin.valueChanged.connect(self._schedule_save)
+        self.json_grammar_check.stateChanged.connect(self._schedule_save)
+        self.code_candidates_spin.valueChanged.connect(self._schedule_save)
+        self.code_repair_spin.valueChanged.connect(self._schedule_save)
+        self.edit_mode_check.stateChanged.connect(self._schedule_save)
+        self.code_alternatives_combo.activated.connect(self._show_code_alternative)
+        self.prefix_cache_check.stateChanged.connect(self._schedule_save)
+        self.bypass_cache_check.stateChanged.connect(self._schedule_save)
+
+        # Mission inputs are part of the workspace; typing only schedules a write.
+        self.task_title.textChanged.connect(self._schedule_save)
+        for editor in (
+            self.tasks_text,
+            self.notes_text,
+            self.parts_text,
+            self.sensors_text,
+            self.constraints_text,
+        ):
+            editor.textChanged.connect(self._schedule_save)
+        self.code_text.textChanged.connect(self._on_output_edited)
+        self.tutorial_text.textChanged.connect(self._on_output_edited)
 
     def _load_settings_into_ui(self):
+        self._loading = True
+        try:
+            self._fill_settings_ui()
+        finally:
+            self._loading = False
+
+    def _fill_settings_ui(self):
         self.competition_combo.setCurrentText(self.settings.competition)
         self.ai_mode_combo.setCurrentText(self.settings.ai_mode)
+        self.hedged_auto_check.setChecked(self.settings.hedged_auto)
         self.openai_model_input.setText(self.settings.openai_model)
         self.api_key_input.setText(self.settings.openai_api_key)
+        self.openai_base_url_input.setText(self.settings.openai_base_url)
         self.remember_key.setChecked(self.settings.remember_api_key)
         self.include_images_check.setChecked(self.settings.include_images)
+        self.dedupe_photos_check.setChecked(self.settings.dedupe_photos)
         self.image_detail_combo.setCurrentText(self.settings.image_detail)
+        self.image_quality_spin.setValue(self.settings.image_quality)
         self.local_model_input.setText(self.settings.local_model_path)
         self.local_code_model_input.setText(self.settings.local_code_model_path)
         self.local_tutorial_model_input.setText(self.settings.local_tutorial_model_path)
         self.local_image_model_input.setText(self.settings.local_image_model_path)
-
-    def _save_settings_from_ui(self):
+        self.speculative_mode_combo.setCurrentText(self.settings.speculative_mode)
+        self.image_analysis_mode_combo.setCurrentText(self.settings.image_analysis_mode)
+        self.image_batch_spin.setValue(self.settings.image_batch_size)
+        self.draft_model_input.setText(self.settings.draft_model_path)
+        self.preload_models_check.setChecked(self.settings.preload_models)
+        self.model_ram_spin.setValue(self.settings.model_pool_ram_mb)
+        self.max_n_ctx_spin.setValue(self.settings.local_max_n_ctx)
+        self.stream_output_check.setChecked(self.settings.stream_output)
+        self.local_parallel_check.setChecked(self.settings.local_parallel)
+        self.image_workers_spin.setValue(self.settings.local_parallel_image_workers)
+        self.json_grammar_check.setChecked(self.settings.json_grammar)
+        self.code_candidates_spin.setValue(self.settings.code_candidates)
+        self.code_repair_spin.setValue(self.settings.code_repair_attempts)
+        self.edit_mode_check.setChecked(self.settings.edit_mode)
+        self.prefix_cache_check.setChecked(self.settings.prefix_cache)
+        self.bypass_cache_check.setChecked(self.settings.bypass_response_cache)
+
+    def _settings_from_ui(self):
         self.settings.competition = self.competition_combo.currentText()
         self.settings.ai_mode = self.ai_mode_combo.currentText()
+        self.settings.hedged_auto = self.hedged_auto_check.isChecked()
         self.settings.openai_model = self.openai_model_input.text().strip() or "gpt-5"
         self.settings.openai_api_key = self.api_key_input.text().strip()
+        self.settings.openai_base_url = self.openai_base_url_input.text().strip()
         self.settings.remember_api_key = self.remember_key.isChecked()
         self.settings.include_images = self.include_images_check.isChecked()
+        self.settings.dedupe_photos = self.dedupe_photos_check.isChecked()
         self.settings.image_detail = self.image_detail_combo.currentText()
+        self.settings.image_quality = self.image_quality_spin.value()
         self.settings.local_model_path = self.local_model_input.text().strip()
         self.settings.local_code_model_path = self.local_code_model_input.text().strip()
         self.settings.local_tutorial_model_path = self.local_tutorial_model_input.text().strip()
         self.settings.local_image_model_path = self.local_image_model_input.text().strip()
+        self.settings.speculative_mode = self.speculative_mode_combo.currentText()
+        self.settings.image_analysis_mode = self.image_analysis_mode_combo.currentText()
+        self.settings.image_batch_size = self.image_batch_spin.value()
+        self.settings.draft_model_path = self.draft_model_input.text().strip()
+        self.settings.preload_models = self.preload_models_check.isChecked()
+        self.settings.model_pool_ram_mb = self.model_ram_spin.value()
+        self.settings.local_max_n_ctx = self.max_n_ctx_spin.value()
+        self.settings.stream_output = self.stream_output_check.isChecked()
+        self.settings.local_parallel = self.local_parallel_check.isChecked()
+        self.settings.local_parallel_image_workers = self.image_workers_spin.value()
+        self.settings.json_grammar = self.json_grammar_check.isChecked()
+        self.settings.code_candidates = self.code_candidates_spin.value()
+        self.settings.code_repair_attempts = self.code_repair_spin.value()
+        self.settings.edit_mode = self.edit_mode_check.isChecked()
+        self.settings.prefix_cache = self.prefix_cache_check.isChecked()
+        self.settings.bypass_response_cache = self.bypass_cache_check.isChecked()
+
+    def _payload(self) -> dict:
+        return {
+            "competition": self.competition_combo.currentText(),
+            "task_title": self.task_title.text().strip(),
+            "tasks": self.tasks_text.toPlainText(),
+            "notes": self.notes_text.toPlainText(),
+            "parts": self.parts_text.toPlainText(),
+            "sensors": self.sensors_text.toPlainText(),
+            "constraints": self.constraints_text.toPlainText(),
+        }
 
-        save_settings(self.settings)
+    def _schedule_save(self):
+        # Only updates memory; the writes happen on the write-behind timer.
+        if self._loading:
+            return
+        self._settings_from_ui()
+        schedule_save_settings(self.settings)
+        self.workspace.inputs = self._payload()
+        self.workspace.settings = project_settings(self.settings)
+        if not self._worker_running():
+            # Hand edits are kept; streamed partial text is not.
+            self.workspace.outputs = {
+                **self.workspace.outputs,
+                "code": self.code_text.toPlainText(),
+                "tutorial": self.tutorial_text.toPlainText(),
+            }
+        schedule_save_workspace(self.workspace)
+
+    def _on_output_edited(self):
+        if self._worker_running():
+            return
+        self._schedule_save()
+
+    def _load_workspace_into_ui(self):
+        self._loading = True
+        try:
+            names = list_workspaces()
+            if self.workspace.name not in names:
+                names = sorted([*names, self.workspace.name])
+            self.workspace_combo.clear()
+            self.workspace_combo.addItems(names)
+            self.workspace_combo.setCurrentText(self.workspace.name)
+
+            inputs = self.workspace.inputs
+            if inputs.get("competition"):
+                self.competition_combo.setCurrentText(inputs["competition"])
+            self.task_title.setText(inputs.get("task_title", ""))
+            self.tasks_text.setPlainText(inputs.get("tasks", ""))
+            self.notes_text.setPlainText(inputs.get("notes", ""))
+            self.parts_text.setPlainText(inputs.get("parts", ""))
+            self.sensors_text.setPlainText(inputs.get("sensors", ""))
+            self.constraints_text.setPlainText(inputs.get("constraints", ""))
+
+            # Names and paths only; the photos themselves are not opened.
+            self.image_paths = []
+            self.image_list.clear()
+            for image in self.workspace.images:
+                self._add_image_item(image.path)
+
+            outputs = self.workspace.outputs
+            self.code_text.setPlainText(outputs.get("code", ""))
+            self.tutorial_text.setPlainText(outputs.get("tutorial", ""))
+            self._show_code_alternatives(outputs.get("code_alternatives") or [])
+            self._last_payload = self.workspace.last_payload
+            self._last_image_paths = list(self.workspace.last_image_paths)
+        finally:
+            self._loading = False
+        self.workspace.seed_digests()
+        # Recorded hashes label the list at once; only new or changed photos
+        # are hashed, in the background.
+        self._hash_photos(self.image_paths)
+        self._refresh_photo_groups()
+
+    def _open_workspace(self, name: str):
+        self._schedule_save()
+        self.workspace = load_workspace(name)
+        if self.workspace.settings:
+            apply_project_settings(self.settings, self.workspace.settings)
+        self.settings.workspace = self.workspace.name
+        self._load_settings_into_ui()
+        self._load_workspace_into_ui()
+        self._schedule_save()
+        self.status_label.setText(f"Opened workspace {self.workspace.name}")
+
+    def _switch_workspace(self, name: str):
+        # Queued results belong to the workspace they were started from.
+        if self._jobs_active():
+            self.workspace_combo.setCurrentText(self.workspace.name)
+            return
+        if name and name != self.workspace.name:
+            self._open_workspace(name)
+
+    def _new_workspace(self):
+        if self._jobs_active():
+            return
+        name, ok = QInputDialog.getText(self, "New workspace", "Workspace name")
+        if ok and name.strip():
+            # A new workspace starts from the current settings with empty inputs.
+            self._open_workspace(name.strip())
+
+    def closeEvent(self, event):
+        self.jobs.cancel_all()
+        if self.worker is not None:
+            # Cancelled runs stop at their next token, so this is short.
+            self.worker.wait(5000)
+        self._schedule_save()
+        get_writer().flush()
+        super().closeEvent(event)
 
     def _add_images(self):
         files, _ = QFileDialog.getOpenFileNames(
@@ -331,16 +738,75 @@ class MainWindow(QMainWindow):
         if not files:
             return
 
+        added = []
         for path in files:
             if path not in self.image_paths:
-                self.image_paths.append(path)
-                item = QListWidgetItem(Path(path).name)
-                item.setToolTip(path)
-                self.image_list.addItem(item)
+                self._add_image_item(path)
+                self.workspace.images.append(ImageRef(path))
+                added.append(path)
+        self._schedule_save()
+        self._hash_photos(added)
+        self._refresh_photo_groups()
+
+    def _dedupe_enabled(self) -> bool:
+        return self.settings.dedupe_photos and hashing_available()
+
+    def _hash_photos(self, paths: list[str]):
+        if not self._dedupe_enabled():
+            return
+        pending = [path for path in paths if not is_hashed(path)]
+        for path, future in hash_in_background(pending):
+            future.add_done_callback(lambda _, path=path: self.photo_signals.hashed.emit(path))
+
+    def _on_photo_hashed(self, path: str):
+        for image in self.workspace.images:
+            if image.path == path:
+                image.refresh_phash()
+        schedule_save_workspace(self.workspace)
+        self.photo_group_timer.start()
+
+    def _on_dedupe_toggled(self):
+        self._schedule_save()
+        self._hash_photos(self.image_paths)
+        self._refresh_photo_groups()
+
+    def _refresh_photo_groups(self):
+        groups = group_photos(self.image_paths, compute=False) if self._dedupe_enabled() else None
+        similar = [group for group in groups.groups if len(group) > 1] if groups else []
+        for index, path in enumerate(self.image_paths):
+            item = self.image_list.item(index)
+            if item is None:
+                continue
+            name = Path(path).name
+            if groups is None:
+                item.setText(name)
+            elif path in groups.pending:
+                item.setText(f"{name} (checking...)")
+            elif path in groups.blank:
+                state = "sent, every photo looks blank" if groups.all_blank else "skipped"
+                item.setText(f"{name} (blank, {state})")
+            else:
+                group = next((group for group in similar if path in group), None)
+                if group is None:
+                    item.setText(name)
+                elif group[0] == path:
+                    number = similar.index(group) + 1
+                    item.setText(f"{name} (group {number}: sent for {len(group)} similar photos)")
+                else:
+                    number = similar.index(group) + 1
+                    item.setText(f"{name} (group {number}: near-copy of {Path(group[0]).name}, skipped)")
+
+    def _add_image_item(self, path: str):
+        self.image_paths.append(path)
+        item = QListWidgetItem(Path(path).name)
+        item.setToolTip(path)
+        self.image_list.addItem(item)
 
     def _clear_images(self):
         self.image_paths = []
         self.image_list.clear()
+        self.workspace.images = []
+        self._schedule_save()
 
     def _browse_local_model(self):
         path, _ = QFileDialog.getOpenFileName(
@@ -382,41 +848,222 @@ class MainWindow(QMainWindow):
         if path:
             self.local_image_model_input.setText(path)
 
+    def _browse_draft_model(self):
+        path, _ = QFileDialog.getOpenFileName(
+            self,
+            "Select small draft .gguf model",
+            str(Path.home()),
+            "GGUF Models (*.gguf)"
+        )
+        if path:
+            self.draft_model_input.setText(path)
+
     def _generate(self):
-        if self.worker and self.worker.isRunning():
-            return
+        self._schedule_save()
+        payload = self._payload()
+
+        previous = None
+        current = {"code": self.code_text.toPlainText(), "tutorial": self.tutorial_text.toPlainText()}
+        if (
+            self.settings.edit_mode
+            and self._last_payload is not None
+            and self.image_paths == self._last_image_paths
+            and (current["code"] or current["tutorial"])
+        ):
+            # Hand-edits in the panes are kept: they are what gets patched.
+            previous = (self._last_payload, current)
+
+        # Each job keeps the settings it was queued with.
+        job = self.jobs.submit(
+            replace(self.settings),
+            payload,
+            self.image_paths,
+            previous,
+            priority=self.priority_combo.currentText(),
+        )
+        if self._worker_running():
+            self.status_label.setText(f"Queued job #{job.job_id} ({self.jobs.pending_count()} waiting)")
+        self._start_next_job()
 
-        self._save_settings_from_ui()
+    def _worker_running(self) -> bool:
+        return bool(self.worker and self.worker.isRunning())
 
-        payload = {
-            "competition": self.competition_combo.currentText(),
-            "task_title": self.task_title.text().strip(),
-            "tasks": self.tasks_text.toPlainText(),
-            "notes": self.notes_text.toPlainText(),
-            "parts": self.parts_text.toPlainText(),
-            "sensors": self.sensors_text.toPlainText(),
-            "constraints": self.constraints_text.toPlainText(),
-        }
+    def _jobs_active(self) -> bool:
+        return self._worker_running() or self.jobs.pending_count() > 0
+
+    def _start_next_job(self):
+        if self._worker_running():
+            self._refresh_jobs()
+            return
+        job = self.jobs.take_next()
+        if job is None:
+            self.cancel_btn.setEnabled(False)
+            self.job_timer.stop()
+            self._refresh_jobs()
+            return
 
-        self.status_label.setText("Generating...")
-        self.generate_btn.setEnabled(False)
+        self.status_label.setText(f"Generating job #{job.job_id}...")
+        self.cancel_btn.setEnabled(True)
+        self._streamed_fields = set()
 
-        self.worker = GenerateThread(self.settings, payload, self.image_paths)
+        self.worker = GenerateThread(job.settings, job.payload, job.image_paths, job.previous, job)
         self.worker.success.connect(self._on_success)
         self.worker.failed.connect(self._on_failed)
+        self.worker.cancelled.connect(self._on_cancelled)
+        self.worker.partial.connect(self._on_partial)
+        self.worker.stream_reset.connect(self._on_stream_reset)
+        self.worker.stage.connect(self._on_stage)
+        # The next job starts only after this thread has fully stopped, so two
+        # runs never compete for the CPU.
+        self.worker.finished.connect(self._start_next_job)
         self.worker.start()
+        self.job_timer.start()
+        self._refresh_jobs()
+
+    def _refresh_jobs(self):
+        selected = self.job_list.currentItem()
+        selected_id = selected.data(Qt.UserRole) if selected else None
+        self.job_list.clear()
+        for job in self.jobs.jobs():
+            item = QListWidgetItem(job.summary())
+            item.setData(Qt.UserRole, job.job_id)
+            if job.error:
+                item.setToolTip(job.error)
+            self.job_list.addItem(item)
+            if job.job_id == selected_id:
+                self.job_list.setCurrentItem(item)
+
+    def _cancel_running(self):
+        job = self.jobs.running()
+        if job is not None:
+            self.jobs.cancel(job.job_id)
+            self.status_label.setText(f"Cancelling job #{job.job_id}...")
+            self.cancel_btn.setEnabled(False)
+
+    def _cancel_selected_job(self):
+        item = self.job_list.currentItem()
+        if item is None:
+            return
+        job_id = item.data(Qt.UserRole)
+        running = self.jobs.running()
+        if running is not None and running.job_id == job_id:
+            self._cancel_running()
+        elif self.jobs.cancel(job_id):
+            self._refresh_jobs()
+
+    def _cancel_all_jobs(self):
+        running = self.jobs.running()
+        if self.jobs.cancel_all() and running is not None:
+            self.status_label.setText(f"Cancelling job #{running.job_id}...")
+            self.cancel_btn.setEnabled(False)
+        self._refresh_jobs()
+
+    def _on_partial(self, field: str, text: str):
+        editor = self.code_text if field == "code" else self.tutorial_text
+        if field not in self._streamed_fields:
+            self._streamed_fields.add(field)
+            editor.clear()
+            self.tabs.setCurrentIndex(0 if field == "code" else 1)
+            if self.worker and self.worker.first_token_s is not None:
+                self.status_label.setText(
+                    f"Generating... (first token after {self.worker.first_token_s:.1f}s)"
+                )
+        cursor = editor.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text)
+
+    def _on_stage(self, breakdown: str):
+        self.status_label.setText(f"Generating... {breakdown}")
+        self._refresh_jobs()
+
+    def _on_stream_reset(self):
+        self._streamed_fields = set()
+        self.status_label.setText("Generating... (retrying with next backend)")
+
+    def _show_code_alternatives(self, alternatives: list[dict]):
+        self.code_alternatives_combo.clear()
+        for index, alternative in enumerate(alternatives, start=1):
+            label = f"Candidate {index}: score {alternative.get('score', 0)}"
+            problems = alternative.get("problems") or []
+            if problems:
+                label += f" ({'; '.join(problems)})"
+            self.code_alternatives_combo.addItem(label, alternative.get("code", ""))
+        self.code_alternatives_combo.setVisible(len(alternatives) > 1)
+
+    def _show_code_alternative(self, index: int):
+        self.code_text.setPlainText(self.code_alternatives_combo.itemData(index) or "")
 
     def _on_success(self, data: dict):
         self.code_text.setPlainText(data.get("code", ""))
+        self._show_code_alternatives(data.get("code_alternatives") or [])
         self.tutorial_text.setPlainText(data.get("tutorial", ""))
-        self.status_label.setText("Done")
-        self.generate_btn.setEnabled(True)
+        if self.worker:
+            self._last_payload = self.worker.payload
+            self._last_image_paths = list(self.worker.image_paths)
+        self.workspace.outputs = {
+            "code": data.get("code", ""),
+            "tutorial": data.get("tutorial", ""),
+            "code_alternatives": data.get("code_alternatives") or [],
+        }
+        self.workspace.last_payload = self._last_payload
+        self.workspace.last_image_paths = list(self._last_image_paths)
+        # The run hashed the photos; keep the digests so reopening skips that.
+        for image in self.workspace.images:
+            image.refresh_digest()
+            image.refresh_phash()
+        schedule_save_workspace(self.workspace)
+        details = []
+        if self.worker and self.worker.patched is not None:
+            patched = self.worker.patched
+            if not patched:
+                details.append("no input changed")
+            else:
+                details.append(f"updated {' and '.join(patched)}" + (" only" if len(patched) == 1 else ""))
+        if self.worker and self.worker.repair:
+            repair = self.worker.repair
+            if repair.get("attempts"):
+                attempts = f"{repair['attempts']} repair{'s' if repair['attempts'] > 1 else ''}"
+                if repair["remaining"]:
+                    details.append(f"code check: {len(repair['remaining'])} problems left after {attempts}")
+                else:
+                    details.append(f"fixed {len(repair['found'])} code problems with {attempts}")
+            if repair.get("warnings"):
+                details.append(f"code check: {'; '.join(repair['warnings'])}")
+        if self.worker and self.worker.cache_hit:
+            hits, misses = cache_stats()
+            details.append(f"from cache, {hits} hits / {misses} misses")
+        if self.worker and self.worker.first_token_s is not None:
+            details.append(f"first token after {self.worker.first_token_s:.1f}s")
+        if self.worker and self.worker.timing_text:
+            details.append(self.worker.timing_text)
+        if self.worker and self.worker.breakdown:
+            details.append(self.worker.breakdown)
+        self.status_label.setText(f"Done ({'; '.join(details)})" if details else "Done")
+        if self.worker and self.worker.job:
+            self.jobs.finish(self.worker.job, DONE)
 
     def _on_failed(self, error: str):
+        summary = error.split("\n", 1)[0]
+        if self.worker and self.worker.job:
+            self.jobs.finish(self.worker.job, FAILED, summary)
+        if self.jobs.pending_count():
+            # A message box would hold up the queue; the job list keeps the error.
+            self.status_label.setText(f"Error: {summary}")
+            return
         self.status_label.setText("Error")
-        self.generate_btn.setEnabled(True)
         QMessageBox.critical(self, "Generation failed", error)
 
+    def _on_cancelled(self):
+        job = self.worker.job if self.worker else None
+        if job is not None:
+            self.jobs.finish(job, CANCELLED)
+        if self._streamed_fields:
+            # Drop the partial text and show the last finished output again.
+            self.code_text.setPlainText(self.workspace.outputs.get("code", ""))
+            self.tutorial_text.setPlainText(self.workspace.outputs.get("tutorial", ""))
+            self._streamed_fields = set()
+        self.status_label.setText(f"Cancelled job #{job.job_id}" if job else "Cancelled")
+
     def _copy_text(self, text: str):
         if not text:
             return
@@ -424,10 +1071,22 @@ class MainWindow(QMainWindow):
         self.status_label.setText("Copied to clipboard")
 
 
+STARTUP_PROBE_ENV = "LEGOSUPERSOFTWARE_STARTUP_PROBE"
+STARTUP_PROBE_MARKER = "LEGOSUPERSOFTWARE_WINDOW_SHOWN"
+
+
 def main():
+    multiprocessing.freeze_support()
     app = QApplication([])
     window = MainWindow()
     window.show()
+
+    if os.environ.get(STARTUP_PROBE_ENV):
+        # Used by startup_budget.py: report once the event loop runs with the
+        # window shown, then exit without starting background work.
+        QTimer.singleShot(0, lambda: (print(STARTUP_PROBE_MARKER, flush=True), app.quit()))
+    else:
+        QTimer.singleShot(0, window.start_background_warmup)
     app.exec()
 
 
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import json
+
+
+def _strip_fences(text: str) -> str:
+    cleaned = text.strip()
+
+    if cleaned.startswith("```"):
+        lines = cleaned.splitlines()
+        if lines and lines[0].startswith("```"):
+            lines = lines[1:]
+        if lines and lines[-1].strip().startswith("```"):
+            lines = lines[:-1]
+        cleaned = "\n".join(lines).strip()
+    return cleaned
+
+
+def _parse_json(cleaned: str) -> dict | None:
+    try:
+        return json.loads(cleaned)
+    except Exception:
+        pass
+
+    start = cleaned.find("{")
+    end = cleaned.rfind("}")
+    if start != -1 and end != -1 and end > start:
+        try:
+            return json.loads(cleaned[start : end + 1])
+        except Exception:
+            pass
+    return None
+
+
+def parse_json_object(text: str):
+    # The JSON value in a reply, without fences or chatter; None if there is none.
+    return _parse_json(_strip_fences(text or ""))
+
+
+def parse_model_output(text: str) -> dict:
+    if not text:
+        return {"code": "", "tutorial": ""}
+
+    cleaned = _strip_fences(text)
+    data = _parse_json(cleaned)
+    if data is not None:
+        return data
+
+    return {
+        "code": cleaned,
+        "tutorial": "",
+    }
+
+
+def is_valid_output(text: str) -> bool:
+    # True only for real JSON with some content, not the raw-text fallback.
+    data = _parse_json(_strip_fences(text or ""))
+    return isinstance(data, dict) and bool(data.get("code") or data.get("tutorial"))
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+from cpu_profile import TUNED_KEYS, profile_kwargs
+from tracing import span
+
+DEFAULT_N_CTX = 4096
+
+
+def _require_llama_cpp():
+    try:
+        from llama_cpp import Llama  # type: ignore
+    except Exception as exc:  # pragma: no cover - runtime import error path
+        raise RuntimeError(
+            "llama-cpp-python is not installed. Install it to use local AI."
+        ) from exc
+    return Llama
+
+
+def _file_signature(path: str | None) -> tuple | None:
+    if not path:
+        return None
+    stat = Path(path).stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class _PoolEntry:
+    def __init__(self, llm, signature: tuple, mmproj_signature: tuple | None, size_bytes: int):
+        self.llm = llm
+        self.signature = signature
+        self.mmproj_signature = mmproj_signature
+        self.size_bytes = size_bytes
+        self.lock = threading.Lock()
+        self.leases = 0
+
+    def close(self) -> None:
+        for owner in (self.llm, getattr(self.llm, "draft_model", None)):
+            close = getattr(owner, "close", None)
+            if callable(close):
+                try:
+                    close()
+                except Exception:
+                    pass
+
+
+def _pool_key(model_path: str, n_ctx: int, mmproj_path: str | None, load_kwargs: dict) -> tuple:
+    return (
+        str(Path(model_path).resolve()),
+        int(n_ctx),
+        mmproj_path or "",
+        tuple(sorted(load_kwargs.items())),
+    )
+
+
+# Loaded models are keyed by (model path, n_ctx, mmproj path, load kwargs). Idle models are
+# evicted least-recently-used first once the RAM budget is exceeded, and a model
+# whose file changed on disk is reloaded on its next lease.
+class ModelPool:
+    def __init__(self, ram_budget_mb: int = 8192):
+        self.ram_budget_mb = ram_budget_mb
+        self._entries: OrderedDict[tuple, _PoolEntry] = OrderedDict()
+        # Stale entries replaced while still leased; closed on their last release.
+        self._retired: list[_PoolEntry] = []
+        self._lock = threading.Lock()
+        self._load_locks: dict[tuple, threading.Lock] = {}
+
+    @property
+    def loaded_bytes(self) -> int:
+        with self._lock:
+            return self._total_bytes()
+
+    def _total_bytes(self) -> int:
+        entries = [*self._entries.values(), *self._retired]
+        return sum(entry.size_bytes for entry in entries)
+
+    def keys(self) -> list[tuple]:
+        with self._lock:
+            return list(self._entries.keys())
+
+    def loaded_contexts(self, model_path: str, mmproj_path: str | None = None, **load_kwargs) -> list[int]:
+        # n_ctx sizes this model is currently loaded with, smallest first.
+        _, _, *rest = _pool_key(model_path, 0, mmproj_path, load_kwargs)
+        with self._lock:
+            return sorted(
+                key[1] for key in self._entries
+                if key[0] == str(Path(model_path).resolve()) and list(key[2:]) == rest
+            )
+
+    @contextmanager
+    def lease(
+        self, model_path: str, n_ctx: int = DEFAULT_N_CTX, mmproj_path: str | None = None, **load_kwargs
+    ):
+        entry = self._acquire(model_path, n_ctx, mmproj_path, load_kwargs)
+        try:
+            with entry.lock:
+                yield entry.llm
+        finally:
+            with self._lock:
+                entry.leases -= 1
+                retired = entry.leases == 0 and entry in self._retired
+                if retired:
+                    self._retired.remove(entry)
+            if retired:
+                entry.close()
+
+    def _acquire(
+        self, model_path: str, n_ctx: int, mmproj_path: str | None, load_kwargs: dict
+    ) -> _PoolEntry:
+        key = _pool_key(model_path, n_ctx, mmproj_path, load_kwargs)
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Serialize loads of the same key so a background preload and a Generate
+        # click never load the same file twice.
+        with load_lock:
+            signature = _file_signature(model_path)
+            mmproj_signature = _file_signature(mmproj_path)
+
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and (
+                    entry.signature != signature or entry.mmproj_signature != mmproj_signature
+                ):
+                    if entry.leases == 0:
+                        self._drop(key)
+                    else:
+                        # Still in use: keep it until its last lease ends.
+                        self._retired.append(self._entries.pop(key))
+                    entry = None
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    entry.leases += 1
+                    return entry
+
+            size_bytes = signature[1] + (mmproj_signature[1] if mmproj_signature else 0)
+            speculative = load_kwargs.get("speculative")
+            if speculative and speculative[0] == "draft_model":
+                size_bytes += _file_signature(speculative[1])[1]
+            self._make_room(size_bytes)
+            tuned = {name: load_kwargs[name] for name in TUNED_KEYS if name in load_kwargs}
+            with span("model_load", model=Path(model_path).name, n_ctx=n_ctx, **tuned):
+                llm = self._load(model_path, n_ctx, mmproj_path, load_kwargs)
+
+            with self._lock:
+                entry = _PoolEntry(llm, signature, mmproj_signature, size_bytes)
+                entry.leases += 1
+                self._entries[key] = entry
+                return entry
+
+    def _load(self, model_path: str, n_ctx: int, mmproj_path: str | None, load_kwargs: dict):
+        Llama = _require_llama_cpp()
+        load_kwargs = dict(load_kwargs)
+        speculative = load_kwargs.pop("speculative", None)
+        if speculative:
+            from speculative import make_draft_model
+
+            load_kwargs["draft_model"] = make_draft_model(
+                speculative, n_ctx, load_kwargs.get("n_threads")
+            )
+        if not mmproj_path:
+            return Llama(model_path=model_path, n_ctx=n_ctx, **load_kwargs)
+
+        try:
+            from llama_cpp.llava_cpp import Llava15ChatHandler  # type: ignore
+        except Exception as exc:
+            raise RuntimeError(
+                "Image analysis requires llama-cpp-python built with vision support "
+                "(LLaVA-style). Install/upgrade it or use OpenAI for images."
+            ) from exc
+        chat_handler = Llava15ChatHandler(clip_model_path=mmproj_path)
+        return Llama(model_path=model_path, chat_handler=chat_handler, n_ctx=n_ctx, **load_kwargs)
+
+    def _make_room(self, incoming_bytes: int) -> None:
+        budget = self.ram_budget_mb * 1024 * 1024
+        if budget <= 0:
+            return
+        with self._lock:
+            total = self._total_bytes()
+            for key in list(self._entries.keys()):
+                if total + incoming_bytes <= budget:
+                    break
+                entry = self._entries[key]
+                if entry.leases:
+                    continue
+                total -= entry.size_bytes
+                self._drop(key)
+
+    def _drop(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.close()
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if not entry.leases]:
+                self._drop(key)
+
+
+_POOL = ModelPool()
+
+
+def get_pool() -> ModelPool:
+    return _POOL
+
+
+def tuned_load_kwargs(settings, model_path: str, load_kwargs: dict) -> dict:
+    # The autotuned profile for this machine and model; explicit options such
+    # as the split thread count of parallel workers take precedence.
+    return {**profile_kwargs(settings, model_path), **load_kwargs}
+
+
+def lease_model(
+    settings, model_path: str, n_ctx: int = DEFAULT_N_CTX, mmproj_path: str | None = None, **load_kwargs
+):
+    _POOL.ram_budget_mb = settings.model_pool_ram_mb
+    load_kwargs = tuned_load_kwargs(settings, model_path, load_kwargs)
+    return _POOL.lease(model_path, n_ctx=n_ctx, mmproj_path=mmproj_path, **load_kwargs)
+
+
+def preload_models(settings) -> threading.Thread:
+    from ai_local_multi import _guess_mmproj_path
+    from speculative import speculative_kwargs
+
+    try:
+        speculative = speculative_kwargs(settings)
+    except ValueError:
+        speculative = {}
+
+    # Load options must match the ones used at generation time to share a pool entry.
+    targets = []
+    for path, load_kwargs in (
+        (settings.local_model_path, speculative),
+        (settings.local_code_model_path, speculative),
+        (settings.local_tutorial_model_path, {}),
+    ):
+        if path and Path(path).exists():
+            targets.append((path, None, load_kwargs))
+    if settings.local_image_model_path and Path(settings.local_image_model_path).exists():
+        mmproj_path = _guess_mmproj_path(settings.local_image_model_path)
+        if mmproj_path:
+            targets.append((settings.local_image_model_path, mmproj_path, {}))
+
+    def _run():
+        for path, mmproj_path, load_kwargs in targets:
+            try:
+                with lease_model(settings, path, mmproj_path=mmproj_path, **load_kwargs):
+                    pass
+            except Exception:
+                continue
+
+    thread = threading.Thread(target=_run, name="model-preload", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import threading
+
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+# The SDK default of 5 s drops the connection between two Generate clicks.
+KEEPALIVE_EXPIRY_S = 60.0
+
+RETRY_BASE_DELAY_S = 0.5
+RETRY_MAX_DELAY_S = 20.0
+
+_LOCK = threading.Lock()
+_CLIENT: OpenAI | None = None
+_CLIENT_KEY: tuple[str, str] | None = None
+
+
+def resolve_api_key(settings) -> str:
+    api_key = settings.openai_api_key or os.getenv("OPENAI_API_KEY", "")
+    if not api_key:
+        raise ValueError("OpenAI API key is missing. Set it in the app or in OPENAI_API_KEY.")
+    return api_key
+
+
+def _limits():
+    # Build the Limits type of whichever httpx flavour the SDK was built against.
+    return type(openai.DEFAULT_CONNECTION_LIMITS)(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY_S,
+    )
+
+
+def get_client(settings) -> OpenAI:
+    # One long-lived client keeps connections and TLS sessions alive between
+    # requests; it is rebuilt when the API key or base URL changes.
+    global _CLIENT, _CLIENT_KEY
+    key = (resolve_api_key(settings), settings.openai_base_url or "")
+    with _LOCK:
+        if _CLIENT is not None and _CLIENT_KEY == key:
+            return _CLIENT
+        # The old client is not closed here: a hedged race or a batch job may
+        # still be using it. It is released once its last caller drops it.
+        _CLIENT = OpenAI(
+            api_key=key[0],
+            base_url=key[1] or None,
+            http_client=openai.DefaultHttpxClient(limits=_limits()),
+        )
+        _CLIENT_KEY = key
+        return _CLIENT
+
+
+def close_client() -> None:
+    global _CLIENT, _CLIENT_KEY
+    with _LOCK:
+        previous, _CLIENT, _CLIENT_KEY = _CLIENT, None, None
+    if previous is not None:
+        previous.close()
+
+
+def make_async_client(settings) -> AsyncOpenAI:
+    # Async connections belong to one event loop, so callers own this client
+    # for the life of their loop. Retries are handled by with_retries().
+    return AsyncOpenAI(
+        api_key=resolve_api_key(settings),
+        base_url=settings.openai_base_url or None,
+        http_client=openai.DefaultAsyncHttpxClient(limits=_limits()),
+        max_retries=0,
+    )
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code >= 500
+
+
+def _retry_delay(exc: Exception, attempt: int) -> float:
+    response = getattr(exc, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY_S)
+        except ValueError:
+            pass
+    # Exponential backoff with full jitter.
+    return random.uniform(0, min(RETRY_MAX_DELAY_S, RETRY_BASE_DELAY_S * 2**attempt))
+
+
+async def with_retries(call, max_retries: int):
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except Exception as exc:
+            if attempt >= max_retries or not is_retryable(exc):
+                raise
+            await asyncio.sleep(_retry_delay(exc, attempt))
+            attempt += 1
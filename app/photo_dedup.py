@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+
+# 8x8 low-frequency DCT coefficients of a 32x32 grayscale thumbnail: a 64-bit
+# hash that survives re-encoding, small shifts and exposure changes.
+HASH_SIZE = 8
+SAMPLE_SIZE = 32
+# Photos whose hashes differ in at most this many of the 64 bits are treated
+# as the same shot.
+NEAR_DUPLICATE_BITS = 10
+# Thumbnails with less contrast than this (grayscale standard deviation,
+# 0-255) are lens-cap, pocket or fully blown-out shots.
+BLANK_STDDEV = 4.0
+HASH_WORKERS = 4
+
+_MISSING = object()
+# (resolved path, mtime_ns, size) -> PhotoHash, or None for unreadable files.
+_HASHES: dict[tuple, PhotoHash | None] = {}
+_LOCK = threading.Lock()
+_POOL: ThreadPoolExecutor | None = None
+
+
+@dataclass(frozen=True)
+class PhotoHash:
+    bits: bytes
+    blank: bool = False
+
+    def to_hex(self) -> str:
+        return self.bits.hex()
+
+    @classmethod
+    def from_hex(cls, text: str, blank: bool = False) -> PhotoHash:
+        return cls(bytes.fromhex(text), blank)
+
+
+@dataclass
+class PhotoGroups:
+    # Each group lists its photos in the given order; the first one is sent.
+    groups: list[list[str]] = field(default_factory=list)
+    blank: list[str] = field(default_factory=list)
+    # Not hashed yet (only when grouping without computing).
+    pending: list[str] = field(default_factory=list)
+
+    @property
+    def representatives(self) -> list[str]:
+        return [group[0] for group in self.groups]
+
+    @property
+    def all_blank(self) -> bool:
+        # Every photo looks blank, e.g. a set of very dark shots. Callers then
+        # keep all of them rather than sending none.
+        return bool(self.blank) and not self.groups and not self.pending
+
+    def group_of(self, path: str) -> tuple[int, list[str]] | None:
+        for index, group in enumerate(self.groups):
+            if path in group:
+                return index, group
+        return None
+
+
+def _file_key(path: str) -> tuple | None:
+    try:
+        stat = Path(path).stat()
+    except OSError:
+        return None
+    return (str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=1)
+def _dct_matrix():
+    import numpy as np
+
+    index = np.arange(SAMPLE_SIZE)
+    matrix = np.cos(np.pi * (2 * index[None, :] + 1) * index[:, None] / (2 * SAMPLE_SIZE))
+    matrix[0] *= 1 / np.sqrt(2)
+    return (matrix * np.sqrt(2 / SAMPLE_SIZE)).astype(np.float32)
+
+
+def _compute_hash(path: str) -> PhotoHash | None:
+    import numpy as np
+    from PIL import Image, ImageOps  # type: ignore
+
+    try:
+        with Image.open(path) as image:
+            # The JPEG decoder scales down while decoding; a 12 MP photo is
+            # never decoded at full size.
+            image.draft("L", (SAMPLE_SIZE * 4, SAMPLE_SIZE * 4))
+            image = ImageOps.exif_transpose(image).convert("L")
+            image = image.resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.BILINEAR)
+            pixels = np.asarray(image, dtype=np.float32)
+    except Exception:
+        return None
+    dct = _dct_matrix()
+    low = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term only carries the overall brightness; leave it out of the median.
+    bits = low > np.median(low[1:])
+    return PhotoHash(np.packbits(bits).tobytes(), float(pixels.std()) < BLANK_STDDEV)
+
+
+@lru_cache(maxsize=1)
+def hashing_available() -> bool:
+    try:
+        import numpy  # noqa: F401
+        from PIL import Image  # type: ignore # noqa: F401
+    except Exception:
+        return False
+    return True
+
+
+def photo_hash(path: str) -> PhotoHash | None:
+    # Memoized by (path, mtime, size) like content_hash.file_digest. None when
+    # the file cannot be read or numpy / Pillow are missing.
+    key = _file_key(path)
+    if key is None or not hashing_available():
+        return None
+    with _LOCK:
+        cached = _HASHES.get(key, _MISSING)
+    if cached is not _MISSING:
+        return cached
+    result = _compute_hash(path)
+    with _LOCK:
+        _HASHES[key] = result
+    return result
+
+
+def cached_hash(path: str):
+    # The memoized hash without computing it; _MISSING when not hashed yet.
+    key = _file_key(path)
+    if key is None:
+        return None
+    with _LOCK:
+        return _HASHES.get(key, _MISSING)
+
+
+def is_hashed(path: str) -> bool:
+    return cached_hash(path) is not _MISSING
+
+
+def known_photo_hash(path: str) -> tuple[int, int, PhotoHash] | None:
+    # (mtime_ns, size, hash) if this session already hashed the file as it is now.
+    key = _file_key(path)
+    if key is None:
+        return None
+    with _LOCK:
+        result = _HASHES.get(key)
+    return (key[1], key[2], result) if isinstance(result, PhotoHash) else None
+
+
+def remember_photo_hash(path: str, mtime_ns: int, size: int, photo: PhotoHash) -> None:
+    # Seeds the memo with a hash recorded earlier; it is only used while the
+    # file still has that mtime and size.
+    with _LOCK:
+        _HASHES[(str(Path(path).resolve()), int(mtime_ns), int(size))] = photo
+
+
+def hash_in_background(paths: list[str]) -> list[tuple[str, Future]]:
+    global _POOL
+    with _LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="photo-hash")
+        pool = _POOL
+    return [(path, pool.submit(photo_hash, path)) for path in paths]
+
+
+def _distances(hashes: list[PhotoHash]):
+    # Pairwise Hamming distances of all hashes in one shot: (N, N) bit counts.
+    import numpy as np
+
+    packed = np.frombuffer(b"".join(photo.bits for photo in hashes), dtype=np.uint8)
+    packed = packed.reshape(len(hashes), -1)
+    return np.unpackbits(packed[:, None, :] ^ packed[None, :, :], axis=2).sum(axis=2)
+
+
+def group_photos(
+    paths: list[str], compute: bool = True, max_bits: int = NEAR_DUPLICATE_BITS
+) -> PhotoGroups:
+    # Greedy in the given order: a photo joins the closest earlier group
+    # leader within max_bits, otherwise it leads a new group. Photos that
+    # cannot be hashed always form their own group.
+    result = PhotoGroups()
+    slots: list[int | None] = []
+    hashed: list[PhotoHash] = []
+    for path in paths:
+        photo = photo_hash(path) if compute else cached_hash(path)
+        if photo is _MISSING:
+            result.pending.append(path)
+            photo = None
+        if isinstance(photo, PhotoHash) and photo.blank:
+            result.blank.append(path)
+            slots.append(None)
+            continue
+        if isinstance(photo, PhotoHash):
+            slots.append(len(hashed))
+            hashed.append(photo)
+        else:
+            slots.append(None)
+
+    distances = _distances(hashed) if len(hashed) > 1 else None
+    blank = set(result.blank)
+    leader_slots: list[int] = []
+    leader_groups: list[list[str]] = []
+    for path, slot in zip(paths, slots):
+        if path in blank:
+            continue
+        if slot is not None and distances is not None and leader_slots:
+            row = distances[slot, leader_slots]
+            nearest = int(row.argmin())
+            if row[nearest] <= max_bits:
+                leader_groups[nearest].append(path)
+                continue
+        result.groups.append([path])
+        if slot is not None:
+            leader_slots.append(slot)
+            leader_groups.append(result.groups[-1])
+    return result
+
+
+def representative_paths(paths: list[str]) -> list[str]:
+    # One photo per group of near-duplicates, blank shots left out.
+    if not paths or not hashing_available():
+        return list(paths)
+    groups = group_photos(paths)
+    return list(paths) if groups.all_blank else groups.representatives
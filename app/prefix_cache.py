@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import hashlib
+import pickle
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from app_settings import SETTINGS_DIR
+from disk_cache import DiskCache
+from prompt_templates import prompt_prefix
+from tracing import span
+
+KV_CACHE_DIR = SETTINGS_DIR / "kv_cache"
+MEMORY_ENTRIES = 4
+
+_DISK = DiskCache(KV_CACHE_DIR, suffix=".state")
+_MEMORY: OrderedDict[str, object] = OrderedDict()
+_LOCK = threading.Lock()
+
+
+def _cache_key(llm, model_path: str, prefix: str) -> str:
+    stat = Path(model_path).stat()
+    identity = f"{Path(model_path).resolve()}|{stat.st_mtime_ns}|{stat.st_size}|{llm.n_ctx()}"
+    digest = hashlib.sha256()
+    digest.update(identity.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(prefix.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _has_prefix_loaded(llm, tokens: list[int]) -> bool:
+    current = getattr(llm, "_input_ids", None)
+    if current is None or len(current) < len(tokens):
+        return False
+    return list(current[: len(tokens)]) == tokens
+
+
+def _remember(key: str, state) -> None:
+    with _LOCK:
+        _MEMORY[key] = state
+        _MEMORY.move_to_end(key)
+        while len(_MEMORY) > MEMORY_ENTRIES:
+            _MEMORY.popitem(last=False)
+
+
+def _load_from_disk(key: str):
+    data = _DISK.get_bytes(key)
+    if data is None:
+        return None
+    try:
+        return pickle.loads(data)
+    except Exception:
+        _DISK.discard(key)
+        return None
+
+
+def _save_to_disk(key: str, state, max_mb: int) -> None:
+    _DISK.max_bytes = max_mb * 1024 * 1024
+    _DISK.put_bytes(key, pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def prime_prefix(settings, llm, model_path: str, prompt: str) -> int:
+    with span("prefix_cache") as current:
+        reused = _prime_prefix(settings, llm, model_path, prompt)
+        current.set(tokens=reused)
+        return reused
+
+
+def _prime_prefix(settings, llm, model_path: str, prompt: str) -> int:
+    # Load (or compute and store) the KV state of the fixed prompt prefix so
+    # llama.cpp only evaluates the mission-specific tail of the prompt. Returns
+    # the number of prefix tokens that no longer need evaluation.
+    if not settings.prefix_cache:
+        return 0
+
+    prefix = prompt_prefix(prompt)
+    if not prefix:
+        return 0
+
+    tokens = llm.tokenize(prefix.encode("utf-8"))
+    if _has_prefix_loaded(llm, tokens):
+        return len(tokens)
+
+    key = _cache_key(llm, model_path, prefix)
+    with _LOCK:
+        state = _MEMORY.get(key)
+        if state is not None:
+            _MEMORY.move_to_end(key)
+    if state is None:
+        state = _load_from_disk(key)
+        if state is not None:
+            _remember(key, state)
+
+    if state is not None:
+        try:
+            llm.load_state(state)
+            return len(tokens)
+        except Exception:
+            with _LOCK:
+                _MEMORY.pop(key, None)
+
+    llm.reset()
+    llm.eval(tokens)
+    state = llm.save_state()
+    _remember(key, state)
+    try:
+        _save_to_disk(key, state, settings.prefix_cache_max_mb)
+    except OSError:
+        pass
+    return len(tokens)
@@ -1,9 +1,13 @@
-﻿SYSTEM_INSTRUCTIONS = (
+﻿import re
+
+SYSTEM_INSTRUCTIONS = (
     "You are a robotics coach and Pybricks engineer for LEGO SPIKE Prime. "
     "Generate reliable, competition-ready plans. "
     "Return only JSON."
 )
 
+PROMPT_INPUTS_HEADER = "Inputs:\n"
+
 JSON_SCHEMA = {
     "code": "<pybricks code as a single string>",
     "tutorial": "<step-by-step build tutorial as a single string>"
@@ -26,7 +30,7 @@ def build_user_prompt(payload: dict) -> str:
         "- The code must be complete and runnable\n"
         "- The tutorial must be step-by-step and practical\n"
         "- Assume team has standard SPIKE Prime set unless parts say otherwise\n\n"
-        "Inputs:\n"
+        f"{PROMPT_INPUTS_HEADER}"
         f"Tasks/Missions:\n{tasks}\n\n"
         f"Notes/Observations:\n{notes}\n\n"
         f"Available Parts/Hardware:\n{parts}\n\n"
@@ -34,3 +38,93 @@ def build_user_prompt(payload: dict) -> str:
         f"Constraints/Rules:\n{constraints}\n\n"
         "Now produce the JSON."
     )
+
+
+# Section headers of build_user_prompt, in order, and the line that ends it.
+_PROMPT_SECTIONS = (
+    ("tasks", "Tasks/Missions:\n"),
+    ("notes", "\n\nNotes/Observations:\n"),
+    ("parts", "\n\nAvailable Parts/Hardware:\n"),
+    ("sensors", "\n\nSensors/Ports/Motors:\n"),
+    ("constraints", "\n\nConstraints/Rules:\n"),
+)
+_PROMPT_END = "\n\nNow produce the JSON."
+
+
+def parse_user_prompt(prompt: str) -> dict | None:
+    # Inverse of build_user_prompt, for requests that only carry the prompt
+    # text. Returns None for any other prompt.
+    match = re.match(r"Create a Pybricks program .*? for a LEGO (.*?) competition\.", prompt)
+    inputs_at = prompt.find(PROMPT_INPUTS_HEADER)
+    if not match or inputs_at == -1 or not prompt.endswith(_PROMPT_END):
+        return None
+    payload = {"competition": match.group(1)}
+    if prompt_prefix(build_user_prompt(payload)) != prompt[: inputs_at + len(PROMPT_INPUTS_HEADER)]:
+        return None
+    body = prompt[inputs_at + len(PROMPT_INPUTS_HEADER) : -len(_PROMPT_END)]
+    for index, (key, header) in enumerate(_PROMPT_SECTIONS):
+        if not body.startswith(header):
+            return None
+        body = body[len(header) :]
+        if index + 1 < len(_PROMPT_SECTIONS):
+            end = body.find(_PROMPT_SECTIONS[index + 1][1])
+            if end == -1:
+                return None
+            payload[key], body = body[:end], body[end:]
+        else:
+            payload[key] = body
+    return payload
+
+
+PAYLOAD_LABELS = {
+    "competition": "Competition",
+    "task_title": "Task title",
+    "tasks": "Tasks/Missions",
+    "notes": "Notes/Observations",
+    "parts": "Available Parts/Hardware",
+    "sensors": "Sensors/Ports/Motors",
+    "constraints": "Constraints/Rules",
+}
+
+ARTIFACT_LABELS = {"code": "Pybricks program", "tutorial": "build tutorial"}
+
+
+def build_patch_prompt(payload: dict, previous_payload: dict, target: str, current: str, changed: list[str]) -> str:
+    # Starts with the regular prompt so local models reuse its cached state.
+    label = ARTIFACT_LABELS[target]
+    changes = "\n".join(
+        f"- {PAYLOAD_LABELS.get(field, field)}: was {previous_payload.get(field, '').strip()!r}, "
+        f"now {payload.get(field, '').strip()!r}"
+        for field in changed
+    )
+    return (
+        f"{build_user_prompt(payload)}\n\n"
+        f"Current {label}:\n{current}\n\n"
+        f"Changed inputs:\n{changes}\n\n"
+        f"Patch the current {label} so it matches the updated inputs. Keep everything "
+        "the change does not affect exactly as it is. "
+        f"Return ONLY JSON with the single key {target} holding the complete updated {label}."
+    )
+
+
+def build_repair_prompt(code: str, problems: list[str], sensors: str = "") -> str:
+    # Only the program and what is wrong with it; the mission sheet is left
+    # out so a repair costs a fraction of a full generation.
+    ports = f"Sensors/Ports/Motors:\n{sensors.strip()}\n\n" if sensors.strip() else ""
+    issues = "\n".join(f"- {problem}" for problem in problems)
+    return (
+        "This Pybricks program for LEGO SPIKE Prime fails a static check.\n\n"
+        f"{ports}"
+        f"Program:\n{code}\n\n"
+        f"Problems:\n{issues}\n\n"
+        "Fix only these problems and keep everything else exactly as it is. "
+        f"Return ONLY JSON with the single key code holding the complete fixed {ARTIFACT_LABELS['code']}."
+    )
+
+
+def prompt_prefix(prompt: str) -> str:
+    # Everything up to the Inputs header is fixed text shared by every run.
+    index = prompt.find(PROMPT_INPUTS_HEADER)
+    if index == -1:
+        return ""
+    return prompt[: index + len(PROMPT_INPUTS_HEADER)]
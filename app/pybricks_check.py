@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import ast
+import re
+from dataclasses import dataclass, field
+
+# Public names of the Pybricks modules available on SPIKE Prime firmware.
+PYBRICKS_MODULES = {
+    "pybricks": {"version"},
+    "pybricks.hubs": {
+        "PrimeHub", "InventorHub", "EssentialHub", "TechnicHub", "CityHub", "MoveHub",
+    },
+    "pybricks.pupdevices": {
+        "Motor", "DCMotor", "ColorSensor", "UltrasonicSensor", "ForceSensor",
+        "ColorDistanceSensor", "ColorLightMatrix", "InfraredSensor", "TiltSensor",
+        "Light", "Remote", "PFMotor",
+    },
+    "pybricks.parameters": {"Port", "Direction", "Stop", "Color", "Button", "Side", "Axis", "Icon"},
+    "pybricks.robotics": {"DriveBase", "GyroDriveBase", "Car"},
+    "pybricks.tools": {
+        "wait", "StopWatch", "multitask", "run_task", "Matrix", "vector", "cross",
+        "hub_menu", "read_input_byte", "AppData",
+    },
+    "pybricks.iodevices": {"PUPDevice", "LWP3Device", "XboxController"},
+}
+
+_MOTOR = {
+    "angle", "reset_angle", "speed", "load", "stalled", "run", "stop", "brake", "hold",
+    "run_time", "run_angle", "run_target", "run_until_stalled", "dc", "track_target", "done",
+    "close", "settings", "control", "model",
+}
+_DRIVEBASE = {
+    "straight", "turn", "curve", "arc", "settings", "drive", "stop", "brake", "distance", "angle",
+    "state", "reset", "done", "stalled", "use_gyro", "heading_control", "distance_control",
+}
+_HUB = {"light", "display", "speaker", "buttons", "imu", "system", "battery", "charger", "ble"}
+
+# Members of the Pybricks objects a program creates, for checking calls such
+# as robot.straight() or hub.imu.heading(). Classes not listed are not checked.
+PYBRICKS_API = {
+    "Motor": _MOTOR,
+    "DCMotor": {"dc", "stop", "brake", "settings", "close"},
+    "ColorSensor": {"color", "reflection", "ambient", "hsv", "detectable_colors", "lights"},
+    "UltrasonicSensor": {"distance", "presence", "lights"},
+    "ForceSensor": {"force", "distance", "pressed", "touched"},
+    "ColorDistanceSensor": {"color", "reflection", "ambient", "distance", "hsv", "detectable_colors", "light"},
+    "DriveBase": _DRIVEBASE,
+    "GyroDriveBase": _DRIVEBASE,
+    "StopWatch": {"time", "pause", "resume", "reset"},
+    "PrimeHub": _HUB,
+    "InventorHub": _HUB,
+    "HubLight": {"on", "off", "blink", "animate"},
+    "HubDisplay": {"orientation", "off", "pixel", "icon", "animate", "number", "char", "text"},
+    "HubSpeaker": {"volume", "beep", "play_notes"},
+    "HubButtons": {"pressed"},
+    "HubIMU": {
+        "ready", "stationary", "up", "tilt", "acceleration", "angular_velocity", "heading",
+        "reset_heading", "rotation", "orientation", "settings",
+    },
+    "HubSystem": {"info", "set_stop_button", "name", "storage", "reset_reason", "shutdown"},
+    "HubBattery": {"voltage", "current"},
+    "HubCharger": {"connected", "current", "status"},
+    "HubBLE": {"broadcast", "observe", "signal_strength", "version"},
+    "SensorLights": {"on", "off"},
+}
+# (class, member) -> class of the member object.
+API_MEMBERS = {
+    **{
+        (hub, member): f"Hub{member.upper() if member in ('imu', 'ble') else member.capitalize()}"
+        for hub in ("PrimeHub", "InventorHub")
+        for member in _HUB
+    },
+    ("ColorSensor", "lights"): "SensorLights",
+    ("UltrasonicSensor", "lights"): "SensorLights",
+}
+# Enum-like classes whose members are read straight off the class.
+PYBRICKS_CONSTANTS = {
+    "Port": {"A", "B", "C", "D", "E", "F"},
+    "Direction": {"CLOCKWISE", "COUNTERCLOCKWISE"},
+    "Stop": {"COAST", "COAST_SMART", "BRAKE", "HOLD", "NONE"},
+    "Color": {
+        "BLACK", "GRAY", "WHITE", "RED", "ORANGE", "BROWN", "YELLOW", "GREEN", "CYAN", "BLUE",
+        "VIOLET", "MAGENTA", "NONE",
+    },
+    "Side": {"TOP", "BOTTOM", "FRONT", "BACK", "LEFT", "RIGHT"},
+    "Axis": {"X", "Y", "Z"},
+}
+# Classes that take a port as their first argument.
+PORT_DEVICES = {
+    "Motor", "DCMotor", "ColorSensor", "UltrasonicSensor", "ForceSensor", "ColorDistanceSensor",
+    "ColorLightMatrix", "InfraredSensor", "TiltSensor", "Light", "PFMotor", "PUPDevice",
+}
+
+# "port A", "Ports B and C", "Port.D" or a line starting with "E:".
+_PORT_LIST = re.compile(
+    r"\bports?\b[\s:]*([A-F](?:\s*(?:,|/|&|\+|and)\s*[A-F])*)\b", re.IGNORECASE
+)
+_PORT_ATTR = re.compile(r"\bPort\.([A-F])\b")
+_PORT_LINE = re.compile(r"^\s*([A-F])\s*[:=-]", re.MULTILINE)
+_PORT_WORD = re.compile(r"\bports?\b", re.IGNORECASE)
+# A capital A-F standing alone, e.g. "left motor A" or "A (left)", and ranges like "A-D".
+_PORT_LETTER = re.compile(r"(?<![\w.])([A-F])(?!\w)")
+_PORT_RANGE = re.compile(r"(?<![\w.])([A-F])\s*(?:-|to)\s*([A-F])(?!\w)")
+
+# MicroPython modules built into the firmware, with and without the u prefix.
+MICROPYTHON_MODULES = {
+    prefix + name
+    for name in ("math", "random", "struct", "sys", "io", "select", "json", "errno")
+    for prefix in ("", "u")
+} | {"micropython"}
+
+MAX_SCORE = 100
+_SYNTAX_PENALTY = 100
+_UNKNOWN_MODULE_PENALTY = 20
+_UNKNOWN_NAME_PENALTY = 15
+_NO_PYBRICKS_PENALTY = 30
+_UNKNOWN_MEMBER_PENALTY = 15
+_NOT_IMPORTED_PENALTY = 15
+_PORT_PENALTY = 15
+
+
+@dataclass
+class CodeReport:
+    score: int
+    problems: list[str] = field(default_factory=list)
+    # Doubts that are not scored and never trigger a repair.
+    warnings: list[str] = field(default_factory=list)
+
+    @property
+    def clean(self) -> bool:
+        return not self.problems
+
+
+def _check_module(module: str, problems: list[str]) -> int:
+    if module in PYBRICKS_MODULES or module in MICROPYTHON_MODULES:
+        return 0
+    problems.append(f"unknown module {module}")
+    return _UNKNOWN_MODULE_PENALTY
+
+
+def _letters(text: str) -> set[str]:
+    letters = set(_PORT_LETTER.findall(text))
+    for first, last in _PORT_RANGE.findall(text):
+        letters.update(chr(code) for code in range(ord(first), ord(last) + 1))
+    return letters
+
+
+def declared_ports(sensors: str) -> set[str]:
+    # Port letters the Sensors/Ports field clearly lists as ports: "port A",
+    # "Port.B", a line starting with "C:", or any capital A-F on a line that
+    # mentions ports, e.g. "Drive: A (left), B (right); Color sensor: port E".
+    # Empty when the field does not talk about ports.
+    ports = set()
+    for match in _PORT_LIST.finditer(sensors):
+        ports.update(letter.upper() for letter in re.findall(r"\b[A-Fa-f]\b", match.group(1)))
+    ports.update(_PORT_ATTR.findall(sensors))
+    ports.update(_PORT_LINE.findall(sensors))
+    for line in sensors.splitlines():
+        if _PORT_WORD.search(line):
+            ports.update(_letters(line))
+    return ports
+
+
+def mentioned_ports(sensors: str) -> set[str]:
+    # Every capital A-F in the field, whether or not it says "port".
+    return declared_ports(sensors) | _letters(sensors)
+
+
+def _bound_names(tree: ast.AST) -> set[str]:
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name == "*":
+                    # `from pybricks.hubs import *` binds everything the module exports.
+                    names.update(PYBRICKS_MODULES.get(getattr(node, "module", None), ()))
+                else:
+                    names.add((alias.asname or alias.name).split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+    return names
+
+
+class _ApiChecker:
+    # Resolves what each name refers to from the imports and from assignments
+    # such as `left = Motor(Port.A)`, then checks member access against
+    # PYBRICKS_API. Flow-insensitive: the last assignment to a name wins.
+    def __init__(self, tree: ast.AST):
+        self.tree = tree
+        self.imported: dict[str, str] = {}
+        self.instances: dict[str, str] = {}
+        self.problems: list[str] = []
+        self.warnings: list[str] = []
+        self.penalty = 0
+        self.ports: dict[str, int] = {}
+        self.port_devices: dict[str, set[str]] = {}
+
+    def run(self) -> None:
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.ImportFrom) and node.module in PYBRICKS_MODULES:
+                for alias in node.names:
+                    if alias.name == "*":
+                        for name in PYBRICKS_MODULES[node.module]:
+                            self.imported.setdefault(name, name)
+                    else:
+                        self.imported[alias.asname or alias.name] = alias.name
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.Assign) and isinstance(node.value, ast.Call):
+                cls = self._class_of_call(node.value)
+                for target in node.targets:
+                    if cls in PYBRICKS_API and isinstance(target, ast.Name):
+                        self.instances[target.id] = cls
+        self._check_unimported()
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.Attribute):
+                self._check_member(node)
+            elif isinstance(node, ast.Call):
+                self._record_port_device(node)
+
+    def _class_of_call(self, call: ast.Call) -> str | None:
+        if isinstance(call.func, ast.Name):
+            return self.imported.get(call.func.id)
+        return None
+
+    def _type_of(self, node: ast.AST) -> str | None:
+        if isinstance(node, ast.Name):
+            return self.instances.get(node.id)
+        if isinstance(node, ast.Attribute):
+            owner = self._type_of(node.value)
+            return API_MEMBERS.get((owner, node.attr)) if owner else None
+        return None
+
+    def _add(self, problem: str, penalty: int) -> None:
+        if problem not in self.problems:
+            self.problems.append(problem)
+            self.penalty += penalty
+
+    def _check_member(self, node: ast.Attribute) -> None:
+        if isinstance(node.value, ast.Name) and node.value.id in self.imported:
+            constants = PYBRICKS_CONSTANTS.get(self.imported[node.value.id])
+            if constants is None:
+                return
+            if node.attr not in constants:
+                self._add(
+                    f"line {node.lineno}: {self.imported[node.value.id]}.{node.attr} does not exist",
+                    _UNKNOWN_MEMBER_PENALTY,
+                )
+            elif self.imported[node.value.id] == "Port":
+                self.ports.setdefault(node.attr, node.lineno)
+            return
+        owner = self._type_of(node.value)
+        if owner and node.attr not in PYBRICKS_API[owner]:
+            self._add(
+                f"line {node.lineno}: {owner.removeprefix('Hub')} has no {node.attr}",
+                _UNKNOWN_MEMBER_PENALTY,
+            )
+
+    def _record_port_device(self, call: ast.Call) -> None:
+        cls = self._class_of_call(call)
+        if cls not in PORT_DEVICES or not call.args:
+            return
+        port = call.args[0]
+        if (
+            isinstance(port, ast.Attribute)
+            and isinstance(port.value, ast.Name)
+            and self.imported.get(port.value.id) == "Port"
+        ):
+            self.port_devices.setdefault(port.attr, set()).add(cls)
+
+    def _check_unimported(self) -> None:
+        exported = set().union(*PYBRICKS_MODULES.values())
+        bound = _bound_names(self.tree)
+        for node in ast.walk(self.tree):
+            if (
+                isinstance(node, ast.Name)
+                and isinstance(node.ctx, ast.Load)
+                and node.id in exported
+                and node.id not in bound
+            ):
+                self._add(f"line {node.lineno}: {node.id} is used but not imported", _NOT_IMPORTED_PENALTY)
+
+    def check_ports(self, sensors: str) -> None:
+        for port, devices in sorted(self.port_devices.items()):
+            if len(devices) > 1:
+                self._add(f"Port.{port} is used by {' and '.join(sorted(devices))}", _PORT_PENALTY)
+        # A port is only a problem when the field clearly lists ports and the
+        # letter appears nowhere in it. Free-form text that names letters
+        # without saying "port" may be parsed wrongly, so there it is only a
+        # warning, which never sends working code to a repair.
+        declared = declared_ports(sensors)
+        mentioned = mentioned_ports(sensors)
+        if not mentioned:
+            return
+        listed = ", ".join(sorted(mentioned))
+        for port, line in sorted(self.ports.items()):
+            if port in mentioned:
+                continue
+            message = f"line {line}: Port.{port} is not in the Sensors/Ports field ({listed})"
+            if declared:
+                self._add(message, _PORT_PENALTY)
+            elif message not in self.warnings:
+                self.warnings.append(message)
+
+
+def check_code(code: str, sensors: str = "") -> CodeReport:
+    # Cheap static score: the code must parse, only import what the hub has,
+    # only use Pybricks members that exist and only the ports in `sensors`.
+    if not code.strip():
+        return CodeReport(0, ["no code"])
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as exc:
+        return CodeReport(MAX_SCORE - _SYNTAX_PENALTY, [f"syntax error on line {exc.lineno}: {exc.msg}"])
+
+    problems: list[str] = []
+    penalty = 0
+    uses_pybricks = False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                uses_pybricks |= alias.name.split(".")[0] == "pybricks"
+                penalty += _check_module(alias.name, problems)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            uses_pybricks |= node.module.split(".")[0] == "pybricks"
+            penalty += _check_module(node.module, problems)
+            known = PYBRICKS_MODULES.get(node.module)
+            if known is None:
+                continue
+            for alias in node.names:
+                if alias.name != "*" and alias.name not in known:
+                    problems.append(f"{node.module} has no {alias.name}")
+                    penalty += _UNKNOWN_NAME_PENALTY
+
+    if not uses_pybricks:
+        problems.append("does not import pybricks")
+        penalty += _NO_PYBRICKS_PENALTY
+
+    checker = _ApiChecker(tree)
+    checker.run()
+    checker.check_ports(sensors)
+    problems.extend(checker.problems)
+    penalty += checker.penalty
+    return CodeReport(max(1, MAX_SCORE - penalty), problems, checker.warnings)
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+
+from app_settings import SETTINGS_DIR
+from content_hash import file_digest
+from disk_cache import DiskCache
+
+RESPONSE_CACHE_DIR = SETTINGS_DIR / "response_cache"
+CACHE_VERSION = 1
+
+_CACHE = DiskCache(RESPONSE_CACHE_DIR, suffix=".json")
+
+
+def _model_signature(path: str) -> list:
+    if not path:
+        return []
+    try:
+        stat = Path(path).stat()
+    except OSError:
+        return [path]
+    return [path, stat.st_mtime_ns, stat.st_size]
+
+
+def response_cache_key(settings, payload: dict, image_paths: list[str]) -> str:
+    key_data = {
+        "version": CACHE_VERSION,
+        "payload": payload,
+        "ai_mode": settings.ai_mode,
+        "openai_model": settings.openai_model,
+        # A team server and api.openai.com can serve the same model name.
+        "openai_base_url": settings.openai_base_url,
+        "image_detail": settings.image_detail,
+        "image_quality": settings.image_quality,
+        "include_images": settings.include_images,
+        "local_model": _model_signature(settings.local_model_path),
+        "local_code_model": _model_signature(settings.local_code_model_path),
+        "local_tutorial_model": _model_signature(settings.local_tutorial_model_path),
+        "local_image_model": _model_signature(settings.local_image_model_path),
+        "temperature": settings.temperature,
+        "max_output_tokens": settings.max_output_tokens,
+        # Caps the context, so it decides how much of a long input was trimmed.
+        "local_max_n_ctx": settings.local_max_n_ctx,
+        "code_candidates": settings.code_candidates,
+        "code_repair_attempts": settings.code_repair_attempts,
+        "image_analysis_mode": settings.image_analysis_mode,
+        "image_batch_size": settings.image_batch_size,
+        "images": [file_digest(path) for path in image_paths],
+    }
+    encoded = json.dumps(key_data, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def lookup_response(settings, key: str) -> dict | None:
+    _CACHE.max_bytes = settings.response_cache_max_mb * 1024 * 1024
+    data = _CACHE.get_json(key)
+    return data if isinstance(data, dict) else None
+
+
+def store_response(settings, key: str, data: dict) -> None:
+    _CACHE.max_bytes = settings.response_cache_max_mb * 1024 * 1024
+    try:
+        _CACHE.put_json(key, data)
+    except OSError:
+        pass
+
+
+def cache_stats() -> tuple[int, int]:
+    return _CACHE.hits, _CACHE.misses
+
+
+def clear_response_cache() -> None:
+    _CACHE.clear()
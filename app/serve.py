@@ -0,0 +1,562 @@
+from __future__ import annotations
+
+import argparse
+import base64
+import hashlib
+import json
+import queue
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+if __package__:
+    # Allow `python -m app.serve` from the repo root; the app modules use flat imports.
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from app_settings import load_settings
+from cancellation import GenerationCancelled, use_cancel_event
+from prompt_templates import SYSTEM_INSTRUCTIONS, parse_user_prompt
+from tracing import start_trace
+
+DEFAULT_PORT = 8765
+QUEUE_LIMIT = 32
+# How long a worker waits after taking a request for others with the same prompt.
+BATCH_WINDOW_S = 0.02
+MAX_BATCH = 8
+SERVE_MODES = ("local", "local_multi")
+
+_SINGLE_KEY = re.compile(r"single key (code|tutorial)\b")
+_DATA_URL = re.compile(r"data:image/(\w+);base64,(.*)", re.DOTALL)
+
+
+@dataclass
+class Job:
+    request: dict
+    text: str
+    image_urls: list[str]
+    stream: bool
+    # Requests with the same batch key share a prompt; with the same exact key
+    # they would produce the same generation.
+    batch_key: tuple
+    exact_key: tuple
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    started_at: float = 0.0
+    batch_size: int = 1
+    # ("started",), ("delta", text), ("done", result) or ("error", status, message)
+    events: queue.Queue = field(default_factory=queue.Queue)
+    cancel: threading.Event = field(default_factory=threading.Event)
+
+
+def _request_input(request: dict) -> tuple[str, list[str]]:
+    texts, images = [], []
+    items = request.get("input")
+    if isinstance(items, str):
+        items = [{"role": "user", "content": items}]
+    for item in items or []:
+        content = item.get("content") if isinstance(item, dict) else None
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "input_text":
+                texts.append(part.get("text", ""))
+            elif part.get("type") == "input_image" and part.get("image_url"):
+                images.append(part["image_url"])
+    return "\n\n".join(texts), images
+
+
+def make_job(request: dict) -> Job:
+    text, image_urls = _request_input(request)
+    images_digest = hashlib.sha256("\0".join(image_urls).encode("utf-8")).hexdigest()
+    batch_key = (text, images_digest, request.get("max_output_tokens"))
+    return Job(
+        request=request,
+        text=text,
+        image_urls=image_urls,
+        stream=bool(request.get("stream")),
+        batch_key=batch_key,
+        # Streamed runs skip the code repair, so they only share with each other.
+        exact_key=(*batch_key, request.get("temperature"), bool(request.get("stream"))),
+    )
+
+
+class RequestQueue:
+    def __init__(self, limit: int = QUEUE_LIMIT):
+        self.limit = limit
+        self._jobs: deque[Job] = deque()
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._jobs)
+
+    def put(self, job: Job) -> bool:
+        with self._cond:
+            if len(self._jobs) >= self.limit:
+                return False
+            self._jobs.append(job)
+            self._cond.notify()
+            return True
+
+    def take_batch(self, window_s: float = BATCH_WINDOW_S, max_batch: int = MAX_BATCH) -> list[Job]:
+        # The oldest request plus any queued within the window that share its
+        # prompt; other requests keep their place in the queue.
+        with self._cond:
+            while not self._jobs:
+                self._cond.wait()
+            first = self._jobs.popleft()
+        if window_s > 0 and max_batch > 1:
+            time.sleep(window_s)
+        with self._cond:
+            matches = [job for job in self._jobs if job.batch_key == first.batch_key][: max_batch - 1]
+            for job in matches:
+                self._jobs.remove(job)
+        return [first, *matches]
+
+
+class _FieldEncoder:
+    # Turns per-field deltas back into the raw JSON text an OpenAI model would
+    # stream, so the client's incremental parser sees the same thing.
+    def __init__(self):
+        self.field: str | None = None
+
+    def delta(self, field_name: str, text: str) -> str:
+        prefix = ""
+        if field_name != self.field:
+            prefix = ("{" if self.field is None else '", ') + json.dumps(field_name) + ': "'
+            self.field = field_name
+        return prefix + json.dumps(text)[1:-1]
+
+    def close(self) -> str:
+        return '"}' if self.field is not None else ""
+
+
+def _write_images(image_urls: list[str], directory: Path) -> list[str]:
+    paths = []
+    for index, url in enumerate(image_urls):
+        match = _DATA_URL.match(url)
+        if not match:
+            raise ValueError("Only base64 data URLs are supported for input_image.")
+        path = directory / f"image_{index:03d}.{match.group(1)}"
+        path.write_bytes(base64.b64decode(match.group(2)))
+        paths.append(str(path))
+    return paths
+
+
+def _usage(trace) -> tuple[int, int]:
+    spans = trace.spans if trace is not None else []
+    return (
+        sum(span.attrs.get("prompt_tokens", 0) for span in spans),
+        sum(span.attrs.get("completion_tokens", 0) for span in spans),
+    )
+
+
+def _server_timing(job: Job, processing_s: float, trace) -> str:
+    entries = [f"queue;dur={(job.started_at - job.enqueued_at) * 1000:.1f}"]
+    for span in trace.spans if trace is not None else []:
+        if span.duration_s is not None:
+            entries.append(f"{span.name};dur={span.duration_s * 1000:.1f}")
+    entries.append(f"total;dur={processing_s * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def _response_object(text: str, model: str, usage: tuple[int, int], metadata: dict) -> dict:
+    response_id = f"resp_{uuid.uuid4().hex}"
+    return {
+        "id": response_id,
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": "completed",
+        "output": [
+            {
+                "id": f"msg_{response_id[5:]}",
+                "type": "message",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }
+        ],
+        "parallel_tool_calls": False,
+        "tool_choice": "auto",
+        "tools": [],
+        "metadata": metadata,
+        "usage": {
+            "input_tokens": usage[0],
+            "output_tokens": usage[1],
+            "total_tokens": usage[0] + usage[1],
+        },
+    }
+
+
+# Serves the local backends behind a Responses-style endpoint. HTTP handler
+# threads only queue requests; worker threads run them one batch at a time.
+class InferenceServer:
+    def __init__(
+        self,
+        settings,
+        workers: int = 1,
+        queue_limit: int = QUEUE_LIMIT,
+        batch_window_s: float = BATCH_WINDOW_S,
+        api_key: str = "",
+    ):
+        if settings.ai_mode not in SERVE_MODES:
+            raise ValueError(f"Serve mode must be one of {', '.join(SERVE_MODES)}.")
+        self.settings = settings
+        self.workers = max(1, workers)
+        self.queue = RequestQueue(queue_limit)
+        self.batch_window_s = batch_window_s
+        self.api_key = api_key
+        self.stats = {"requests": 0, "rejected": 0, "batches": 0, "batched": 0, "shared": 0}
+        self._stats_lock = threading.Lock()
+        self._http: ThreadingHTTPServer | None = None
+
+    def _count(self, **increments) -> None:
+        with self._stats_lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def submit(self, request: dict) -> Job | None:
+        job = make_job(request)
+        if not self.queue.put(job):
+            self._count(rejected=1)
+            return None
+        self._count(requests=1)
+        return job
+
+    def start(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> str:
+        handler = type("Handler", (_ResponsesHandler,), {"inference": self})
+        self._http = ThreadingHTTPServer((host, port), handler)
+        self._http.daemon_threads = True
+        for index in range(self.workers):
+            threading.Thread(target=self._work, name=f"serve-worker-{index}", daemon=True).start()
+        threading.Thread(target=self._http.serve_forever, name="serve-http", daemon=True).start()
+        return f"http://{host}:{self._http.server_address[1]}/v1"
+
+    def shutdown(self) -> None:
+        if self._http is not None:
+            self._http.shutdown()
+            self._http.server_close()
+
+    def _work(self) -> None:
+        while True:
+            self._run_batch(self.queue.take_batch(self.batch_window_s))
+
+    def _run_batch(self, batch: list[Job]) -> None:
+        # llama.cpp evaluates one sequence at a time, so a batch runs back to
+        # back on the same loaded model: later requests reuse the evaluated
+        # prompt, and identical ones share a single generation.
+        self._count(batches=1, batched=len(batch))
+        results: dict[tuple, dict] = {}
+        for job in batch:
+            if job.cancel.is_set():
+                continue
+            job.started_at = time.perf_counter()
+            job.batch_size = len(batch)
+            job.events.put(("started",))
+            if job.exact_key in results:
+                self._count(shared=1)
+                job.events.put(("done", results[job.exact_key]))
+                continue
+            try:
+                result = self._run_job(job)
+            except GenerationCancelled:
+                job.events.put(("error", 499, "Request was cancelled."))
+                continue
+            except Exception as exc:
+                job.events.put(("error", 500, str(exc)))
+                continue
+            results[job.exact_key] = result
+            job.events.put(("done", result))
+
+    def _job_settings(self, job: Job):
+        request = job.request
+        temperature = request.get("temperature")
+        return replace(
+            self.settings,
+            temperature=self.settings.temperature if temperature is None else float(temperature),
+            max_output_tokens=int(request.get("max_output_tokens") or self.settings.max_output_tokens),
+            stream_output=job.stream,
+            # Best-of-N is the client's job: it sends one request per candidate.
+            code_candidates=1,
+            # A streaming client builds its output from the deltas already
+            # sent, so a repair made afterwards would never reach it.
+            code_repair_attempts=0 if job.stream else self.settings.code_repair_attempts,
+        )
+
+    def _run_job(self, job: Job) -> dict:
+        from generation import generate
+
+        settings = self._job_settings(job)
+        encoder = _FieldEncoder()
+
+        def _forward(field_name: str, text: str) -> None:
+            job.events.put(("delta", encoder.delta(field_name, text)))
+
+        on_delta = _forward if job.stream else None
+
+        payload = parse_user_prompt(job.text)
+        with tempfile.TemporaryDirectory(prefix="legosupersoftware-serve-") as directory:
+            with use_cancel_event(job.cancel):
+                image_paths = _write_images(job.image_urls, Path(directory))
+                if payload is not None:
+                    result = generate(settings, payload, image_paths, on_delta=on_delta)
+                    text, trace = json.dumps(result.data), result.trace
+                else:
+                    with start_trace(
+                        "serve_completion", write_log=settings.trace_log, mode=settings.ai_mode
+                    ) as trace:
+                        text = self._complete_prompt(settings, job.text, on_delta)
+        if job.stream and encoder.field is not None:
+            job.events.put(("delta", encoder.close()))
+
+        processing_s = time.perf_counter() - job.started_at
+        return {
+            "text": text,
+            "streamed": encoder.field is not None,
+            "usage": _usage(trace),
+            "processing_s": processing_s,
+            "server_timing": _server_timing(job, processing_s, trace),
+        }
+
+    def _complete_prompt(self, settings, prompt: str, on_delta=None) -> str:
+        # Prompts that are not a mission sheet, e.g. edit-mode patches.
+        match = _SINGLE_KEY.search(prompt)
+        if match:
+            from incremental import complete_role
+
+            return complete_role(
+                settings, settings.ai_mode, match.group(1), lambda _: prompt, {}, on_delta
+            )
+
+        from context_budget import plan_prompt
+        from local_completion import complete
+        from model_pool import lease_model
+
+        if settings.ai_mode == "local":
+            model_path = settings.local_model_path
+        else:
+            model_path = settings.local_code_model_path
+        full_prompt, plan = plan_prompt(
+            settings, model_path, lambda _: f"{SYSTEM_INSTRUCTIONS}\n\n{prompt}", {}
+        )
+        with lease_model(settings, model_path, n_ctx=plan.n_ctx) as llm:
+            return complete(llm, full_prompt, plan.max_tokens, settings.temperature, span_name="completion")
+
+
+class _ResponsesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    inference: InferenceServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, data: dict, headers: dict | None = None) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error_json(self, status: int, message: str, headers: dict | None = None) -> None:
+        self._send_json(status, {"error": {"message": message, "type": "server_error"}}, headers)
+
+    def _authorized(self) -> bool:
+        key = self.inference.api_key
+        return not key or self.headers.get("Authorization", "") == f"Bearer {key}"
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        if path.endswith("/health"):
+            stats = {"status": "ok", "queued": len(self.inference.queue), **self.inference.stats}
+            self._send_json(200, stats)
+        elif path.endswith("/models"):
+            mode = self.inference.settings.ai_mode
+            models = [{"id": mode, "object": "model", "owned_by": "local"}]
+            self._send_json(200, {"object": "list", "data": models})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/responses"):
+            self.send_error(404)
+            return
+        if not self._authorized():
+            self._send_error_json(401, "Invalid API key for this server.")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error_json(400, "Request body is not valid JSON.")
+            return
+        job = self.inference.submit(request)
+        if job is None:
+            # The OpenAI client retries 429s after Retry-After.
+            self._send_error_json(429, "Server queue is full.", {"Retry-After": "1"})
+            return
+        if job.stream:
+            self._stream(job)
+        else:
+            self._respond(job)
+
+    def _timing_headers(self, job: Job, result: dict | None = None) -> dict:
+        headers = {
+            "X-Queue-Time-Ms": f"{(job.started_at - job.enqueued_at) * 1000:.1f}",
+            "X-Batch-Size": str(job.batch_size),
+        }
+        if result is not None:
+            headers["X-Processing-Time-Ms"] = f"{result['processing_s'] * 1000:.1f}"
+            headers["Server-Timing"] = result["server_timing"]
+        return headers
+
+    def _metadata(self, job: Job, result: dict) -> dict:
+        # Streamed responses send their headers before the work is done, so the
+        # timings are repeated here.
+        return {
+            "queue_ms": f"{(job.started_at - job.enqueued_at) * 1000:.1f}",
+            "processing_ms": f"{result['processing_s'] * 1000:.1f}",
+            "batch_size": str(job.batch_size),
+        }
+
+    def _respond(self, job: Job) -> None:
+        while True:
+            event = job.events.get()
+            if event[0] == "done":
+                result = event[1]
+                model = job.request.get("model") or self.inference.settings.ai_mode
+                response = _response_object(
+                    result["text"], model, result["usage"], self._metadata(job, result)
+                )
+                self._send_json(200, response, self._timing_headers(job, result))
+                return
+            if event[0] == "error":
+                self._send_error_json(event[1], event[2], self._timing_headers(job))
+                return
+
+    def _stream(self, job: Job) -> None:
+        event = job.events.get()
+        if event[0] == "error":
+            self._send_error_json(event[1], event[2])
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        for name, value in self._timing_headers(job).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.close_connection = True
+
+        model = job.request.get("model") or self.inference.settings.ai_mode
+        sequence = 0
+
+        def send(data: dict) -> None:
+            nonlocal sequence
+            data["sequence_number"] = sequence
+            sequence += 1
+            self.wfile.write(f"event: {data['type']}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        def delta(text: str) -> None:
+            send(
+                {
+                    "type": "response.output_text.delta",
+                    "item_id": "msg_local",
+                    "output_index": 0,
+                    "content_index": 0,
+                    "delta": text,
+                    "logprobs": [],
+                }
+            )
+
+        try:
+            created = {**_response_object("", model, (0, 0), {}), "status": "in_progress", "output": []}
+            send({"type": "response.created", "response": created})
+            while True:
+                event = job.events.get()
+                if event[0] == "delta":
+                    delta(event[1])
+                elif event[0] == "done":
+                    result = event[1]
+                    if not result["streamed"]:
+                        # Shared or cached results arrive whole.
+                        delta(result["text"])
+                    response = _response_object(
+                        result["text"], model, result["usage"], self._metadata(job, result)
+                    )
+                    send({"type": "response.completed", "response": response})
+                    return
+                elif event[0] == "error":
+                    send({"type": "error", "code": str(event[1]), "message": event[2], "param": None})
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; stop generating at the next token.
+            job.cancel.set()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Serve the local models to other PCs through an OpenAI-compatible "
+        "Responses endpoint."
+    )
+    parser.add_argument("--mode", choices=SERVE_MODES, help="Local backend to serve (default: saved mode)")
+    parser.add_argument("--host", default="127.0.0.1", help="Use 0.0.0.0 to accept other PCs")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=1, help="Requests generated at the same time")
+    parser.add_argument("--queue", type=int, default=QUEUE_LIMIT, help="Queued requests before 429")
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_S * 1000)
+    parser.add_argument("--api-key", default="", help="Require this key from clients")
+    parser.add_argument("--settings", type=Path, help="JSON file with AppSettings overrides")
+    parser.add_argument("--no-preload", action="store_true", help="Load models on the first request")
+    args = parser.parse_args(argv)
+
+    settings = load_settings()
+    overrides = {}
+    if args.settings:
+        overrides.update(json.loads(args.settings.read_text(encoding="utf-8")))
+    if args.mode:
+        overrides["ai_mode"] = args.mode
+    unknown = sorted(key for key in overrides if not hasattr(settings, key))
+    if unknown:
+        print(f"Unknown settings: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    settings = replace(settings, **overrides)
+    if settings.ai_mode not in SERVE_MODES:
+        print(f"Choose --mode {' or '.join(SERVE_MODES)}.", file=sys.stderr)
+        return 2
+
+    server = InferenceServer(
+        settings,
+        workers=args.workers,
+        queue_limit=args.queue,
+        batch_window_s=args.batch_window_ms / 1000,
+        api_key=args.api_key,
+    )
+    if not args.no_preload:
+        from model_pool import preload_models
+
+        preload_models(replace(settings, preload_models=True))
+    url = server.start(args.host, args.port)
+    print(f"Serving {settings.ai_mode} at {url}")
+    print("Set this as the OpenAI base URL in the app and use the openai mode.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
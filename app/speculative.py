@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+
+def speculative_kwargs(settings) -> dict:
+    # Hashable load option for the model pool; the draft object itself is
+    # created when the model is loaded.
+    mode = settings.speculative_mode
+    tokens = max(1, int(settings.speculative_tokens))
+    if mode == "prompt_lookup":
+        return {"speculative": ("prompt_lookup", tokens)}
+    if mode == "draft_model":
+        if not settings.draft_model_path:
+            raise ValueError(
+                "Draft model path is empty. Select a small .gguf from the same model family."
+            )
+        return {"speculative": ("draft_model", settings.draft_model_path, tokens)}
+    return {}
+
+
+def make_draft_model(spec: tuple, n_ctx: int, n_threads: int | None = None):
+    if spec[0] == "prompt_lookup":
+        try:
+            from llama_cpp.llama_speculative import LlamaPromptLookupDecoding  # type: ignore
+        except Exception as exc:
+            raise RuntimeError(
+                "Speculative decoding needs a newer llama-cpp-python (0.2.40 or later)."
+            ) from exc
+        return MeasuredDraft(LlamaPromptLookupDecoding(num_pred_tokens=spec[1]))
+    _, model_path, tokens = spec
+    return MeasuredDraft(GgufDraftModel(model_path, tokens, n_ctx, n_threads))
+
+
+class GgufDraftModel:
+    # Greedy drafts from a small model that shares the main model's vocabulary.
+    # Its KV cache is kept between calls, so each call only evaluates the
+    # tokens the main model added since the last draft.
+
+    def __init__(self, model_path: str, num_draft_tokens: int, n_ctx: int, n_threads: int | None = None):
+        from model_pool import _require_llama_cpp
+
+        Llama = _require_llama_cpp()
+        kwargs = {"n_threads": n_threads} if n_threads else {}
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, verbose=False, **kwargs)
+        self.num_draft_tokens = num_draft_tokens
+
+    def __call__(self, input_ids, **kwargs):
+        import numpy as np
+
+        llm = self.llm
+        ids = input_ids.tolist()
+        if not ids or len(ids) + self.num_draft_tokens > llm.n_ctx():
+            return np.array([], dtype=np.intc)
+
+        shared = 0
+        for cached, token in zip(llm.input_ids[: llm.n_tokens].tolist(), ids):
+            if cached != token:
+                break
+            shared += 1
+        # The last token is always evaluated again so there are logits to sample from.
+        llm.n_tokens = min(shared, len(ids) - 1)
+        llm.eval(ids[llm.n_tokens :])
+
+        drafted = []
+        eos = llm.token_eos()
+        for _ in range(self.num_draft_tokens):
+            token = llm.sample(temp=0.0)
+            if token == eos:
+                break
+            drafted.append(token)
+            if len(drafted) < self.num_draft_tokens:
+                llm.eval([token])
+        return np.array(drafted, dtype=np.intc)
+
+    def close(self) -> None:
+        close = getattr(self.llm, "close", None)
+        if callable(close):
+            close()
+
+
+class MeasuredDraft:
+    # Wraps a draft model and counts how many drafted tokens the main model kept.
+    # The next call's input shows what was accepted: the drafted tokens that
+    # match, followed by one token sampled by the main model.
+
+    def __init__(self, draft):
+        self.draft = draft
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.drafted = 0
+        self.accepted = 0
+        self._last_length = 0
+        self._last_draft: list[int] = []
+
+    def stats(self) -> tuple[int, int]:
+        # The final draft of a run is never checked, so it is not counted.
+        return self.drafted - len(self._last_draft), self.accepted
+
+    def __call__(self, input_ids, **kwargs):
+        ids = input_ids.tolist()
+        if self._last_draft and len(ids) > self._last_length:
+            for drafted, token in zip(self._last_draft, ids[self._last_length :]):
+                if drafted != token:
+                    break
+                self.accepted += 1
+        draft = self.draft(input_ids, **kwargs)
+        self._last_length = len(ids)
+        self._last_draft = draft.tolist()
+        self.drafted += len(self._last_draft)
+        return draft
+
+    def close(self) -> None:
+        close = getattr(self.draft, "close", None)
+        if callable(close):
+            close()
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent
+
+# Must match main.py; not imported from there to keep this script's own
+# imports out of the measurements.
+STARTUP_PROBE_ENV = "LEGOSUPERSOFTWARE_STARTUP_PROBE"
+STARTUP_PROBE_MARKER = "LEGOSUPERSOFTWARE_WINDOW_SHOWN"
+
+# Modules the GUI imports before the window appears, followed by the backends
+# that should only be loaded after it.
+MODULES = [
+    "app_settings",
+    "generation",
+    "model_pool",
+    "response_cache",
+    "PySide6.QtWidgets",
+    "main",
+    "ai_local",
+    "ai_local_multi",
+    "ai_openai",
+]
+
+EAGER_MODULES = ("ai_openai", "ai_local", "ai_local_multi", "openai", "llama_cpp")
+
+
+def _python_env() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(APP_DIR), env.get("PYTHONPATH", "")]))
+    if sys.platform.startswith("linux") and not env.get("DISPLAY"):
+        env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    return env
+
+
+def measure_import(module: str) -> float | None:
+    # Each module is imported in a fresh interpreter so the time includes
+    # everything it pulls in.
+    code = (
+        "import time; started = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - started)"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, env=_python_env(), cwd=APP_DIR
+    )
+    if completed.returncode != 0:
+        return None
+    return float(completed.stdout.strip().splitlines()[-1])
+
+
+def eager_backend_imports() -> list[str]:
+    code = (
+        "import sys, main; "
+        f"print(','.join(name for name in {EAGER_MODULES!r} if name in sys.modules))"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, env=_python_env(), cwd=APP_DIR
+    )
+    if completed.returncode != 0:
+        return []
+    loaded = completed.stdout.strip().splitlines()[-1] if completed.stdout.strip() else ""
+    return [name for name in loaded.split(",") if name]
+
+
+def measure_first_window(timeout: float = 60.0) -> float | None:
+    env = _python_env()
+    env[STARTUP_PROBE_ENV] = "1"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, str(APP_DIR / "main.py")],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        env=env,
+        cwd=APP_DIR,
+    )
+    try:
+        for line in process.stdout:
+            if line.strip() == STARTUP_PROBE_MARKER:
+                return time.perf_counter() - started
+            if time.perf_counter() - started > timeout:
+                break
+        return None
+    finally:
+        process.kill()
+        process.wait()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Report GUI import times and time-to-first-window.")
+    parser.add_argument("--max-window-s", type=float, default=3.0)
+    parser.add_argument("--max-main-import-s", type=float, default=2.0)
+    parser.add_argument("--runs", type=int, default=3, help="Window launches; the best is used")
+    parser.add_argument("--json", type=Path, help="Also write the report to this file")
+    args = parser.parse_args(argv)
+
+    imports = {module: measure_import(module) for module in MODULES}
+    eager = eager_backend_imports()
+    windows = [measure_first_window() for _ in range(max(1, args.runs))]
+    window_times = [value for value in windows if value is not None]
+    first_window = min(window_times) if window_times else None
+
+    for module, seconds in imports.items():
+        shown = "not importable" if seconds is None else f"{seconds * 1000:8.1f} ms"
+        print(f"import {module:<20} {shown}")
+    print(f"backends loaded by main: {', '.join(eager) or 'none'}")
+    print("time to first window: " + ("failed" if first_window is None else f"{first_window:.2f} s"))
+
+    failures = []
+    main_import = imports.get("main")
+    if main_import is None:
+        failures.append("main could not be imported")
+    elif main_import > args.max_main_import_s:
+        failures.append(f"import main took {main_import:.2f}s (budget {args.max_main_import_s:.2f}s)")
+    if eager:
+        failures.append(f"main imports backends eagerly: {', '.join(eager)}")
+    if first_window is None:
+        failures.append("window did not appear")
+    elif first_window > args.max_window_s:
+        failures.append(f"first window after {first_window:.2f}s (budget {args.max_window_s:.2f}s)")
+
+    if args.json:
+        report = {
+            "imports_s": imports,
+            "eager_backends": eager,
+            "first_window_s": first_window,
+            "first_window_runs_s": windows,
+            "failures": failures,
+        }
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from app_settings import SETTINGS_DIR
+
+TRACE_LOG_PATH = SETTINGS_DIR / "traces.jsonl"
+
+_CURRENT = threading.local()
+_WRITE_LOCK = threading.Lock()
+
+
+class Span:
+    def __init__(self, name: str, start_s: float, attrs: dict):
+        self.name = name
+        self.start_s = start_s
+        self.duration_s: float | None = None
+        self.attrs = attrs
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "start_s": round(self.start_s, 4),
+            "duration_s": None if self.duration_s is None else round(self.duration_s, 4),
+            "attrs": self.attrs,
+        }
+
+
+class _NullSpan:
+    def set(self, **attrs) -> None:
+        pass
+
+
+class Trace:
+    def __init__(self, name: str, listener=None, **attrs):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration_s: float | None = None
+        self.spans: list[Span] = []
+        self.error = ""
+        self._listener = listener
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def _notify(self) -> None:
+        if self._listener is not None:
+            try:
+                self._listener(self)
+            except Exception:
+                pass
+
+    def open_span(self, name: str, **attrs) -> Span:
+        span = Span(name, self.elapsed(), attrs)
+        with self._lock:
+            self.spans.append(span)
+        self._notify()
+        return span
+
+    def close_span(self, span: Span) -> None:
+        span.duration_s = self.elapsed() - span.start_s
+        self._notify()
+
+    def record_span(self, name: str, duration_s: float, **attrs) -> Span:
+        # For work timed elsewhere, e.g. inside a worker process.
+        span = Span(name, max(0.0, self.elapsed() - duration_s), attrs)
+        span.duration_s = duration_s
+        with self._lock:
+            self.spans.append(span)
+        self._notify()
+        return span
+
+    def current_stage(self) -> str:
+        # The innermost span still running, e.g. "code_generation".
+        with self._lock:
+            running = [span.name for span in self.spans if span.duration_s is None]
+        return running[-1] if running else ""
+
+    def breakdown(self) -> str:
+        with self._lock:
+            spans = list(self.spans)
+        parts = []
+        for span in spans:
+            if span.duration_s is None:
+                parts.append(f"{span.name}...")
+                continue
+            text = f"{span.name} {span.duration_s:.1f}s"
+            rates = []
+            tokens_per_s = span.attrs.get("tokens_per_s")
+            if tokens_per_s:
+                rates.append(f"{tokens_per_s:.1f} tok/s")
+            if span.attrs.get("images_per_s"):
+                rates.append(f"{span.attrs['images_per_s']:.2f} img/s")
+            if "acceptance_rate" in span.attrs:
+                rates.append(f"{span.attrs['acceptance_rate']:.0%} drafts accepted")
+            if "n_ctx" in span.attrs:
+                rates.append(f"n_ctx {span.attrs['n_ctx']}")
+                if "kv_mb" in span.attrs:
+                    rates.append(f"KV {span.attrs['kv_mb']:.0f} MB")
+                if span.attrs.get("trimmed"):
+                    rates.append(f"trimmed {', '.join(span.attrs['trimmed'])}")
+            if rates:
+                text += f" ({', '.join(rates)})"
+            parts.append(text)
+        return " | ".join(parts)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "duration_s": None if self.duration_s is None else round(self.duration_s, 4),
+            "attrs": self.attrs,
+            "error": self.error,
+            "spans": spans,
+        }
+
+
+def current_trace() -> Trace | None:
+    return getattr(_CURRENT, "trace", None)
+
+
+@contextmanager
+def use_trace(trace: Trace | None):
+    # Makes an existing trace current in another thread.
+    previous = current_trace()
+    _CURRENT.trace = trace
+    try:
+        yield trace
+    finally:
+        _CURRENT.trace = previous
+
+
+@contextmanager
+def start_trace(name: str, listener=None, write_log: bool = True, **attrs):
+    trace = Trace(name, listener=listener, **attrs)
+    with use_trace(trace):
+        try:
+            yield trace
+        except Exception as exc:
+            trace.error = str(exc)
+            raise
+        finally:
+            trace.duration_s = trace.elapsed()
+            if write_log:
+                _append_trace(trace)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    trace = current_trace()
+    if trace is None:
+        yield _NullSpan()
+        return
+    opened = trace.open_span(name, **attrs)
+    try:
+        yield opened
+    except Exception as exc:
+        opened.set(error=str(exc))
+        raise
+    finally:
+        trace.close_span(opened)
+
+
+def record_span(name: str, duration_s: float, **attrs) -> None:
+    trace = current_trace()
+    if trace is not None:
+        trace.record_span(name, duration_s, **attrs)
+
+
+def token_rates(
+    span_obj, prompt_tokens: int, completion_tokens: int, total_s: float, first_token_s: float | None = None
+) -> None:
+    attrs = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+    if first_token_s is not None:
+        # Time to the first streamed token is dominated by prompt evaluation.
+        attrs["prompt_eval_s"] = round(first_token_s, 4)
+        decode_s = total_s - first_token_s
+        if completion_tokens > 1 and decode_s > 0:
+            attrs["tokens_per_s"] = round((completion_tokens - 1) / decode_s, 2)
+    elif completion_tokens and total_s > 0:
+        attrs["tokens_per_s"] = round(completion_tokens / total_s, 2)
+    span_obj.set(**attrs)
+
+
+def _append_trace(trace: Trace) -> None:
+    try:
+        SETTINGS_DIR.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(trace.to_dict())
+        with _WRITE_LOCK, TRACE_LOG_PATH.open("a", encoding="utf-8") as handle:
+            handle.write(line + "\n")
+    except OSError:
+        pass
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+
+from app_settings import SETTINGS_DIR
+from content_hash import file_digest
+from disk_cache import DiskCache
+
+VISION_CACHE_DIR = SETTINGS_DIR / "vision_cache"
+VISION_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+_CACHE = DiskCache(VISION_CACHE_DIR, suffix=".json", max_bytes=VISION_CACHE_MAX_BYTES)
+
+
+def summary_key(image_path: str, model_path: str, prompt: str) -> str:
+    stat = Path(model_path).stat()
+    digest = hashlib.sha256()
+    for part in (
+        file_digest(image_path),
+        str(Path(model_path).resolve()),
+        str(stat.st_mtime_ns),
+        str(stat.st_size),
+        prompt,
+    ):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def lookup_summary(key: str) -> str | None:
+    data = _CACHE.get_json(key)
+    if isinstance(data, dict) and isinstance(data.get("summary"), str):
+        return data["summary"]
+    return None
+
+
+def store_summary(key: str, image_path: str, summary: str) -> None:
+    try:
+        _CACHE.put_json(key, {"image": Path(image_path).name, "summary": summary})
+    except OSError:
+        pass
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from app_settings import SETTINGS_DIR, AppSettings, settings_data
+from content_hash import known_digest, remember_digest
+from photo_dedup import PhotoHash, known_photo_hash, remember_photo_hash
+from write_behind import get_writer
+
+WORKSPACES_DIR = SETTINGS_DIR / "workspaces"
+WORKSPACE_FILE = "workspace.json"
+WORKSPACE_VERSION = 1
+
+INPUT_KEYS = ("competition", "task_title", "tasks", "notes", "parts", "sensors", "constraints")
+# Settings that belong to this PC rather than to a project.
+MACHINE_SETTINGS = (
+    "openai_api_key",
+    "remember_api_key",
+    "workspace",
+    "model_pool_ram_mb",
+    "preload_models",
+    "cpu_profiles",
+)
+
+
+@dataclass
+class ImageRef:
+    # Recorded metadata of a photo. Opening a workspace never touches the
+    # files; a recorded digest is only trusted while mtime and size match.
+    path: str
+    mtime_ns: int = 0
+    size: int = 0
+    digest: str = ""
+    # Perceptual hash for near-duplicate grouping, same mtime/size rule.
+    phash: str = ""
+    blank: bool = False
+
+    @property
+    def name(self) -> str:
+        return Path(self.path).name
+
+    def refresh_digest(self) -> None:
+        # Picks up the digest a generation computed, without hashing again.
+        known = known_digest(self.path)
+        if known:
+            if known[:2] != (self.mtime_ns, self.size):
+                self.phash, self.blank = "", False
+            self.mtime_ns, self.size, self.digest = known
+
+    def refresh_phash(self) -> None:
+        known = known_photo_hash(self.path)
+        if not known:
+            return
+        mtime_ns, size, photo = known
+        if (mtime_ns, size) != (self.mtime_ns, self.size):
+            # The file changed; a digest recorded for the old bytes is stale.
+            self.digest = ""
+        self.mtime_ns, self.size = mtime_ns, size
+        self.phash, self.blank = photo.to_hex(), photo.blank
+
+    def seed_digest(self) -> None:
+        if self.digest and self.size:
+            remember_digest(self.path, self.mtime_ns, self.size, self.digest)
+        if self.phash and self.size:
+            remember_photo_hash(
+                self.path, self.mtime_ns, self.size, PhotoHash.from_hex(self.phash, self.blank)
+            )
+
+
+@dataclass
+class Workspace:
+    name: str
+    inputs: dict = field(default_factory=dict)
+    images: list[ImageRef] = field(default_factory=list)
+    outputs: dict = field(default_factory=dict)
+    # Inputs and photos of the last successful run, for edit mode.
+    last_payload: dict | None = None
+    last_image_paths: list[str] = field(default_factory=list)
+    settings: dict = field(default_factory=dict)
+
+    @property
+    def image_paths(self) -> list[str]:
+        return [image.path for image in self.images]
+
+    def seed_digests(self) -> None:
+        for image in self.images:
+            image.seed_digest()
+
+
+def _dir_name(name: str) -> str:
+    cleaned = re.sub(r"[^A-Za-z0-9._ -]+", "_", name).strip(" ._")
+    return cleaned or "default"
+
+
+def workspace_path(name: str) -> Path:
+    return WORKSPACES_DIR / _dir_name(name) / WORKSPACE_FILE
+
+
+def list_workspaces() -> list[str]:
+    # Directory names only; no workspace file is opened.
+    if not WORKSPACES_DIR.exists():
+        return []
+    return sorted(
+        path.name for path in WORKSPACES_DIR.iterdir() if (path / WORKSPACE_FILE).exists()
+    )
+
+
+def workspace_data(workspace: Workspace) -> dict:
+    return {
+        "version": WORKSPACE_VERSION,
+        "name": workspace.name,
+        "inputs": {key: workspace.inputs.get(key, "") for key in INPUT_KEYS},
+        "images": [asdict(image) for image in workspace.images],
+        "outputs": dict(workspace.outputs),
+        "last_payload": workspace.last_payload,
+        "last_image_paths": list(workspace.last_image_paths),
+        "settings": dict(workspace.settings),
+    }
+
+
+def _from_data(name: str, data: dict) -> Workspace:
+    images = []
+    for entry in data.get("images", []) or []:
+        if isinstance(entry, dict) and entry.get("path"):
+            fields = ("path", "mtime_ns", "size", "digest", "phash", "blank")
+            images.append(ImageRef(**{key: entry[key] for key in fields if key in entry}))
+    return Workspace(
+        name=name,
+        inputs={key: str(value) for key, value in (data.get("inputs") or {}).items()},
+        images=images,
+        outputs=data.get("outputs") or {},
+        last_payload=data.get("last_payload"),
+        last_image_paths=list(data.get("last_image_paths") or []),
+        settings=data.get("settings") or {},
+    )
+
+
+def load_workspace(name: str) -> Workspace:
+    path = workspace_path(name)
+    # A write that has not reached the disk yet is newer than the file.
+    data = get_writer().pending(path)
+    if data is None:
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = {}
+    if not isinstance(data, dict):
+        data = {}
+    return _from_data(_dir_name(name), data)
+
+
+def schedule_save_workspace(workspace: Workspace) -> None:
+    get_writer().schedule(workspace_path(workspace.name), workspace_data(workspace))
+
+
+def project_settings(settings: AppSettings) -> dict:
+    data = settings_data(settings)
+    for key in MACHINE_SETTINGS:
+        data.pop(key, None)
+    return data
+
+
+def apply_project_settings(settings: AppSettings, data: dict) -> None:
+    for key, value in data.items():
+        if key not in MACHINE_SETTINGS and hasattr(settings, key):
+            setattr(settings, key, value)
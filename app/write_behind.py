@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import threading
+from pathlib import Path
+
+FLUSH_DELAY_S = 0.5
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    # Readers see either the old file or the new one, never a half-written one.
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+# Coalesces JSON writes per file. schedule() only swaps in the latest data; a
+# background timer writes whatever is pending FLUSH_DELAY_S after the first
+# change, so a burst of keystrokes costs one write.
+class WriteBehind:
+    def __init__(self, delay_s: float = FLUSH_DELAY_S):
+        self.delay_s = delay_s
+        self._pending: dict[Path, object] = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+
+    def schedule(self, path: Path, data) -> None:
+        # data must not be mutated afterwards; it is serialized on the timer thread.
+        with self._lock:
+            self._pending[Path(path)] = data
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay_s, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def pending(self, path: Path):
+        with self._lock:
+            return self._pending.get(Path(path))
+
+    def flush(self) -> None:
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                timer, self._timer = self._timer, None
+            if timer is not None:
+                timer.cancel()
+            for path, data in pending.items():
+                try:
+                    atomic_write_text(path, json.dumps(data, indent=2))
+                except OSError:
+                    continue
+
+
+_WRITER = WriteBehind()
+atexit.register(_WRITER.flush)
+
+
+def get_writer() -> WriteBehind:
+    return _WRITER
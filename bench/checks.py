@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+# Sensors/Ports texts as teams write them -> the ports they list.
+PORT_FIELDS = {
+    "Ports: A = left drive, B = right drive, C = color sensor": {"A", "B", "C"},
+    "left motor A, right motor B, color sensor on port E": {"A", "B", "E"},
+    "Drive: A (left), B (right); Color sensor: port E": {"A", "B", "E"},
+    "Left motor A, right motor B, color sensor C, distance sensor D.": {"A", "B", "C", "D"},
+    "Motors on ports A-D": {"A", "B", "C", "D"},
+    "A: left motor\nB: right motor\nE: color sensor": {"A", "B", "E"},
+}
+
+DRIVE_CODE = (
+    "from pybricks.pupdevices import Motor, ColorSensor\n"
+    "from pybricks.parameters import Port\n"
+    "left = Motor(Port.A)\n"
+    "right = Motor(Port.B)\n"
+    "color = ColorSensor(Port.E)\n"
+)
+
+
+# Chatter models put around the JSON object, including brackets before it.
+STREAM_PREAMBLES = ("", "Sure (see [notes]) here:\n", "```json\n", "Done} ] here:\n")
+
+
+def check_stream_preamble() -> list[str]:
+    from json_stream import stream_fields
+
+    expected = {"code": "x = [1, 2]", "tutorial": "Step {1}"}
+    failures = []
+    for preamble in STREAM_PREAMBLES:
+        text = preamble + json.dumps(expected) + "\n```\nAnything else?"
+        for size in (1, 7, len(text)):
+            deltas = {"code": "", "tutorial": ""}
+
+            def on_delta(field, delta):
+                deltas[field] += delta
+
+            stream_fields((text[i : i + size] for i in range(0, len(text), size)), on_delta)
+            if deltas != expected:
+                failures.append(f"{preamble!r} in {size}-char chunks: streamed {deltas}")
+    return failures
+
+
+def check_port_fields() -> list[str]:
+    from pybricks_check import check_code, mentioned_ports
+
+    failures = []
+    for sensors, expected in PORT_FIELDS.items():
+        found = mentioned_ports(sensors)
+        if found != expected:
+            failures.append(f"{sensors!r}: read ports {sorted(found)}, expected {sorted(expected)}")
+        report = check_code(DRIVE_CODE, sensors)
+        if expected >= {"A", "B", "E"} and not report.clean:
+            failures.append(f"{sensors!r}: correct code reported as {report.problems}")
+    # A field that clearly lists ports still catches a port it does not name.
+    report = check_code(DRIVE_CODE, "Ports: A = left drive, B = right drive, C = color sensor")
+    if report.clean:
+        failures.append("Port.E missing from a listed field was not reported")
+    # Letters without the word "port" only give a warning, which never triggers a repair.
+    report = check_code(DRIVE_CODE, "Left motor A, right motor B, color sensor C")
+    if not report.clean or not report.warnings:
+        failures.append(f"free-form field: expected only a warning, got {report.problems}")
+    return failures
+
+
+CHECKS = (check_stream_preamble, check_port_fields)
+
+
+def main() -> int:
+    sys.path.insert(0, str(APP_DIR))
+    failed = 0
+    for check in CHECKS:
+        failures = check()
+        failed += bool(failures)
+        print(f"{check.__name__}: {'FAIL' if failures else 'ok'}")
+        for failure in failures:
+            print(f"  {failure}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
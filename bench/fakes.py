@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import json
+import sys
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeLlamaConfig:
+    load_time_s = 0.5
+    prompt_tokens_per_s = 400.0
+    tokens_per_s = 40.0
+    completion_tokens = 200
+    # Chatter before and after the JSON object when no grammar is given. The
+    # brackets check that streaming readers skip to the first "{".
+    leading_text = "Sure (see [notes]) here:\n"
+    trailing_tokens = 0
+    # Vision encoder time per image, and summary tokens decoded per image.
+    image_encode_s = 0.2
+    image_summary_tokens = 32
+    loads: list[tuple[float, bool]] = []
+
+
+def _fake_completion_text(tokens: int) -> str:
+    code_words = max(1, tokens // 2)
+    tutorial_words = max(1, tokens - code_words)
+    # A program that passes the Pybricks check, so runs are not followed by repairs.
+    header = "from pybricks.pupdevices import Motor\nfrom pybricks.parameters import Port\nmotor = Motor(Port.A)\n"
+    code = header + "\n".join(f"motor.run_angle(500, {index})" for index in range(code_words))
+    tutorial = " ".join(f"step{index}" for index in range(tutorial_words))
+    return json.dumps({"code": code, "tutorial": tutorial})
+
+
+def _split_tokens(text: str, count: int) -> list[str]:
+    size = max(1, len(text) // max(1, count))
+    return [text[index : index + size] for index in range(0, len(text), size)]
+
+
+class FakeLlama:
+    def __init__(self, model_path, n_ctx=512, chat_handler=None, **kwargs):
+        started = time.perf_counter()
+        self.model_path = model_path
+        self._n_ctx = n_ctx
+        self.chat_handler = chat_handler
+        self.kwargs = kwargs
+        self._input_ids: list[int] = []
+        # Tokenizer-only loads (the context planner) skip the weights.
+        if kwargs.get("vocab_only"):
+            return
+        time.sleep(FakeLlamaConfig.load_time_s)
+        FakeLlamaConfig.loads.append((time.perf_counter() - started, chat_handler is not None))
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False):
+        # Roughly one token per word; the value only has to be deterministic.
+        tokens = [len(word) for word in text.split()]
+        return [1] + tokens if add_bos else tokens
+
+    def reset(self):
+        self._input_ids = []
+
+    def eval(self, tokens):
+        time.sleep(len(tokens) / FakeLlamaConfig.prompt_tokens_per_s)
+        self._input_ids = list(self._input_ids) + list(tokens)
+
+    def save_state(self):
+        return {"input_ids": list(self._input_ids)}
+
+    def load_state(self, state):
+        self._input_ids = list(state["input_ids"])
+
+    def _prompt_eval(self, prompt: str):
+        tokens = self.tokenize(prompt.encode("utf-8"))
+        shared = 0
+        for left, right in zip(self._input_ids, tokens):
+            if left != right:
+                break
+            shared += 1
+        time.sleep((len(tokens) - shared) / FakeLlamaConfig.prompt_tokens_per_s)
+        self._input_ids = tokens
+        return len(tokens)
+
+    def create_completion(self, prompt, max_tokens=16, temperature=0.2, stream=False, **kwargs):
+        prompt_tokens = self._prompt_eval(prompt)
+        count = min(max_tokens, FakeLlamaConfig.completion_tokens)
+        pieces = _split_tokens(_fake_completion_text(count), count)
+        if kwargs.get("grammar") is None:
+            if FakeLlamaConfig.leading_text:
+                pieces.insert(0, FakeLlamaConfig.leading_text)
+            pieces += [" more"] * min(FakeLlamaConfig.trailing_tokens, max(0, max_tokens - len(pieces)))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces)}
+        delay = 1.0 / FakeLlamaConfig.tokens_per_s
+
+        if stream:
+            def _chunks():
+                for piece in pieces:
+                    time.sleep(delay)
+                    yield {"choices": [{"text": piece, "finish_reason": None}]}
+
+            return _chunks()
+
+        time.sleep(delay * len(pieces))
+        return {"choices": [{"text": "".join(pieces), "finish_reason": "stop"}], "usage": usage}
+
+    def create_chat_completion(self, messages, **kwargs):
+        images = sum(
+            part.get("type") == "image_url"
+            for message in messages
+            if isinstance(message.get("content"), list)
+            for part in message["content"]
+        )
+        text_messages = [
+            {**message, "content": [part for part in message["content"] if part.get("type") == "text"]}
+            if isinstance(message.get("content"), list)
+            else message
+            for message in messages
+        ]
+        self._prompt_eval(json.dumps(text_messages))
+        time.sleep(images * FakeLlamaConfig.image_encode_s)
+        time.sleep(max(1, images) * FakeLlamaConfig.image_summary_tokens / FakeLlamaConfig.tokens_per_s)
+        summary = "Field with two mission models."
+        if images > 1 or kwargs.get("response_format"):
+            photos = [{"photo": number, "summary": f"{summary} (photo {number})"} for number in range(1, images + 1)]
+            summary = json.dumps({"photos": photos})
+        return {"choices": [{"message": {"role": "assistant", "content": summary}}]}
+
+
+class FakeLlava15ChatHandler:
+    def __init__(self, clip_model_path, **kwargs):
+        self.clip_model_path = clip_model_path
+
+
+class FakePromptLookupDecoding:
+    # The fake Llama never calls its draft model; this only lets the
+    # prompt_lookup setting load.
+    def __init__(self, max_ngram_size: int = 2, num_pred_tokens: int = 10):
+        self.num_pred_tokens = num_pred_tokens
+
+
+class FakeLlamaGrammar:
+    def __init__(self, text: str):
+        self.text = text
+
+    @classmethod
+    def from_string(cls, grammar: str, verbose: bool = True):
+        return cls(grammar)
+
+
+def install_fake_llama_cpp() -> None:
+    module = types.ModuleType("llama_cpp")
+    module.Llama = FakeLlama
+    module.LlamaGrammar = FakeLlamaGrammar
+    llava = types.ModuleType("llama_cpp.llava_cpp")
+    llava.Llava15ChatHandler = FakeLlava15ChatHandler
+    module.llava_cpp = llava
+    speculative = types.ModuleType("llama_cpp.llama_speculative")
+    speculative.LlamaPromptLookupDecoding = FakePromptLookupDecoding
+    module.llama_speculative = speculative
+    sys.modules["llama_cpp"] = module
+    sys.modules["llama_cpp.llava_cpp"] = llava
+    sys.modules["llama_cpp.llama_speculative"] = speculative
+
+
+class FakeOpenAIConfig:
+    latency_s = 0.3
+    tokens_per_s = 80.0
+    completion_tokens = 200
+    # Chatter before the JSON object, as models without a schema add.
+    leading_text = "Sure (see [notes]) here:\n"
+    requests = 0
+    # Status codes returned (in order) before requests succeed, e.g. [429, 503].
+    fail_statuses: list[int] = []
+    connections = 0
+
+
+def _response_object(text: str, model: str, input_tokens: int, output_tokens: int) -> dict:
+    return {
+        "id": "resp_fake",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": "completed",
+        "output": [
+            {
+                "id": "msg_fake",
+                "type": "message",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }
+        ],
+        "parallel_tool_calls": False,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        },
+    }
+
+
+class _FakeResponsesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        FakeOpenAIConfig.connections += 1
+
+    def _send_error_status(self, status: int) -> None:
+        body = json.dumps({"error": {"message": f"fake {status}", "type": "fake_error"}}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/responses"):
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", "0"))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        FakeOpenAIConfig.requests += 1
+        if FakeOpenAIConfig.fail_statuses:
+            self._send_error_status(FakeOpenAIConfig.fail_statuses.pop(0))
+            return
+
+        time.sleep(FakeOpenAIConfig.latency_s)
+        count = min(int(request.get("max_output_tokens") or 10**6), FakeOpenAIConfig.completion_tokens)
+        text = FakeOpenAIConfig.leading_text + _fake_completion_text(count)
+        pieces = _split_tokens(text, count)
+        input_tokens = len(json.dumps(request.get("input", ""))) // 4
+        response = _response_object(text, request.get("model", "fake"), input_tokens, len(pieces))
+        delay = 1.0 / FakeOpenAIConfig.tokens_per_s
+
+        if not request.get("stream"):
+            time.sleep(delay * len(pieces))
+            body = json.dumps(response).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        sequence = 0
+
+        def send(event: dict):
+            nonlocal sequence
+            event["sequence_number"] = sequence
+            sequence += 1
+            data = f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            self.wfile.write(data.encode("utf-8"))
+            self.wfile.flush()
+
+        send({"type": "response.created", "response": {**response, "status": "in_progress", "output": []}})
+        for piece in pieces:
+            time.sleep(delay)
+            send(
+                {
+                    "type": "response.output_text.delta",
+                    "item_id": "msg_fake",
+                    "output_index": 0,
+                    "content_index": 0,
+                    "delta": piece,
+                    "logprobs": [],
+                }
+            )
+        send({"type": "response.completed", "response": response})
+        self.close_connection = True
+
+
+def start_fake_openai_server(host: str = "127.0.0.1", port: int = 0) -> tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer((host, port), _FakeResponsesHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
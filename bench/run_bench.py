@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import replace
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+APP_DIR = REPO_DIR / "app"
+
+MODES = ("local", "local_multi", "openai", "auto")
+STAGES = ("model_load", "prompt_build", "image_encoding", "image_analysis", "generation", "parse")
+
+PAYLOAD = {
+    "competition": "WRO",
+    "task_title": "Benchmark mission",
+    "tasks": "Push the blue block into the scoring zone, then return to base.",
+    "notes": "Table surface is slightly uneven near the start area.",
+    "parts": "Standard SPIKE Prime set.",
+    "sensors": "Left motor A, right motor B, color sensor C, distance sensor D.",
+    "constraints": "Robot must fit in 30x30 cm at start.",
+}
+
+
+class StageTimer:
+    def __init__(self):
+        self.totals = {stage: 0.0 for stage in STAGES}
+
+    def reset(self):
+        for stage in self.totals:
+            self.totals[stage] = 0.0
+
+    def wrap(self, module, name: str, stage: str):
+        original = getattr(module, name)
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.totals[stage] += time.perf_counter() - started
+
+        setattr(module, name, timed)
+
+
+def _git_commit() -> str:
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=REPO_DIR
+        )
+    except OSError:
+        return ""
+    return completed.stdout.strip()
+
+
+# A GGUF v3 header with no tensors and no metadata: enough for the backend
+# probe, and the fake Llama never reads the weights.
+FAKE_GGUF = b"GGUF" + struct.pack("<I", 3) + struct.pack("<QQ", 0, 0)
+
+
+def _make_fixtures(root: Path, image_count: int) -> dict:
+    models = {}
+    for name in ("single", "code", "tutorial", "vision"):
+        path = root / f"{name}.gguf"
+        path.write_bytes(FAKE_GGUF)
+        models[name] = str(path)
+    (root / "vision.mmproj.gguf").write_bytes(FAKE_GGUF)
+
+    images = []
+    for index in range(image_count):
+        path = root / f"photo{index}.jpg"
+        try:
+            from PIL import Image  # type: ignore
+
+            # Distinct noise per photo, so near-duplicate grouping and the
+            # blank-shot check keep every fixture.
+            noise = Image.effect_noise((64, 48), 64 + 16 * index).convert("RGB")
+            noise.resize((4032, 3024), Image.BICUBIC).save(path, quality=92)
+        except Exception:
+            path.write_bytes(os.urandom(3 * 1024 * 1024))
+        images.append(str(path))
+    return {"models": models, "images": images}
+
+
+def _settings_for(base, mode: str, fixtures: dict, base_url: str, image_mode: str = "per_image"):
+    models = fixtures["models"]
+    return replace(
+        base,
+        ai_mode=mode,
+        openai_api_key="bench",
+        openai_base_url=base_url,
+        local_model_path=models["single"],
+        local_code_model_path=models["code"],
+        local_tutorial_model_path=models["tutorial"],
+        local_image_model_path=models["vision"],
+        image_analysis_mode=image_mode,
+    )
+
+
+def _run_direct(settings, images: list[str]) -> tuple[float, float | None]:
+    from generation import generate
+
+    first_token = []
+    started = time.perf_counter()
+
+    def on_delta(field, text):
+        if not first_token:
+            first_token.append(time.perf_counter() - started)
+
+    result = generate(settings, dict(PAYLOAD), images, on_delta=on_delta)
+    elapsed = time.perf_counter() - started
+    # The fakes wrap their JSON in chatter. A streaming reader that loses the
+    # object sends no deltas, even when a later repair step fills in the code.
+    if not result.data.get("code"):
+        raise RuntimeError("no code in the output")
+    if settings.stream_output and not first_token:
+        raise RuntimeError("no streamed output before the result")
+    return elapsed, (first_token[0] if first_token else None)
+
+
+def _run_generate_thread(settings, images: list[str]) -> tuple[float, float | None]:
+    from PySide6.QtCore import QCoreApplication
+
+    from main import GenerateThread
+
+    app = QCoreApplication.instance() or QCoreApplication([])
+    outcome = {}
+    thread = GenerateThread(settings, dict(PAYLOAD), images)
+    thread.success.connect(lambda data: outcome.setdefault("data", data))
+    thread.failed.connect(lambda error: outcome.setdefault("error", error))
+
+    started = time.perf_counter()
+    thread.start()
+    while not outcome:
+        app.processEvents()
+        time.sleep(0.001)
+    thread.wait()
+    elapsed = time.perf_counter() - started
+    first_token_s = thread.first_token_s
+    thread.deleteLater()
+    app.processEvents()
+    if "error" in outcome:
+        raise RuntimeError(outcome["error"])
+    return elapsed, first_token_s
+
+
+def run(args) -> dict:
+    from fakes import FakeLlamaConfig, FakeOpenAIConfig, install_fake_llama_cpp, start_fake_openai_server
+
+    install_fake_llama_cpp()
+    FakeLlamaConfig.load_time_s = args.load_time
+    FakeLlamaConfig.tokens_per_s = args.tokens_per_s
+    FakeLlamaConfig.prompt_tokens_per_s = args.prompt_tokens_per_s
+    FakeLlamaConfig.completion_tokens = args.completion_tokens
+    FakeLlamaConfig.image_encode_s = args.image_encode
+    FakeOpenAIConfig.latency_s = args.openai_latency
+    FakeOpenAIConfig.tokens_per_s = args.openai_tokens_per_s
+    FakeOpenAIConfig.completion_tokens = args.completion_tokens
+    server, base_url = start_fake_openai_server()
+
+    import ai_local
+    import ai_local_multi
+    import ai_openai
+    import generation
+    from app_settings import AppSettings
+    from model_pool import get_pool
+
+    timer = StageTimer()
+    for module in (ai_local, ai_local_multi, ai_openai):
+        timer.wrap(module, "build_user_prompt", "prompt_build")
+    timer.wrap(ai_openai, "image_data_url", "image_encoding")
+    timer.wrap(ai_local_multi, "_image_summaries", "image_analysis")
+    timer.wrap(generation, "parse_model_output", "parse")
+    timer.wrap(ai_local_multi, "parse_model_output", "parse")
+
+    fixtures = _make_fixtures(Path(args.workdir), args.images)
+    base = AppSettings(
+        bypass_response_cache=True,
+        prefix_cache=args.prefix_cache,
+        stream_output=args.stream,
+        max_output_tokens=max(args.completion_tokens, 16),
+    )
+
+    drivers = [("generate", _run_direct)]
+    if args.gui:
+        try:
+            import PySide6  # noqa: F401
+
+            drivers.append(("GenerateThread", _run_generate_thread))
+        except Exception:
+            print("PySide6 not installed; skipping GenerateThread runs", file=sys.stderr)
+
+    results = []
+    for mode in args.modes:
+        settings = _settings_for(base, mode, fixtures, base_url, args.image_mode)
+        for driver_name, driver in drivers:
+            for repeat in range(args.repeat):
+                if repeat == 0:
+                    get_pool().clear()
+                timer.reset()
+                FakeLlamaConfig.loads.clear()
+                tracemalloc.start()
+                tracemalloc.reset_peak()
+                error = ""
+                try:
+                    total_s, first_token_s = driver(settings, fixtures["images"])
+                except Exception as exc:
+                    total_s, first_token_s = 0.0, None
+                    error = (str(exc).splitlines() or [type(exc).__name__])[0]
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                stages = dict(timer.totals)
+                stages["model_load"] = sum(seconds for seconds, _ in FakeLlamaConfig.loads)
+                # The vision model loads inside image analysis; count it only once.
+                vision_load = sum(seconds for seconds, vision in FakeLlamaConfig.loads if vision)
+                stages["image_analysis"] = max(0.0, stages["image_analysis"] - vision_load)
+                # Everything not attributed to another stage is token generation
+                # (prompt evaluation plus decoding, or the HTTP round trip).
+                accounted = sum(value for key, value in stages.items() if key != "generation")
+                stages["generation"] = max(0.0, total_s - accounted) if not error else 0.0
+                result = {
+                    "mode": mode,
+                    "driver": driver_name,
+                    "run": repeat,
+                    "cold": repeat == 0,
+                    "total_s": round(total_s, 4),
+                    "first_token_s": None if first_token_s is None else round(first_token_s, 4),
+                    "stages_s": {key: round(value, 4) for key, value in stages.items()},
+                    "peak_memory_mb": round(peak / (1024 * 1024), 2),
+                    # Photo analysis throughput, including the vision model load.
+                    "images_per_s": (
+                        round(len(fixtures["images"]) / timer.totals["image_analysis"], 3)
+                        if timer.totals["image_analysis"] > 0 and not error
+                        else None
+                    ),
+                    "error": error,
+                }
+                results.append(result)
+                _print_result(result)
+
+    server.shutdown()
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("output", "workdir")
+        },
+        "results": results,
+    }
+
+
+def _print_result(result: dict) -> None:
+    stages = " ".join(f"{key}={value:.3f}" for key, value in result["stages_s"].items())
+    first = "-" if result["first_token_s"] is None else f"{result['first_token_s']:.3f}"
+    status = f" ERROR {result['error']}" if result["error"] else ""
+    if result["images_per_s"]:
+        stages += f" images/s={result['images_per_s']:.2f}"
+    print(
+        f"{result['mode']:<12} {result['driver']:<15} run={result['run']} "
+        f"total={result['total_s']:.3f}s first={first}s peak={result['peak_memory_mb']}MB "
+        f"{stages}{status}"
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark every generation mode against fake backends.")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--repeat", type=int, default=2, help="Runs per mode; the first is cold")
+    parser.add_argument("--images", type=int, default=3)
+    parser.add_argument("--load-time", type=float, default=0.5, help="Fake model load seconds")
+    parser.add_argument("--tokens-per-s", type=float, default=40.0)
+    parser.add_argument("--prompt-tokens-per-s", type=float, default=400.0)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--openai-latency", type=float, default=0.3)
+    parser.add_argument("--openai-tokens-per-s", type=float, default=80.0)
+    parser.add_argument(
+        "--image-mode", choices=("per_image", "batched"), default="per_image", help="Local photo analysis"
+    )
+    parser.add_argument("--image-encode", type=float, default=0.2, help="Fake vision seconds per image")
+    parser.add_argument("--no-stream", dest="stream", action="store_false")
+    parser.add_argument("--prefix-cache", action="store_true")
+    parser.add_argument("--no-gui", dest="gui", action="store_false", help="Skip GenerateThread runs")
+    parser.add_argument("-o", "--output", type=Path, default=Path("bench_results.jsonl"))
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="legobench-") as workdir:
+        args.workdir = workdir
+        # Keep caches and settings written during the run out of the real profile.
+        os.environ["HOME"] = workdir
+        os.environ["USERPROFILE"] = workdir
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        sys.path[:0] = [str(APP_DIR), str(BENCH_DIR)]
+        report = run(args)
+
+    with args.output.open("a", encoding="utf-8") as handle:
+        handle.write(json.dumps(report) + "\n")
+    print(f"Appended results to {args.output}")
+    return 1 if any(result["error"] for result in report["results"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
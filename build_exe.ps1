@@ -9,9 +9,9 @@ if (-not (Test-Path $PythonExe)) {
 }
 
 & $PythonExe -m pip install --upgrade pip
-& $PythonExe -m pip install PySide6 openai
+& $PythonExe -m pip install PySide6 openai Pillow numpy
 if ($LASTEXITCODE -ne 0) {
-  Write-Host "Failed to install core requirements (PySide6/openai). Aborting." -ForegroundColor Red
+  Write-Host "Failed to install core requirements (PySide6/openai/Pillow/numpy). Aborting." -ForegroundColor Red
   exit 1
 }
 & $PythonExe -m pip install llama-cpp-python